@@ -0,0 +1,859 @@
+"""
+Benchmarks for the Rankmaniac map-reduce scripts.
+
+Each benchmark is a sub-command that runs the scripts in data/ as
+subprocesses on synthetic inputs of growing size, built by replicating
+one of the graphs in local_test_data/ with shifted node identifiers.
+
+Usage:
+    python benchmark.py accel [options]
+    python benchmark.py codec [options]
+    python benchmark.py cores [options]
+    python benchmark.py delta [options]
+    python benchmark.py fused [options]
+    python benchmark.py map [options]
+    python benchmark.py montecarlo [options]
+    python benchmark.py partition [options]
+    python benchmark.py reduce [options]
+    python benchmark.py skew [options]
+
+Special notes:
+    WARNING! Requires Python >= 2.6 on a Unix system.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+from __future__ import with_statement # for Python 2.5
+
+import sys, os
+import random
+import shutil
+import subprocess
+import multiprocessing
+import tempfile
+from optparse import OptionParser
+from time import time
+
+from hot_keys import detect_hot_keys
+from local_runner import LocalRankmaniac, get_key, skew
+from partition_graph import partition_graph
+
+try:
+    import numpy as np
+    import reorder_graph
+    import parallel_engine
+    import local_engine
+    import monte_carlo
+    from local_engine import CSRGraph
+except ImportError: # NumPy is not installed
+    np = None
+    reorder_graph = None
+    parallel_engine = None
+    local_engine = None
+    monte_carlo = None
+
+DefaultGraph = os.path.join('local_test_data', 'EmailEnron')
+DefaultScales = '1,10,100'
+
+def scale_graph(infile, factor, outfile):
+    """
+    Writes `factor` copies of the graph to `outfile`, shifting the node
+    identifiers of every copy so that the copies are disjoint. Returns
+    the number of nodes written.
+    """
+
+    with open(infile) as f:
+        lines = f.readlines()
+
+    ids = [int(line[len('NodeId:'):line.index('\t')]) for line in lines]
+    size = max(ids) + 1
+
+    with open(outfile, 'w') as out:
+        for copy in range(factor):
+            offset = copy * size
+            for line in lines:
+                head, rest = line.rstrip('\n').split('\t', 1)
+                fields = rest.split(',')
+                node = int(head[len('NodeId:'):]) + offset
+                neighbors = [str(int(x) + offset) for x in fields[2:]]
+                out.write('NodeId:%d\t%s\n'
+                          % (node, ','.join(fields[:2] + neighbors)))
+
+    return factor * len(lines)
+
+# Runs a command and reports its peak RSS on stderr. Forking from this
+# small process keeps the benchmark's own memory out of the measurement.
+RusageWrapper = ('import resource, subprocess, sys\n'
+                 'status = subprocess.call(sys.argv[1:])\n'
+                 'usage = resource.getrusage(resource.RUSAGE_CHILDREN)\n'
+                 'sys.stderr.write("%d\\n" % (usage.ru_maxrss))\n'
+                 'sys.exit(status)\n')
+
+def run_script(script, infile, outfile, env=None):
+    """
+    Runs a streaming script on a file and returns the wall-time (in
+    seconds) and the peak resident set size (in kilobytes) of the
+    subprocess. `env` adds environment variables for the script.
+    """
+
+    if env is not None:
+        env = dict(os.environ, **env)
+
+    command = [sys.executable, '-c', RusageWrapper, sys.executable, script]
+    with open(infile) as stdin:
+        with open(outfile, 'w') as stdout:
+            start = time()
+            proc = subprocess.Popen(command, stdin=stdin, stdout=stdout,
+                                    stderr=subprocess.PIPE, env=env)
+            errors = proc.communicate()[1].splitlines()
+            elapsed = time() - start
+
+    if proc.returncode != 0:
+        raise Exception('%s exited with status %d'
+                        % (script, proc.returncode))
+
+    return elapsed, int(errors[-1])
+
+def sort_records(infile, outfile):
+    """
+    Sorts streaming records by key, as the Hadoop shuffle does.
+    """
+
+    with open(infile) as f:
+        lines = f.readlines()
+    lines.sort(key=get_key)
+    with open(outfile, 'w') as f:
+        f.writelines(lines)
+
+def count_lines(filename):
+    """
+    Returns the number of lines (records) in a file.
+    """
+
+    count = 0
+    with open(filename) as f:
+        for line in f:
+            count += 1
+    return count
+
+def bench_reduce(options, tmpdir):
+    """
+    Measures the peak RSS and throughput of the pagerank reducer on the
+    sorted map output of graphs of growing size.
+    """
+
+    mapper = os.path.join(options.indir, 'pagerank_map.py')
+    reducer = options.script or os.path.join(options.indir,
+                                             'pagerank_reduce.py')
+
+    print('%10s %12s %10s %12s %12s'
+          % ('nodes', 'records', 'seconds', 'records/sec', 'peak RSS KB'))
+    for scale in options.scales:
+        graph = os.path.join(tmpdir, 'graph')
+        mapped = os.path.join(tmpdir, 'mapped')
+        shuffled = os.path.join(tmpdir, 'shuffled')
+        reduced = os.path.join(tmpdir, 'reduced')
+
+        nodes = scale_graph(options.graph, scale, graph)
+        run_script(mapper, graph, mapped)
+        sort_records(mapped, shuffled)
+        records = count_lines(shuffled)
+
+        elapsed, maxrss = run_script(reducer, shuffled, reduced)
+        print('%10d %12d %10.3f %12.0f %12d'
+              % (nodes, records, elapsed, records / elapsed, maxrss))
+
+def bench_codec(options, tmpdir):
+    """
+    Compares the text and binary record codecs (CODEC, see
+    data/pagerank_codec.py) on graphs of growing size. Each graph is
+    first run through one iteration in the codec, so that the input is
+    in it as well. Reports the bytes per edge of the node records and
+    of the map output (what is shuffled), and the time spent by the
+    mapper and the reducer with the number of records each parses per
+    second.
+    """
+
+    mapper = os.path.join(options.indir, 'pagerank_map.py')
+    reducer = os.path.join(options.indir, 'pagerank_reduce.py')
+
+    print('%10s %7s %10s %12s %8s %12s %8s %12s'
+          % ('nodes', 'codec', 'graph B/e', 'shuffle B/e', 'map s',
+             'map rec/s', 'reduce s', 'reduce rec/s'))
+    for scale in options.scales:
+        text = os.path.join(tmpdir, 'text')
+        graph = os.path.join(tmpdir, 'graph')
+        mapped = os.path.join(tmpdir, 'mapped')
+        shuffled = os.path.join(tmpdir, 'shuffled')
+        reduced = os.path.join(tmpdir, 'reduced')
+
+        nodes = scale_graph(options.graph, scale, text)
+        edges = 0
+        with open(text) as f:
+            for line in f:
+                edges += line.count(',') - 1
+
+        for codec in ('text', 'binary'):
+            env = {'CODEC': codec}
+            run_script(mapper, text, mapped, env)
+            sort_records(mapped, shuffled)
+            run_script(reducer, shuffled, graph, env)
+
+            map_time = run_script(mapper, graph, mapped, env)[0]
+            sort_records(mapped, shuffled)
+            reduce_time = run_script(reducer, shuffled, reduced, env)[0]
+
+            print('%10d %7s %10.2f %12.2f %8.3f %12.0f %8.3f %12.0f'
+                  % (nodes, codec,
+                     float(os.path.getsize(graph)) / edges,
+                     float(os.path.getsize(shuffled)) / edges,
+                     map_time, nodes / map_time, reduce_time,
+                     count_lines(shuffled) / reduce_time))
+
+def bench_map(options, tmpdir):
+    """
+    Measures the throughput (in input records per second) of the
+    pagerank mapper on graphs of growing size.
+    """
+
+    mapper = options.script or os.path.join(options.indir,
+                                            'pagerank_map.py')
+
+    print('%10s %12s %10s %12s %12s'
+          % ('nodes', 'out records', 'seconds', 'records/sec',
+             'peak RSS KB'))
+    for scale in options.scales:
+        graph = os.path.join(tmpdir, 'graph')
+        mapped = os.path.join(tmpdir, 'mapped')
+
+        nodes = scale_graph(options.graph, scale, graph)
+        elapsed, maxrss = run_script(mapper, graph, mapped)
+        print('%10d %12d %10.3f %12.0f %12d'
+              % (nodes, count_lines(mapped), elapsed, nodes / elapsed,
+                 maxrss))
+
+def read_top_k(outdir, k=20, places=None):
+    """
+    Returns the `k` highest-ranked nodes in the output of a step. If
+    `places` is set, the ranks are rounded to that many decimal places
+    first, so that equal ranks summed in another order still tie.
+    """
+
+    ranks = []
+    for filename in sorted(os.listdir(outdir)):
+        if not filename.startswith('part-'):
+            continue
+        with open(os.path.join(outdir, filename)) as f:
+            for line in f:
+                head, rest = line.split('\t', 1)
+                rank = float(rest.split(',', 1)[0])
+                if places is not None:
+                    rank = round(rank, places)
+                ranks.append((-rank, int(head[len('NodeId:'):])))
+
+    ranks.sort()
+    return [node for (rank, node) in ranks[:k]]
+
+def read_solution(filename):
+    """
+    Reads a solution file from sols/.
+    """
+
+    with open(filename) as f:
+        return [int(line) for line in f if line.strip()]
+
+def bench_fused(options, tmpdir):
+    """
+    Runs the block pagerank scripts with several iterations per step
+    and reports how many steps (and local iterations) it takes until
+    the top-20 matches the solution, and what those steps cost.
+    """
+
+    solution = options.solution or os.path.join(
+        'sols', os.path.basename(options.graph))
+    expected = read_solution(solution)
+
+    print('%6s %8s %8s %10s %12s'
+          % ('iters', 'steps', 'total', 'seconds', 'shuffled'))
+    for iters in options.iters:
+        r = LocalRankmaniac(options.indir, os.path.join(tmpdir, str(iters)))
+        r.set_infile(os.path.abspath(options.graph))
+        for i in range(options.steps):
+            r.do_iter('pagerank_block_map.py', 'pagerank_block_reduce.py',
+                      'process_map.py', 'process_reduce.py',
+                      num_pagerank_mappers=options.mappers,
+                      num_pagerank_reducers=options.reducers,
+                      cache_files=['pagerank_codec.py'],
+                      pagerank_combiner='pagerank_combine.py',
+                      iters_per_step=iters)
+        r.run()
+
+        # The first step after which the top-20 stays correct, among
+        # the steps run before the process step stopped the job
+        steps = len([t for t in r.timings if t['step'] == 'pagerank'])
+        stable = None
+        for i in range(steps):
+            outdir = os.path.join(tmpdir, str(iters), str(i), 'pagerank')
+            if read_top_k(outdir, len(expected)) != expected:
+                stable = None
+            elif stable is None:
+                stable = i + 1
+
+        if stable is None:
+            print('%6d %8s' % (iters, 'never'))
+            continue
+
+        timings = [t for t in r.timings if t['iter_no'] < stable]
+        seconds = sum([t['map'] + t['shuffle'] + t['reduce']
+                       for t in timings])
+        shuffled = sum([t['shuffle_bytes'] for t in timings])
+        print('%6d %8d %8d %10.3f %12d'
+              % (iters, stable, stable * iters, seconds, shuffled))
+
+def bench_delta(options, tmpdir):
+    """
+    Runs the pagerank scripts in delta mode for several values of
+    DELTA_EPSILON (where 0 means the ordinary scripts), each with and
+    without the static graph of schimmy mode ('+s'), and reports the
+    bytes shuffled by the pagerank step of every iteration, the saving
+    in total bytes over the run for the first epsilon (0 by default)
+    with the same schimmy setting, and whether the top-20 after the last
+    iteration matches the solution. Delta mode only cuts the rank
+    shares; the neighbour lists of every node are still shuffled unless
+    schimmy mode leaves them out.
+    """
+
+    solution = options.solution or os.path.join(
+        'sols', os.path.basename(options.graph))
+    expected = read_solution(solution)
+
+    # The static graph for the schimmy runs
+    parts = partition_graph(options.graph, options.reducers, tmpdir,
+                            'schimmy')
+    parts = [os.path.join(tmpdir, filename) for filename in parts]
+
+    runs = []
+    for epsilon in options.epsilons:
+        for schimmy in (False, True):
+            cmdenv = {}
+            cache_files = ['pagerank_codec.py']
+            name = '%g' % (epsilon)
+            if epsilon > 0:
+                cmdenv['DELTA_EPSILON'] = repr(epsilon)
+            if schimmy:
+                cmdenv['SCHIMMY_GRAPH'] = 'schimmy'
+                cache_files += parts
+                name += '+s'
+
+            outdir = os.path.join(tmpdir, name)
+            r = LocalRankmaniac(options.indir, outdir)
+            r.set_infile(os.path.abspath(options.graph))
+            for i in range(options.steps):
+                r.do_iter('pagerank_map.py', 'pagerank_reduce.py',
+                          'process_map.py', 'process_reduce.py',
+                          num_pagerank_mappers=options.mappers,
+                          num_pagerank_reducers=options.reducers,
+                          cache_files=cache_files,
+                          pagerank_combiner='pagerank_combine.py',
+                          cmdenv=cmdenv)
+            r.run()
+
+            # The process step may stop the run before the last iteration
+            shuffled = [t['shuffle_bytes'] for t in r.timings
+                        if t['step'] == 'pagerank']
+            last = os.path.join(outdir, str(len(shuffled) - 1), 'pagerank')
+            correct = read_top_k(last, len(expected)) == expected
+            runs.append((name, correct, shuffled, schimmy))
+
+    print('%6s%s' % ('iter', ''.join(['%12s' % (run[0]) for run in runs])))
+    for i in range(options.steps):
+        cells = []
+        for name, correct, shuffled, schimmy in runs:
+            if i < len(shuffled):
+                cells.append('%12d' % (shuffled[i]))
+            else:
+                cells.append('%12s' % ('-'))
+        print('%6d%s' % (i, ''.join(cells)))
+    print('%6s%s' % ('total', ''.join(['%12d' % (sum(run[2]))
+                                       for run in runs])))
+
+    # The saving over the baseline with the same schimmy setting
+    baselines = {}
+    for name, correct, shuffled, schimmy in runs:
+        baselines.setdefault(schimmy, sum(shuffled))
+    cells = []
+    for name, correct, shuffled, schimmy in runs:
+        saving = 1 - float(sum(shuffled)) / baselines[schimmy]
+        cells.append('%11.1f%%' % (100 * saving))
+    print('%6s%s' % ('saving', ''.join(cells)))
+    print('%6s%s' % ('top-20', ''.join(['%12s' % (run[1] and 'ok' or 'wrong')
+                                        for run in runs])))
+
+def read_node_map(filename):
+    """
+    Reads the mapping from renumbered to original node identifiers
+    written by reorder_graph.py.
+    """
+
+    mapping = {}
+    with open(filename) as f:
+        for line in f:
+            node, original = line.split()
+            mapping[int(node)] = int(original)
+    return mapping
+
+def bench_partition(options, tmpdir):
+    """
+    Runs the block pagerank scripts (one iteration per step) on the
+    graph as it is, with hash partitioning, and renumbered by each
+    method of reorder_graph.py, with range partitioning. Reports the
+    fraction of edges that cross partitions, the rank shares sent
+    across partitions and the bytes shuffled per step, and whether the
+    top-20 after the last step matches the solution.
+    """
+
+    if reorder_graph is None:
+        raise Exception('NumPy is required to reorder the graph')
+
+    solution = options.solution or os.path.join(
+        'sols', os.path.basename(options.graph))
+    expected = read_solution(solution)
+    graph = os.path.abspath(options.graph)
+
+    print('%-6s %8s %14s %12s %8s'
+          % ('method', 'cut', 'cross shares', 'shuffled', 'top-20'))
+    for method in ['hash'] + sorted(reorder_graph.Methods):
+        workdir = os.path.join(tmpdir, method)
+        os.makedirs(workdir)
+
+        infile = graph
+        partitioner = None
+        mapping = None
+        if method != 'hash':
+            infile = os.path.join(workdir, 'graph')
+            partitioner = os.path.join(workdir, 'partitions')
+            cut, hash_cut = reorder_graph.reorder_graph(
+                graph, infile, options.reducers, method, partitioner)
+            mapping = read_node_map(infile + '.map')
+
+        r = LocalRankmaniac(options.indir, workdir)
+        r.set_infile(infile)
+        for i in range(options.steps):
+            r.do_iter('pagerank_block_map.py', 'pagerank_block_reduce.py',
+                      'process_map.py', 'process_reduce.py',
+                      num_pagerank_mappers=options.mappers,
+                      num_pagerank_reducers=options.reducers,
+                      cache_files=['pagerank_codec.py'],
+                      pagerank_combiner='pagerank_combine.py',
+                      pagerank_partitioner=partitioner)
+        r.run()
+
+        timings = [t for t in r.timings if t['step'] == 'pagerank']
+        edges = sum([t['counters'].get(('Rankmaniac', 'Edges'), 0)
+                     for t in timings])
+        shares = sum([t['counters'].get(('Rankmaniac',
+                                         'CrossPartitionShares'), 0)
+                      for t in timings])
+        shuffled = sum([t['shuffle_bytes'] for t in timings])
+
+        last = os.path.join(workdir, str(len(timings) - 1), 'pagerank')
+        top = read_top_k(last, len(expected))
+        if mapping is not None:
+            top = [mapping[node] for node in top]
+
+        print('%-6s %7.1f%% %14d %12d %8s'
+              % (method, 100.0 * shares / max(edges, 1),
+                 shares // len(timings), shuffled // len(timings),
+                 top == expected and 'ok' or 'wrong'))
+
+def add_hub(infile, outfile, hub='0'):
+    """
+    Adds a link to the `hub` node from every other node, which makes
+    the hub a hot key with an in-degree of n - 1.
+    """
+
+    with open(infile) as f:
+        with open(outfile, 'w') as out:
+            for line in f:
+                head, rest = line.rstrip('\n').split('\t', 1)
+                if head[len('NodeId:'):] != hub:
+                    rest += ',' + hub
+                out.write(head + '\t' + rest + '\n')
+
+def write_ranges(infile, num_reducers, prefix):
+    """
+    Writes the split points that give every reducer about as many
+    nodes of the graph, in the order of the range partitioner, to
+    `<prefix>.txt`.
+    """
+
+    with open(infile) as f:
+        nodes = sorted([line[len('NodeId:'):line.index('\t')]
+                        for line in f])
+    with open(prefix + '.txt', 'w') as out:
+        for i in range(1, num_reducers):
+            out.write(nodes[i * len(nodes) // num_reducers] + '\n')
+
+def bench_skew(options, tmpdir):
+    """
+    Runs the pagerank scripts on replicated graphs with an added hub,
+    with hash and range partitioning, with and without the combiner and
+    with and without salting the hot keys, and reports the largest
+    number of records received by one pagerank reducer, the skew (that
+    number over the average), the time spent in the reduce phase per
+    step, and whether the top-20 after the last step matches the one
+    without salting.
+    """
+
+    steps = min(options.steps, 3)
+    ranges = os.path.join(tmpdir, 'ranges')
+
+    print('%10s %11s %9s %6s %12s %6s %10s %8s'
+          % ('nodes', 'partitioner', 'combiner', 'salted', 'max records',
+             'skew', 'reduce', 'top-20'))
+    for scale in options.scales:
+        scaled = os.path.join(tmpdir, 'scaled')
+        graph = os.path.join(tmpdir, 'graph')
+        nodes = scale_graph(options.graph, scale, scaled)
+        add_hub(scaled, graph)
+        detect_hot_keys(graph, os.path.join(tmpdir, 'hot_keys'))
+        write_ranges(graph, options.reducers, ranges)
+
+        for partitioner in (None, ranges):
+            for combiner in (None, 'pagerank_combine.py'):
+                expected = None
+                for salted in (False, True):
+                    cache_files = ['pagerank_codec.py']
+                    cmdenv = {}
+                    if salted:
+                        cache_files.append(os.path.join(tmpdir, 'hot_keys'))
+                        cmdenv['HOT_KEYS'] = 'hot_keys'
+
+                    outdir = os.path.join(tmpdir, 'out')
+                    r = LocalRankmaniac(options.indir, outdir)
+                    r.set_infile(graph)
+                    for i in range(steps):
+                        r.do_iter('pagerank_map.py', 'pagerank_reduce.py',
+                                  'process_map.py', 'process_reduce.py',
+                                  num_pagerank_mappers=options.mappers,
+                                  num_pagerank_reducers=options.reducers,
+                                  cache_files=cache_files,
+                                  pagerank_combiner=combiner,
+                                  cmdenv=cmdenv,
+                                  pagerank_partitioner=partitioner)
+                    r.run()
+
+                    timings = [t for t in r.timings
+                               if t['step'] == 'pagerank']
+                    most = max([max(t['reducer_records']) for t in timings])
+                    ratio = max([skew(t['reducer_records'])
+                                 for t in timings])
+                    seconds = sum([t['reduce'] for t in timings]) / \
+                              len(timings)
+
+                    # The process step completes the ranks of hot nodes
+                    last = os.path.join(outdir, str(len(timings) - 1),
+                                        'process')
+                    top = read_top_k(last, places=9)
+                    if expected is None:
+                        expected = top
+
+                    print('%10d %11s %9s %6s %12d %6.2f %10.3f %8s'
+                          % (nodes, partitioner and 'range' or 'hash',
+                             combiner and 'yes' or 'no',
+                             salted and 'yes' or 'no', most, ratio, seconds,
+                             top == expected and 'ok' or 'wrong'))
+
+def random_graph(num_nodes, degree, outfile, seed=0):
+    """
+    Writes a random directed graph with a power-law in-degree
+    distribution: every node links to `degree` nodes, each picked
+    uniformly at random or, as often, as the target of an earlier edge
+    (preferential attachment).
+    """
+
+    rng = random.Random(seed)
+    targets = []
+    with open(outfile, 'w') as out:
+        for node in range(num_nodes):
+            neighbors = set()
+            while len(neighbors) < min(degree, num_nodes - 1):
+                if targets and rng.random() < 0.5:
+                    neighbor = rng.choice(targets)
+                else:
+                    neighbor = rng.randrange(num_nodes)
+                if neighbor != node:
+                    neighbors.add(neighbor)
+            targets.extend(neighbors)
+            out.write('NodeId:%d\t1.0,0.0%s\n'
+                      % (node, ''.join([',%d' % (x)
+                                        for x in sorted(neighbors)])))
+
+# The iteration schemes compared by bench_accel(), as a label and the
+# method and the extrapolation of local_engine.pagerank()
+AccelModes = [
+    ('jacobi', 'jacobi', None),
+    ('aitken', 'jacobi', 'aitken'),
+    ('quadratic', 'jacobi', 'quadratic'),
+    ('gs', 'gauss-seidel', None),
+    ('gs+quadratic', 'gauss-seidel', 'quadratic'),
+]
+
+# The same for the scripts, as a label, the pagerank scripts and their
+# cmdenv
+AccelScripts = [
+    ('jacobi', 'pagerank_map.py', 'pagerank_reduce.py', {}),
+    ('aitken', 'pagerank_map.py', 'pagerank_reduce.py',
+     {'EXTRAPOLATE': 'aitken'}),
+    ('block', 'pagerank_block_map.py', 'pagerank_block_reduce.py', {}),
+    ('block gs', 'pagerank_block_map.py', 'pagerank_block_reduce.py',
+     {'SWEEP': 'gauss-seidel'}),
+]
+
+def bench_accel(options, tmpdir):
+    """
+    Reports the number of iterations until the top-20 stops changing
+    for every iteration scheme of the reference engine, on the bundled
+    graphs and on random power-law graphs of growing size, and the
+    number of steps until the top-20 of the scripts matches the
+    solution for every scheme they support, on the bundled graphs.
+    """
+
+    if local_engine is None:
+        raise Exception('NumPy is required to run the reference engine')
+
+    graphs = []
+    for name in sorted(os.listdir('local_test_data')):
+        graphs.append((name, os.path.join('local_test_data', name)))
+    for nodes in options.nodes:
+        filename = os.path.join(tmpdir, 'random%d' % (nodes))
+        random_graph(nodes, options.degree, filename)
+        graphs.append(('random%d' % (nodes), filename))
+
+    print('%-14s%s' % ('engine', ''.join(['%14s' % (mode[0])
+                                          for mode in AccelModes])))
+    for name, filename in graphs:
+        graph = CSRGraph.load(filename)
+        cells = []
+        for label, method, extrapolate in AccelModes:
+            stable, ranks, num_iter = local_engine.iterations_to_top_k(
+                graph, 20, tol=1e-10, method=method, extrapolate=extrapolate)
+            cells.append('%14d' % (stable))
+        print('%-14s%s' % (name, ''.join(cells)))
+
+    print('')
+    print('%-14s%s' % ('scripts', ''.join(['%14s' % (script[0])
+                                           for script in AccelScripts])))
+    for name, filename in graphs:
+        solution = os.path.join('sols', name)
+        if not os.path.isfile(solution):
+            continue
+        expected = read_solution(solution)
+
+        cells = []
+        for label, mapper, reducer, cmdenv in AccelScripts:
+            cmdenv = dict(cmdenv, DANGLING='self')
+            outdir = os.path.join(tmpdir, 'accel')
+            r = LocalRankmaniac(options.indir, outdir)
+            r.set_infile(os.path.abspath(filename))
+            for i in range(options.steps):
+                r.do_iter(mapper, reducer, 'process_map.py',
+                          'process_reduce.py',
+                          num_pagerank_mappers=options.mappers,
+                          num_pagerank_reducers=options.reducers,
+                          cache_files=['pagerank_codec.py'],
+                          cmdenv=cmdenv)
+            r.run()
+
+            # The first step after which the top-20 stays correct
+            steps = len([t for t in r.timings if t['step'] == 'pagerank'])
+            stable = None
+            for i in range(steps):
+                outdir = os.path.join(tmpdir, 'accel', str(i), 'pagerank')
+                if read_top_k(outdir, len(expected)) != expected:
+                    stable = None
+                elif stable is None:
+                    stable = i + 1
+            cells.append('%14s' % (stable or 'never'))
+            shutil.rmtree(os.path.join(tmpdir, 'accel'))
+        print('%-14s%s' % (name, ''.join(cells)))
+
+def bench_montecarlo(options, tmpdir):
+    """
+    Compares the Monte Carlo top-k (see monte_carlo.py) with power
+    iteration on the bundled graphs. For power iteration it reports the
+    iterations until the certificate of process_reduce.py holds; for
+    every number of walks per node the steps walked, the length of the
+    top-20 prefix that matches the solution, how much of the top-20 is
+    certain, the number of candidates, and the local power iterations
+    needed to refine the candidates with the number of nodes they
+    update (see monte_carlo.refine). The cost is in edges traversed (walk
+    steps, or iterations times edges) and seconds.
+    """
+
+    if monte_carlo is None:
+        raise Exception('NumPy is required to run the random walks')
+
+    def correct(nodes, expected):
+        count = 0
+        while count < len(expected) and count < len(nodes) and \
+              nodes[count] == expected[count]:
+            count += 1
+        return count
+
+    print('%-12s %8s %12s %8s %8s %8s %6s %8s %8s %8s'
+          % ('graph', 'walks', 'edges', 'seconds', 'correct', 'certain',
+             'cands', 'refine', 'updated', 'refined'))
+    for name in sorted(os.listdir('local_test_data')):
+        solution = os.path.join('sols', name)
+        if not os.path.isfile(solution):
+            continue
+        expected = read_solution(solution)
+        k = len(expected)
+        graph = CSRGraph.load(os.path.join('local_test_data', name))
+        everyone = np.arange(graph.num_nodes)
+
+        start = time()
+        ranks, num_iter, num_active = monte_carlo.refine(
+            graph, graph.ranks, everyone, k)
+        elapsed = time() - start
+        top = local_engine.top_k(graph, ranks, k)
+        print('%-12s %8s %12d %8.3f %8d %8s %6s %8d %8d %8s'
+              % (name, 'power', num_iter * graph.num_edges, elapsed,
+                 correct(top, expected), '-', '-', num_iter, num_active,
+                 top == expected and 'ok' or 'wrong'))
+
+        for walks in options.walks:
+            start = time()
+            estimates, num_steps = monte_carlo.random_walks(graph, walks)
+            mean, halfwidth = monte_carlo.confidence(estimates)
+            top, certain, candidates = monte_carlo.top_k_bounds(
+                mean, halfwidth, k)
+            elapsed = time() - start
+
+            ranks, num_iter, num_active = monte_carlo.refine(
+                graph, mean, candidates, k)
+            order = candidates[np.lexsort((candidates,
+                                           -ranks[candidates]))]
+            refined = monte_carlo.node_ids(graph, order[:k])
+            print('%-12s %8d %12d %8.3f %8d %8d %6d %8d %8d %8s'
+                  % (name, walks, num_steps, elapsed,
+                     correct(monte_carlo.node_ids(graph, top), expected),
+                     certain, len(candidates), num_iter, num_active,
+                     refined == expected and 'ok' or 'wrong'))
+
+def bench_cores(options, tmpdir):
+    """
+    Runs the multi-core engine (see parallel_engine.py) on replicated
+    graphs with a growing number of workers, and reports the time per
+    iteration, the throughput in edges per second and the speedup and
+    efficiency over one worker.
+    """
+
+    if parallel_engine is None:
+        raise Exception('NumPy is required to run the multi-core engine')
+
+    workers = options.workers
+    if workers is None:
+        workers = [1]
+        while workers[-1] * 2 <= multiprocessing.cpu_count():
+            workers.append(workers[-1] * 2)
+
+    print('%10s %7s %10s %14s %8s %10s'
+          % ('nodes', 'workers', 'iteration', 'edges/sec', 'speedup',
+             'efficiency'))
+    for scale in options.scales:
+        scaled = os.path.join(tmpdir, 'scaled')
+        scale_graph(options.graph, scale, scaled)
+        graph = CSRGraph.load(scaled)
+
+        base = None
+        for num_workers in workers:
+            engine = parallel_engine.ParallelEngine(graph, num_workers)
+            try:
+                start = time()
+                ranks, num_iter = engine.pagerank(tol=0,
+                                                  max_iter=options.steps)
+                elapsed = (time() - start) / num_iter
+            finally:
+                engine.close()
+
+            if base is None:
+                base = elapsed
+            print('%10d %7d %9.4fs %14.0f %7.2fx %9.0f%%'
+                  % (graph.num_nodes, num_workers, elapsed,
+                     graph.num_edges / elapsed, base / elapsed,
+                     100 * base / elapsed / num_workers))
+
+Commands = {
+    'accel': bench_accel,
+    'codec': bench_codec,
+    'cores': bench_cores,
+    'delta': bench_delta,
+    'fused': bench_fused,
+    'map': bench_map,
+    'montecarlo': bench_montecarlo,
+    'partition': bench_partition,
+    'reduce': bench_reduce,
+    'skew': bench_skew,
+}
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%%prog {%s} [options]'
+                                % ('|'.join(sorted(Commands))))
+    parser.add_option('-g', '--graph', default=DefaultGraph,
+                      help='graph to replicate [%default]')
+    parser.add_option('-s', '--scales', default=DefaultScales,
+                      help='comma-separated replication factors '
+                           '[%default]')
+    parser.add_option('-d', '--indir', default='data',
+                      help='directory containing the scripts [%default]')
+    parser.add_option('--script',
+                      help='script to benchmark instead of the one in '
+                           'the scripts directory')
+    parser.add_option('--solution',
+                      help='solution to compare against [sols/<graph>]')
+    parser.add_option('-m', '--mappers', type='int', default=4,
+                      help='number of pagerank mappers [%default]')
+    parser.add_option('-r', '--reducers', type='int', default=4,
+                      help='number of pagerank reducers [%default]')
+    parser.add_option('--steps', type='int', default=20,
+                      help='number of steps to run [%default]')
+    parser.add_option('--iters', default='1,2,4,8',
+                      help='comma-separated iterations per step '
+                           '[%default]')
+    parser.add_option('-e', '--epsilons', default='0,1e-6,1e-4',
+                      help='comma-separated values of DELTA_EPSILON, where '
+                           '0 disables delta mode [%default]')
+    parser.add_option('-R', '--walks', default='16,64,256,1024',
+                      help='comma-separated random walks per node '
+                           '[%default]')
+    parser.add_option('--nodes', default='10000,100000',
+                      help='comma-separated sizes of the random graphs '
+                           '[%default]')
+    parser.add_option('--degree', type='int', default=10,
+                      help='out-degree of the random graphs [%default]')
+    parser.add_option('-w', '--workers',
+                      help='comma-separated numbers of worker processes '
+                           '[powers of two up to the number of CPUs]')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1 or args[0] not in Commands:
+        parser.error('expected one of: %s' % (', '.join(sorted(Commands))))
+
+    options.scales = [int(x) for x in options.scales.split(',')]
+    options.iters = [int(x) for x in options.iters.split(',')]
+    options.epsilons = [float(x) for x in options.epsilons.split(',')]
+    options.nodes = [int(x) for x in options.nodes.split(',')]
+    options.walks = [int(x) for x in options.walks.split(',')]
+    if options.workers is not None:
+        options.workers = [int(x) for x in options.workers.split(',')]
+
+    tmpdir = tempfile.mkdtemp(prefix='rankmaniac-bench-')
+    try:
+        Commands[args[0]](options, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,296 @@
+"""
+Compact on-disk binary CSR format for Rankmaniac input graphs.
+
+Re-parsing the comma-separated adjacency text is the most expensive
+part of reading a graph, so this module converts the text format
+
+    NodeId:<id>\t<current rank>,<previous rank>,<neighbor>,...
+
+once into a binary file that can be memory-mapped without copying.
+The file consists of a fixed header followed by the arrays
+
+    node_ids    int64[n]        the original identifier of each row
+    indptr      int64[n + 1]    the offsets of each row in `indices`
+    ranks       float64[n]      the current rank of each node
+    prev_ranks  float64[n]      the previous rank of each node
+    indices     int32[m]        the row index of every edge target
+
+all stored little-endian. Since the arrays are memory-mapped, graphs
+larger than RAM are paged in from disk as they are accessed.
+
+Special notes:
+    Requires NumPy.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import os
+import struct
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+
+Magic = 'RMCSR\x00\x01\x00'
+HeaderFormat = '<8sqq' # magic, number of nodes, number of edges
+HeaderSize = struct.calcsize(HeaderFormat)
+
+ChunkSize = 1 << 20 # number of edges or rows processed at a time
+
+def is_binary(filename):
+    """
+    Returns `True` if the file is a binary CSR graph, and `False`
+    otherwise.
+    """
+
+    f = open(filename, 'rb')
+    try:
+        return f.read(len(Magic)) == Magic
+    finally:
+        f.close()
+
+def _layout(n, m):
+    """
+    Returns the (name, dtype, offset, length) of every array in a file with
+    `n` nodes and `m` edges.
+    """
+
+    layout = []
+    offset = HeaderSize
+    for name, dtype, length in (('node_ids', '<i8', n),
+                                ('indptr', '<i8', n + 1),
+                                ('ranks', '<f8', n),
+                                ('prev_ranks', '<f8', n),
+                                ('indices', '<i4', m)):
+        layout.append((name, np.dtype(dtype), offset, length))
+        offset += np.dtype(dtype).itemsize * length
+    return layout
+
+def load(filename, mode='r'):
+    """
+    Memory-maps a binary CSR graph and returns a dictionary with the
+    arrays `node_ids`, `indptr`, `ranks`, `prev_ranks` and `indices`.
+
+    Keyword arguments:
+        mode        <str>       the mmap mode; use 'r+' to update the
+                                rank vectors in place.
+    """
+
+    f = open(filename, 'rb')
+    try:
+        magic, n, m = struct.unpack(HeaderFormat, f.read(HeaderSize))
+    finally:
+        f.close()
+
+    if magic != Magic:
+        raise ValueError('%s is not a binary CSR graph' % (filename))
+
+    arrays = {}
+    for name, dtype, offset, length in _layout(n, m):
+        if length == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode=mode,
+                                     offset=offset, shape=(length,))
+    return arrays
+
+def write(filename, node_ids, indptr, indices, ranks, prev_ranks=None):
+    """
+    Writes the arrays of an in-memory graph to a binary CSR file.
+    """
+
+    if prev_ranks is None:
+        prev_ranks = np.zeros(len(node_ids))
+
+    n = len(node_ids)
+    m = len(indices)
+    arrays = {'node_ids': node_ids, 'indptr': indptr, 'indices': indices,
+              'ranks': ranks, 'prev_ranks': prev_ranks}
+
+    f = open(filename, 'wb')
+    try:
+        f.write(struct.pack(HeaderFormat, Magic, n, m))
+        for name, dtype, offset, length in _layout(n, m):
+            np.asarray(arrays[name], dtype=dtype).tofile(f)
+    finally:
+        f.close()
+
+def convert(infile, outfile):
+    """
+    Converts a graph from the text input format to the binary CSR
+    format, and returns the number of nodes and edges.
+
+    Only O(n) memory is used: the edges are streamed to disk while the
+    text is read, and then renumbered in chunks. Nodes that only appear
+    as neighbors are appended as rows without out-links.
+    """
+
+    ids = []
+    ranks = []
+    prev_ranks = []
+    degrees = []
+
+    tmp = tempfile.TemporaryFile()
+    try:
+        chunks = []
+        pending = 0
+
+        f = open(infile)
+        try:
+            for line in f:
+                head, rest = line.split('\t', 1)
+                fields = rest.rstrip().split(',', 2)
+                ids.append(int(head[len('NodeId:'):]))
+                ranks.append(float(fields[0]))
+                prev_ranks.append(float(fields[1]))
+                if len(fields) > 2 and fields[2]:
+                    degrees.append(fields[2].count(',') + 1)
+                    chunks.append(fields[2])
+                    pending += degrees[-1]
+                else:
+                    degrees.append(0)
+
+                if pending >= ChunkSize:
+                    _write_targets(tmp, chunks)
+                    chunks = []
+                    pending = 0
+        finally:
+            f.close()
+
+        _write_targets(tmp, chunks)
+        tmp.flush()
+
+        ids = np.array(ids, dtype=np.int64)
+        m = int(np.sum(degrees, dtype=np.int64))
+        targets = np.zeros(0, dtype=np.int64)
+        if m > 0:
+            targets = np.memmap(tmp, dtype='<i8', mode='r', shape=(m,))
+
+        node_ids = _collect_node_ids(ids, targets)
+        n = len(node_ids)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:len(degrees) + 1])
+        indptr[len(degrees) + 1:] = indptr[len(degrees)]
+
+        all_ranks = np.ones(n)
+        all_ranks[:len(ids)] = ranks
+        all_prev_ranks = np.zeros(n)
+        all_prev_ranks[:len(ids)] = prev_ranks
+
+        out = open(outfile, 'wb')
+        try:
+            out.write(struct.pack(HeaderFormat, Magic, n, m))
+            node_ids.astype('<i8').tofile(out)
+            indptr.astype('<i8').tofile(out)
+            all_ranks.astype('<f8').tofile(out)
+            all_prev_ranks.astype('<f8').tofile(out)
+            _write_indices(out, node_ids, targets)
+        finally:
+            out.close()
+    finally:
+        tmp.close()
+
+    return n, m
+
+def _write_targets(f, chunks):
+    """
+    Appends the raw neighbor identifiers of a batch of rows.
+    """
+
+    if chunks:
+        targets = np.fromstring(','.join(chunks), dtype=np.int64, sep=',')
+        targets.astype('<i8').tofile(f)
+
+def _collect_node_ids(ids, targets):
+    """
+    Returns the identifiers of all rows: the nodes of the input file in
+    order, followed by the nodes that only appear as neighbors.
+    """
+
+    if len(ids) and np.array_equal(ids, np.arange(len(ids))):
+        # Dense identifiers; only larger neighbors can be missing
+        known = None
+    else:
+        known = np.unique(ids)
+
+    extra = np.zeros(0, dtype=np.int64)
+    for start in range(0, len(targets), ChunkSize):
+        chunk = np.unique(targets[start:start + ChunkSize])
+        if known is None:
+            chunk = chunk[(chunk < 0) | (chunk >= len(ids))]
+        elif len(known):
+            pos = np.searchsorted(known, chunk).clip(0, len(known) - 1)
+            chunk = chunk[known[pos] != chunk]
+        extra = np.union1d(extra, chunk)
+
+    return np.concatenate([ids, extra])
+
+def _write_indices(f, node_ids, targets):
+    """
+    Renumbers the raw neighbor identifiers to row indices in chunks and
+    appends them to the file.
+    """
+
+    n = len(node_ids)
+    dense = np.array_equal(node_ids, np.arange(n))
+    if not dense:
+        order = np.argsort(node_ids, kind='mergesort')
+        sorted_ids = node_ids[order]
+
+    for start in range(0, len(targets), ChunkSize):
+        chunk = np.asarray(targets[start:start + ChunkSize])
+        if not dense:
+            chunk = order[np.searchsorted(sorted_ids, chunk)]
+        chunk.astype('<i4').tofile(f)
+
+def iter_lines(filename, rows=ChunkSize // 16):
+    """
+    Yields the graph in the text input format, decoding `rows` rows at a
+    time so that only a few pages of the file are resident at once.
+    """
+
+    graph = load(filename)
+    node_ids = graph['node_ids']
+    indptr = graph['indptr']
+    indices = graph['indices']
+
+    for start in range(0, len(node_ids), rows):
+        stop = min(start + rows, len(node_ids))
+        offsets = np.asarray(indptr[start:stop + 1])
+        targets = node_ids[np.asarray(indices[offsets[0]:offsets[-1]])]
+        offsets = offsets - offsets[0]
+
+        lines = []
+        for i in range(stop - start):
+            row = start + i
+            neighbors = targets[offsets[i]:offsets[i + 1]]
+            lines.append('NodeId:%d\t%r,%r%s\n'
+                         % (node_ids[row], float(graph['ranks'][row]),
+                            float(graph['prev_ranks'][row]),
+                            ''.join([',%d' % (t) for t in neighbors])))
+        for line in lines:
+            yield line
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile outfile')
+    parser.add_option('-d', '--decode', action='store_true', default=False,
+                      help='convert a binary graph back to text')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error('expected an input and an output file')
+
+    if options.decode:
+        out = open(args[1], 'w')
+        try:
+            out.writelines(iter_lines(args[0]))
+        finally:
+            out.close()
+    else:
+        n, m = convert(args[0], args[1])
+        print('Wrote %d nodes and %d edges (%d bytes)'
+              % (n, m, os.path.getsize(args[1])))
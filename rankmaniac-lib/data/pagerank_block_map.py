@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import sys
+from pagerank_codec import parseNode, formatLinks, formatRank, \
+                           numReducers, partition, incrCounter, \
+                           danglingMode, reducerKeys, formatDangling, \
+                           DANGLING_KEY, Writer
+#
+# This program is the mapper for running several pagerank iterations in
+# one step (see pagerank_block_reduce.py). Like pagerank_map.py it emits
+# the links of every node, but it only emits rank shares along edges
+# that cross to another reducer's partition. The shares along the other
+# edges are computed by the reducer itself. The number of edges and of
+# shares emitted are reported as counters.
+#
+# With DANGLING=uniform the rank of the dangling nodes is sent to every
+# reducer as in pagerank_map.py; with DANGLING=self the reducer passes
+# it back itself.
+#
+
+out = Writer()
+reducers = numReducers()
+dangling = danglingMode()
+numNodes = 0
+danglingSum = 0.0
+partitions = {}
+numEdges = 0
+numShares = 0
+
+def getPartition(node):
+    part = partitions.get(node)
+    if part is None:
+        part = partitions[node] = partition(node, reducers)
+    return part
+
+for line in sys.stdin:
+    node, currRank, prevRank, neighbours = parseNode(line)
+
+    out.write(formatLinks(node, currRank, currRank, neighbours))
+
+    numNodes += 1
+    if not neighbours:
+        danglingSum += float(currRank)
+    else:
+        neighbours = neighbours.split(',')
+        numEdges += len(neighbours)
+        part = getPartition(node)
+        boundary = [neighbour for neighbour in neighbours
+                    if getPartition(neighbour) != part]
+        numShares += len(boundary)
+        if boundary:
+            share = '\t' + formatRank(float(currRank) / len(neighbours)) + \
+                    '\n'
+            out.write(share.join(boundary) + share)
+
+if dangling == 'uniform':
+    value = formatDangling(danglingSum, numNodes)
+    for key in reducerKeys(reducers, DANGLING_KEY):
+        out.write(key + '\t' + value + '\n')
+
+out.flush()
+
+incrCounter('Edges', numEdges)
+incrCounter('CrossPartitionShares', numShares)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import sys, os
+from pagerank_codec import ALPHA, parseRecord, isLinks, parseLinks, \
+                           parseRank, formatNode, numReducers, partition, \
+                           danglingMode, isDangling, parseDangling, Writer
+#
+# This program runs ITERS_PER_STEP pagerank iterations in one step. It
+# keeps the whole partition (block) of the graph it receives in memory,
+# and iterates over the edges inside the block, while the rank shares
+# along the edges coming from other blocks (as emitted by
+# pagerank_block_map.py) stay fixed for the step. The next step brings
+# the shares across blocks up to date.
+#
+# With SWEEP=gauss-seidel the ranks inside the block are updated in
+# place, one node at a time, so every node already uses the new ranks
+# of the nodes before it in the same sweep (Gauss-Seidel instead of
+# Jacobi iteration). This pays off even with one iteration per step.
+#
+# Dangling nodes are handled according to DANGLING (see
+# pagerank_codec.py). With 'self' the rank of a dangling node is passed
+# back to it in every iteration of the step. With 'uniform' the
+# dangling rank of every mapper arrives before the first node, and its
+# share is added to every node like the shares from other blocks, so it
+# too stays fixed for the step.
+#
+# Every node is written out with its rank from the start of the step as
+# its previous rank, so the process step sees the change over the whole
+# step.
+#
+
+iters = int(os.environ.get('ITERS_PER_STEP', '1'))
+sweep = os.environ.get('SWEEP', 'jacobi')
+if sweep not in ('jacobi', 'gauss-seidel'):
+    raise ValueError('unknown SWEEP %r' % (sweep))
+reducers = numReducers()
+dangling = danglingMode()
+
+danglingSum = 0.0
+numNodes = 0
+danglingShare = 0.0
+
+ranks = {}          # node -> rank at the start of the step
+links = {}          # node -> neighbours as a string
+external = {}       # node -> sum of the shares from other blocks
+order = []          # nodes in the order they arrived
+
+for line in sys.stdin:
+    node, value = parseRecord(line)
+
+    if isDangling(value):
+        # the totals of one mapper, which sort before every node
+        mass, count = parseDangling(value)
+        danglingSum += mass
+        numNodes += count
+        danglingShare = danglingSum / numNodes
+        continue
+
+    if node not in external:
+        order.append(node)
+        ranks[node] = 1.0   # for nodes that only appear as neighbours
+        links[node] = ''
+        external[node] = 0.0
+
+    if isLinks(value):
+        currRank, prevRank, links[node] = parseLinks(value)
+        ranks[node] = float(currRank)
+    else:
+        external[node] += parseRank(value)
+
+if order:
+    block = partition(order[0], reducers)
+
+    # the neighbours of each node that are inside the block (nodes that
+    # only appear as such neighbours are added to the end of the block)
+    internal = {}
+    for node in order:
+        inside = []
+        degree = 0
+        if links[node]:
+            neighbours = links[node].split(',')
+            degree = len(neighbours)
+            for neighbour in neighbours:
+                if partition(neighbour, reducers) == block:
+                    inside.append(neighbour)
+                    if neighbour not in external:
+                        order.append(neighbour)
+                        ranks[neighbour] = 1.0
+                        links[neighbour] = ''
+                        external[neighbour] = 0.0
+        internal[node] = (inside, degree)
+
+    for node in order:
+        external[node] += danglingShare
+    unlinked = set()
+    if dangling == 'self':
+        unlinked = set([node for node in order if not internal[node][1]])
+
+    startRanks = ranks
+    if sweep == 'gauss-seidel':
+        # the neighbours inside the block that link to each node
+        incoming = dict([(node, []) for node in order])
+        for node in order:
+            inside, degree = internal[node]
+            for neighbour in inside:
+                incoming[neighbour].append((node, degree))
+
+        ranks = ranks.copy()
+        for i in range(iters):
+            for node in order:
+                rankSum = external[node]
+                for source, degree in incoming[node]:
+                    rankSum += ranks[source] / degree
+                if node in unlinked:
+                    rankSum += ranks[node]
+                ranks[node] = (1 - ALPHA) + ALPHA * rankSum
+    else:
+        for i in range(iters):
+            sums = external.copy()
+            for node in order:
+                inside, degree = internal[node]
+                if inside:
+                    share = ranks[node] / degree
+                    for neighbour in inside:
+                        sums[neighbour] += share
+            for node in unlinked:
+                sums[node] += ranks[node]
+
+            ranks = {}
+            for node in order:
+                ranks[node] = (1 - ALPHA) + ALPHA * sums[node]
+
+    out = Writer()
+    for node in order:
+        out.write(formatNode(node, repr(ranks[node]), repr(startRanks[node]),
+                             links[node]))
+    out.flush()
@@ -0,0 +1,428 @@
+#
+# Shared record format for the pagerank map-reduce scripts.
+#
+# Input (and pagerank output) lines look like
+#
+#     NodeId:<node>\t<current rank>,<previous rank>,<neighbour>,...
+#
+# and the map output is keyed on the node with one of two values
+#
+#     <node>\tL<current rank>,<previous rank>,<neighbour>,...
+#     <node>\t<rank contribution>
+#
+# Everything is parsed with str.split() instead of regular expressions,
+# and the neighbours are passed along as a string without converting
+# them to integers.
+#
+# With CODEC=binary the ranks and neighbours of node and links records,
+# and the rank contributions, are written in a compact binary form
+# instead (see the binary codec below). The records are still lines
+# with a tab after the key, so Hadoop streaming handles them as usual,
+# and both forms are always accepted as input.
+#
+
+import sys, os
+import bisect
+import struct
+import binascii
+
+ALPHA = 0.85
+
+LINKS = 'L'     # prefix of the value holding a node's links
+NODE_ID = 'NodeId:'
+BATCH_SIZE = 8192   # output lines per writelines() call
+
+def parseNode(line):
+    # Returns (node, current rank, previous rank, neighbours) where the
+    # ranks and neighbours are left as strings
+    head, rest = line.rstrip('\n').split('\t', 1)
+    if rest[:1] == BINARY:
+        currRank, prevRank, neighbours = unpackRanks(rest)
+        return head[len(NODE_ID):], currRank, prevRank, neighbours
+    fields = rest.split(',', 2)
+    if len(fields) < 3:
+        fields.append('')
+    return head[len(NODE_ID):], fields[0], fields[1], fields[2]
+
+def parseValue(value):
+    # Returns (current rank, previous rank, neighbours) of the value of
+    # a node record
+    if value[:1] == BINARY:
+        return unpackRanks(value)
+    fields = value.split(',', 2)
+    if len(fields) < 3:
+        fields.append('')
+    return fields[0], fields[1], fields[2]
+
+def formatNode(node, currRank, prevRank, neighbours):
+    if binary:
+        return NODE_ID + node + '\t' + \
+               packRanks(currRank, prevRank, neighbours) + '\n'
+    if neighbours:
+        return NODE_ID + node + '\t' + currRank + ',' + prevRank + ',' + \
+               neighbours + '\n'
+    return NODE_ID + node + '\t' + currRank + ',' + prevRank + '\n'
+
+def formatLinks(node, currRank, prevRank, neighbours):
+    if binary:
+        return node + '\t' + LINKS + \
+               packRanks(currRank, prevRank, neighbours) + '\n'
+    if neighbours:
+        return node + '\t' + LINKS + currRank + ',' + prevRank + ',' + \
+               neighbours + '\n'
+    return node + '\t' + LINKS + currRank + ',' + prevRank + '\n'
+
+def parseRecord(line):
+    # Returns (node, value) of a map output record
+    node, value = line.rstrip('\n').split('\t', 1)
+    return node, value
+
+def isLinks(value):
+    return value[:1] == LINKS
+
+def parseLinks(value):
+    # Returns (current rank, previous rank, neighbours) of a links value
+    return parseValue(value[1:])
+
+def formatRank(rank):
+    # Returns the value of a rank contribution
+    if binary:
+        return BINARY + binascii.b2a_base64(struct.pack('<d', rank))[:11]
+    return repr(rank)
+
+def parseRank(value):
+    if value[:1] == BINARY:
+        return struct.unpack('<d', binascii.a2b_base64(value[1:] + '='))[0]
+    return float(value)
+
+#
+# Binary codec. A binary value is BINARY followed by the base64 (without
+# padding) of
+#
+#     <current rank> <previous rank> <width> <neighbours>
+#
+# where the ranks are little-endian doubles, and the neighbours are
+# integers, each stored as the zigzag varint of its difference to the
+# one before, in their original order. If the identifiers are padded
+# with zeros to a fixed width (see reorder_graph.py), <width> is that
+# width, and 0 otherwise. A rank contribution is just the double.
+#
+
+BINARY = '~'
+
+codec = os.environ.get('CODEC', 'text')
+if codec not in ('text', 'binary'):
+    raise ValueError('unknown CODEC %r' % (codec))
+binary = codec == 'binary'
+
+def packVarints(values):
+    # Returns the zigzag varints of the differences between the values
+    out = []
+    prev = 0
+    for value in values:
+        delta = value - prev
+        prev = value
+        if delta < 0:
+            z = -2 * delta - 1
+        else:
+            z = 2 * delta
+        while z >= 0x80:
+            out.append(chr((z & 0x7F) | 0x80))
+            z >>= 7
+        out.append(chr(z))
+    return ''.join(out)
+
+def unpackVarints(data):
+    # Returns the values encoded by packVarints()
+    values = []
+    prev = 0
+    z = 0
+    shift = 0
+    for c in data:
+        b = ord(c)
+        z |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        if z & 1:
+            prev -= (z + 1) >> 1
+        else:
+            prev += z >> 1
+        values.append(prev)
+        z = 0
+        shift = 0
+    return values
+
+def packRanks(currRank, prevRank, neighbours):
+    # Returns the binary value of a node or links record
+    width = 0
+    values = []
+    if neighbours:
+        values = [int(neighbour) for neighbour in neighbours.split(',')]
+        # look for an identifier with a leading zero
+        padded = ',' + neighbours + ','
+        i = padded.find(',0')
+        while i >= 0:
+            end = padded.index(',', i + 1)
+            if end - i > 2:
+                width = end - i - 1
+                break
+            i = padded.find(',0', end)
+    data = struct.pack('<ddB', float(currRank), float(prevRank), width) + \
+           packVarints(values)
+    return BINARY + binascii.b2a_base64(data).rstrip('=\n')
+
+def unpackRanks(value):
+    # Returns (current rank, previous rank, neighbours) as strings
+    data = value[1:]
+    data = binascii.a2b_base64(data + '=' * (-len(data) % 4))
+    currRank, prevRank, width = struct.unpack('<ddB', data[:17])
+    values = unpackVarints(data[17:])
+    if width:
+        neighbours = ','.join(['%0*d' % (width, x) for x in values])
+    else:
+        neighbours = ','.join(map(str, values))
+    return repr(currRank), repr(prevRank), neighbours
+
+class Writer:
+    # Buffers output lines and writes them in batches
+    def __init__(self, out=sys.stdout, size=BATCH_SIZE):
+        self.out = out
+        self.size = size
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.size:
+            self.flush()
+
+    def extend(self, lines):
+        self.lines.extend(lines)
+        if len(self.lines) >= self.size:
+            self.flush()
+
+    def flush(self):
+        self.out.writelines(self.lines)
+        self.lines = []
+
+def numReducers():
+    # Hadoop streaming exports the job configuration to the environment
+    for name in ('mapreduce_job_reduces', 'mapred_reduce_tasks'):
+        if name in os.environ:
+            return int(os.environ[name])
+    return 1
+
+def taskPartition():
+    # The partition (reducer number) of the current task
+    for name in ('mapreduce_task_partition', 'mapred_task_partition'):
+        if name in os.environ:
+            return int(os.environ[name])
+    return 0
+
+def rangeSplits():
+    # The split points of the range partitioner (see reorder_graph.py)
+    # named by RANGE_PARTITIONS, or None for hash partitioning
+    global splitPoints
+    if splitPoints is None:
+        splitPoints = []
+        filename = os.environ.get('RANGE_PARTITIONS')
+        if filename:
+            splitPoints = [line.rstrip('\n') for line in open(filename)]
+            if len(splitPoints) != numReducers() - 1:
+                raise ValueError('%s has %d split points for %d reducers'
+                                 % (filename, len(splitPoints),
+                                    numReducers()))
+    return splitPoints or None
+
+splitPoints = None
+
+def partition(node, numReducers):
+    # Same as the job's partitioner: Hadoop's TotalOrderPartitioner if
+    # RANGE_PARTITIONS is set, and its default HashPartitioner on a Text
+    # key otherwise
+    splits = rangeSplits()
+    if splits is not None:
+        return bisect.bisect_right(splits, node)
+    h = 1
+    for c in node:
+        h = (31 * h + ord(c)) & 0xFFFFFFFF
+    return (h & 0x7FFFFFFF) % numReducers
+
+def reducerKeys(numReducers, prefix='!'):
+    # Returns one key per reducer, each sent to that reducer and sorting
+    # before its nodes
+    splits = rangeSplits()
+    if splits is not None:
+        # each split point sorts before the nodes of its reducer
+        return [prefix] + splits
+    keys = [None] * numReducers
+    missing = numReducers
+    i = 0
+    while missing:
+        key = prefix + str(i)
+        part = partition(key, numReducers)
+        if keys[part] is None:
+            keys[part] = key
+            missing -= 1
+        i += 1
+    return keys
+
+#
+# Convergence statistics of the process step. Each process mapper sends
+# a summary of its nodes to every process reducer, under the keys
+# reducerKeys(numReducers, STATS_KEY), which sort before 'NodeId:' so
+# that the reducers see every summary before their first node.
+#
+
+STATS_KEY = '!'
+FINAL_RANK = 'FinalRank:'
+
+def formatFinalRank(rank, node):
+    return FINAL_RANK + repr(rank) + '\t' + node + '\n'
+
+#
+# Dangling nodes (nodes without out-links) are handled according to
+# DANGLING:
+#
+#   drop        (default) their rank is not passed on
+#   self        their rank is passed back to themselves
+#   uniform     their rank is spread evenly over all nodes
+#
+# For 'uniform', each mapper sends the dangling rank and the number of
+# nodes it has seen to every reducer, under the keys
+# reducerKeys(numReducers, DANGLING_KEY), which sort before all nodes.
+# The value is 'D<dangling rank>,<number of nodes>'.
+#
+
+DANGLING = 'D'
+DANGLING_KEY = '!'
+
+def danglingMode():
+    mode = os.environ.get('DANGLING', 'drop')
+    if mode not in ('drop', 'self', 'uniform'):
+        raise ValueError('unknown DANGLING mode %r' % (mode))
+    return mode
+
+def isDangling(value):
+    return value[:1] == DANGLING
+
+def formatDangling(rankSum, count):
+    return DANGLING + repr(rankSum) + ',' + str(count)
+
+def parseDangling(value):
+    rankSum, count = value[1:].split(',')
+    return float(rankSum), int(count)
+
+#
+# Aitken extrapolation. If EXTRAPOLATE is 'aitken', pagerank_reduce.py
+# replaces the new rank of every node by its Aitken extrapolation from
+# its last three ranks every EXTRAPOLATE_EVERY (at least 3) iterations.
+# The drivers export the number of the current step as ITERATION, and
+# the process step does not stop on an extrapolated iteration, since
+# the change in rank then says nothing about the distance to the limit.
+#
+
+def extrapolating():
+    # Returns True if the current iteration is extrapolated
+    mode = os.environ.get('EXTRAPOLATE')
+    if not mode:
+        return False
+    if mode != 'aitken':
+        raise ValueError('unknown EXTRAPOLATE mode %r' % (mode))
+    every = max(3, int(os.environ.get('EXTRAPOLATE_EVERY', '10')))
+    iteration = int(os.environ.get('ITERATION', '0'))
+    return (iteration + 1) % every == 0
+
+def aitken(x0, x1, x2):
+    # Extrapolates the limit of x0, x1, x2 if they converge
+    # geometrically, and returns x2 otherwise
+    d1 = x1 - x0
+    d2 = x2 - x1
+    if d1 == 0.0:
+        return x2
+    ratio = d2 / d1
+    if not 0.0 < ratio < 1.0:
+        return x2
+    return x2 + d2 * ratio / (1.0 - ratio)
+
+#
+# Hadoop streaming counters. A task increments a counter by writing
+# 'reporter:counter:<group>,<counter>,<amount>' to stderr. Counters are
+# integers, so ranks are counted in units of 1 / COUNTER_SCALE.
+#
+
+COUNTER_GROUP = 'Rankmaniac'
+COUNTER_SCALE = 1000000
+
+def incrCounter(name, amount):
+    sys.stderr.write('reporter:counter:%s,%s,%d\n'
+                     % (COUNTER_GROUP, name, amount))
+
+#
+# Schimmy mode. If SCHIMMY_GRAPH is set, the neighbours of the nodes
+# sent to reducer i are read from the cache file '<SCHIMMY_GRAPH>-0000i'
+# (see partition_graph.py), which holds '<node>\t<neighbours>' lines in
+# the same order as the reducer's input. The links records then carry
+# only the ranks, and the neighbour lists are not shuffled.
+#
+
+def schimmyGraph():
+    # Returns the static graph partition of the current task, or None
+    prefix = os.environ.get('SCHIMMY_GRAPH')
+    if not prefix:
+        return None
+    return open('%s-%05d' % (prefix, taskPartition()))
+
+#
+# Hot keys. Nodes with a very high in-degree would make the reducer that
+# owns them the straggler of every iteration, so HOT_KEYS names a file
+# of '<node>\t<salts>' lines (see hot_keys.py), and the rank shares sent
+# to those nodes are spread over the keys '<node>#0' ... '<node>#<salts
+# - 1>', which usually go to other reducers. Those reducers write out
+# partial sums as 'NodeId:<node>#<salt>\t<partial rank>' lines, and the
+# process step adds them to the rank of the node: its mappers send the
+# node and its partial sums to every process reducer along with the
+# convergence summaries, as 'H<node>,<value>' where the value is either
+# the node's own or 'P<partial rank>'.
+#
+# The range partitioner would send every salted key to the reducer of
+# the node itself, so with RANGE_PARTITIONS the keys are prefixed with
+# the key of another reducer instead, as '<reducer key>#<node>#<salt>':
+# salt i goes to the i-th reducer after the one of the node.
+#
+
+SALT = '#'
+HOT = 'H'
+PARTIAL = 'P'
+
+def hotKeys():
+    # Returns {node: number of salts} from HOT_KEYS, or {}
+    filename = os.environ.get('HOT_KEYS')
+    hot = {}
+    if filename:
+        for line in open(filename):
+            node, salts = line.split()
+            hot[node] = int(salts)
+    return hot
+
+def isSalted(node):
+    return SALT in node
+
+def saltedKey(node, salt, numReducers):
+    # Returns the key of one salt of a hot node
+    key = node + SALT + str(salt)
+    if rangeSplits() is None:
+        return key
+    routes = reducerKeys(numReducers)
+    route = routes[(partition(node, numReducers) + salt) % len(routes)]
+    return route + SALT + key
+
+def unsalt(node):
+    return node.split(SALT)[-2]
+
+def formatHot(node, value):
+    return HOT + node + ',' + value
+
+def parseHot(value):
+    # Returns (node, value)
+    return value[len(HOT):].split(',', 1)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import sys
+from pagerank_codec import parseRecord, isLinks, isDangling, \
+                           parseDangling, formatDangling, formatRank, \
+                           parseRank, Writer
+#
+# This program runs on the (sorted) output of each mapper and sums the
+# rank contributions to each node, so that only one contribution per
+# node and mapper is shuffled to the reducers. Links records are passed
+# through unchanged, and the output stays sorted by node. The dangling
+# totals sent to each reducer are summed as well.
+#
+
+out = Writer()
+
+def writeSum(node, rankSum, numNodes):
+    if numNodes is not None:
+        out.write(node + '\t' + formatDangling(rankSum, numNodes) + '\n')
+    elif rankSum is not None:
+        out.write(node + '\t' + formatRank(rankSum) + '\n')
+
+prevNode = None
+rankSum = None
+numNodes = None
+
+for line in sys.stdin:
+    currNode, value = parseRecord(line)
+
+    if currNode != prevNode:
+        # the previous node is complete, so write out its sum
+        writeSum(prevNode, rankSum, numNodes)
+        prevNode = currNode
+        rankSum = None
+        numNodes = None
+
+    if isLinks(value):
+        out.write(line)
+    elif isDangling(value):
+        danglingSum, count = parseDangling(value)
+        if numNodes is None:
+            rankSum, numNodes = danglingSum, count
+        else:
+            rankSum += danglingSum
+            numNodes += count
+    elif rankSum is None:
+        rankSum = parseRank(value)
+    else:
+        rankSum += parseRank(value)
+
+# flush the last node
+writeSum(prevNode, rankSum, numNodes)
+
+out.flush()
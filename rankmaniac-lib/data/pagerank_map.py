@@ -1,37 +1,108 @@
 #!/usr/bin/env python
 
-import sys
-import re
+import sys, os
+from pagerank_codec import ALPHA, COUNTER_SCALE, parseNode, formatLinks, \
+                           numReducers, danglingMode, reducerKeys, \
+                           formatDangling, formatRank, incrCounter, \
+                           hotKeys, saltedKey, DANGLING_KEY, Writer
 #
-# This program simply represents the identity function.
+# This program emits, for every node, its links (keyed on the node
+# itself) and an equal share of its current rank to each neighbour.
+# Nodes are handled one line at a time, so nothing is kept in memory.
 #
+# If DELTA_EPSILON is set, only the change in rank is sent instead, and
+# only by nodes whose rank has changed by more than DELTA_EPSILON since
+# they last sent it. The previous rank of a node then holds the rank it
+# has sent so far (0.0 before the first iteration), so a change that is
+# held back is sent once it has grown large enough. Delta mode only cuts
+# the rank shares: every node still sends its own record, neighbours
+# included, so pair it with SCHIMMY_GRAPH to shrink the shuffle (see
+# 'benchmark.py delta').
+#
+# The rank of nodes without neighbours is handled according to DANGLING
+# (see pagerank_codec.py). The number of nodes, the number of dangling
+# nodes and their rank are also reported as counters.
+#
+# If SCHIMMY_GRAPH is set, the reducers read the neighbours from a static
+# copy of the graph, so the links records leave them out.
+#
+# The shares sent to the nodes in HOT_KEYS are spread over their salted
+# keys in turn (see pagerank_codec.py).
+#
+
+epsilon = os.environ.get('DELTA_EPSILON')
+if epsilon is not None:
+    epsilon = float(epsilon)
+
+schimmy = bool(os.environ.get('SCHIMMY_GRAPH'))
+dangling = danglingMode()
+numNodes = 0
+numDangling = 0
+danglingRank = 0.0
+danglingSum = 0.0
 
-adj_dict = {}
-nodes = []
+hot = hotKeys()
+nextSalt = {}
+reducers = numReducers()
+
+def salted(neighbour):
+    salts = hot.get(neighbour)
+    if salts is None:
+        return neighbour
+    salt = nextSalt.get(neighbour, 0)
+    nextSalt[neighbour] = (salt + 1) % salts
+    return saltedKey(neighbour, salt, reducers)
+
+out = Writer()
 
-def stringToList(node_str):
-    return re.split('NodeId:|,|\t|\n', node_str)
-    
 for line in sys.stdin:
-    line = stringToList(line)
-    nodeID = int(line[1])
-    curr_rank = float(line[2])
-    prev_rank = float(line[3])
-    neighbours = [int(x) for x in line[4:-2]]
-    adj_dict[nodeID] = {'prev_rank': prev_rank, 'curr_rank': curr_rank, \
-                        'neighbours': neighbours}
-    nodes.append(nodeID)
-    
-for i in range(len(nodes)):
-    curr_node = nodes[i]
-    adj_dict[curr_node]['prev_rank']= adj_dict[curr_node]['curr_rank'] 
-    adj_dict[curr_node]['curr_rank'] = float(i)
-    sys.stdout.write(str(curr_node) + ':::' + str(adj_dict[curr_node]['prev_rank']) \
-                     + ':::' + str(adj_dict[curr_node]['curr_rank']) \
-                     + ':::' + str(adj_dict[curr_node]['neighbours']) +'\n')
-    
-
-    
-
-    
+    node, currRank, prevRank, neighbours = parseNode(line)
+    links = neighbours
+    if schimmy:
+        links = ''
+
+    if epsilon is None:
+        # the reducer makes the current rank the previous one (and may
+        # extrapolate from both)
+        change = float(currRank)
+        out.write(formatLinks(node, currRank, prevRank, links))
+    elif float(prevRank) == 0.0:
+        # nothing has been sent yet, so send the whole rank and start
+        # the sum over the incoming changes from the teleport term
+        change = float(currRank)
+        out.write(formatLinks(node, repr(1 - ALPHA), currRank, links))
+    else:
+        change = float(currRank) - float(prevRank)
+        if abs(change) > epsilon:
+            out.write(formatLinks(node, currRank, currRank, links))
+        else:
+            change = 0.0
+            out.write(formatLinks(node, currRank, prevRank, links))
+
+    numNodes += 1
+    if not neighbours:
+        numDangling += 1
+        danglingRank += float(currRank)
+        if dangling == 'self' and change:
+            out.write(node + '\t' + formatRank(change) + '\n')
+        elif dangling == 'uniform':
+            danglingSum += change
+    elif change:
+        # one "<neighbour>\t<share>" line per neighbour, built in one join
+        neighbours = neighbours.split(',')
+        if hot:
+            neighbours = [salted(neighbour) for neighbour in neighbours]
+        share = '\t' + formatRank(change / len(neighbours)) + '\n'
+        out.write(share.join(neighbours) + share)
+
+if dangling == 'uniform':
+    # every reducer needs the totals of every mapper
+    value = formatDangling(danglingSum, numNodes)
+    for key in reducerKeys(numReducers(), DANGLING_KEY):
+        out.write(key + '\t' + value + '\n')
+
+out.flush()
 
+incrCounter('Nodes', numNodes)
+incrCounter('DanglingNodes', numDangling)
+incrCounter('DanglingRank', int(round(danglingRank * COUNTER_SCALE)))
@@ -1,44 +1,142 @@
 #!/usr/bin/env python
 
-import sys
-import re
+import sys, os
+from pagerank_codec import ALPHA, parseRecord, isLinks, parseLinks, \
+                           isDangling, parseDangling, formatNode, \
+                           schimmyGraph, isSalted, extrapolating, aitken, \
+                           parseRank, NODE_ID, Writer
 #
-# This program simply represents the identity function.
+# This program sums the rank contributions of each node. The records for
+# a node arrive next to each other, so the node is written out as soon
+# as the key changes (and the last node at the end of the input). Only
+# the current node is kept in memory.
+#
+# If DELTA_EPSILON is set, the contributions are changes in rank (see
+# pagerank_map.py), which are added to the node's current rank.
+#
+# With DANGLING=uniform the dangling rank of every mapper arrives before
+# the first node, and an equal share of it is added to every node.
+#
+# If SCHIMMY_GRAPH is set, the neighbours come from this reducer's
+# partition of the static graph instead of the links records. Both are
+# sorted by node, so they are merged as the input is read.
+#
+# The salted keys of hot nodes only carry rank shares, whose (damped)
+# sum is written out for the process step to add to the node.
+#
+# On the iterations picked by EXTRAPOLATE (see pagerank_codec.py) the
+# new rank is extrapolated from the previous, current and new ranks.
+# This is not done in delta mode, where the previous rank is the rank
+# sent so far.
 #
 
-def stringToList(node_str):
-    return re.split(":::|\n|'", node_str)
+delta = 'DELTA_EPSILON' in os.environ
+extrapolate = not delta and extrapolating()
 
-results_dict = {}   
-prevNode = None 
-prevOldRank = None
-prevNewRank = None
-prevNeighbours = None
+out = Writer()
 
-for line in sys.stdin:
-    line = stringToList(line)
-    
-    currNode = int(line[0])
-    currOldRank = float(line[1])
-    currNewRank = float(line[2])
-    currNeighbours =line[3]
-    
-    if currNode == prevNode:
-        # perform reduce operation on node
-        prevNewRank += currNewRank
+danglingSum = 0.0
+numNodes = 0
+danglingShare = 0.0
+
+def writeNode(node, currRank, prevRank, rankSum, neighbours):
+    # Write the node back in the input format for the next iteration
+    if isSalted(node):
+        # a partial sum of a hot node, for the process step
+        out.write(NODE_ID + node + '\t' + repr(ALPHA * rankSum) + '\n')
+        return
+    rankSum += danglingShare
+    if currRank is None:
+        # the node only appears as a neighbour, so it has no links (and
+        # nothing to send in delta mode)
+        newRank = repr((1 - ALPHA) + ALPHA * rankSum)
+        if delta:
+            prevRank = newRank
+        else:
+            prevRank = '1.0'
+    elif delta:
+        newRank = repr(float(currRank) + ALPHA * rankSum)
+    else:
+        newRank = (1 - ALPHA) + ALPHA * rankSum
+        if extrapolate:
+            newRank = aitken(float(prevRank), float(currRank), newRank)
+        newRank = repr(newRank)
+        prevRank = currRank
+    out.write(formatNode(node, newRank, prevRank, neighbours))
+
+graph = schimmyGraph()
+graphNode = None
+graphLinks = ''
+
+def readGraph():
+    # Advance to the next node of the static graph
+    global graphNode, graphLinks
+    line = graph.readline()
+    if line:
+        graphNode, graphLinks = line.rstrip('\n').split('\t', 1)
     else:
-        # add previous node to our results dict
+        graphNode, graphLinks = None, ''
+
+def joinGraph(node):
+    # Write out the nodes of the static graph before `node` (which
+    # received nothing), and return the neighbours of `node`
+    while graphNode is not None and (node is None or graphNode < node):
+        writeNode(graphNode, None, None, 0.0, graphLinks)
+        readGraph()
+    if graphNode is None or graphNode != node:
+        return ''
+    neighbours = graphLinks
+    readGraph()
+    return neighbours
+
+if graph is not None:
+    readGraph()
+
+prevNode = None
+currRank = None
+prevRank = None
+rankSum = 0.0
+neighbours = ''
+
+for line in sys.stdin:
+    currNode, value = parseRecord(line)
+
+    if isDangling(value):
+        # the totals of one mapper, which sort before every node
+        mass, count = parseDangling(value)
+        danglingSum += mass
+        numNodes += count
+        danglingShare = danglingSum / numNodes
+        continue
+
+    if currNode != prevNode:
+        # the previous node is complete, so write it out
         if prevNode is not None:
-            results_dict[prevNode] = (prevOldRank, prevNewRank, prevNeighbours)
+            if graph is not None and not isSalted(prevNode):
+                neighbours = joinGraph(prevNode)
+            writeNode(prevNode, currRank, prevRank, rankSum, neighbours)
         # restart reduce process with new node
         prevNode = currNode
-        prevOldRank = currOldRank
-        prevNewRank = currNewRank
-        prevNeighbours = currNeighbours
+        currRank = None
+        prevRank = None
+        rankSum = 0.0
+        neighbours = ''
+
+    if isLinks(value):
+        # the node's own record carries its rank and links
+        currRank, prevRank, neighbours = parseLinks(value)
+    else:
+        # perform reduce operation on node
+        rankSum += parseRank(value)
 
-for node, (oldRank, newRank, neighbours) in results_dict.iteritems():
-    print node, oldRank, newRank, neighbours
-    sys.stdout.write(str(node) + ':::' + str(oldRank) + ':::' + \
-                     ':::' + str(newRank) + ':::' + str(neighbours) + '\n')    
+# flush the last node
+if prevNode is not None:
+    if graph is not None and not isSalted(prevNode):
+        neighbours = joinGraph(prevNode)
+    writeNode(prevNode, currRank, prevRank, rankSum, neighbours)
 
+if graph is not None:
+    # and the nodes of the static graph after it
+    joinGraph(None)
 
+out.flush()
@@ -1,20 +1,79 @@
 #!/usr/bin/env python
 
-import sys
-
+import sys, os
+import heapq
+from pagerank_codec import STATS_KEY, PARTIAL, NODE_ID, parseNode, \
+                           parseValue, numReducers, reducerKeys, hotKeys, \
+                           isSalted, unsalt, formatHot, Writer
+#
+# This program passes every node through unchanged, and summarizes the
+# nodes it has seen for the convergence check in process_reduce.py: the
+# number of nodes, the L1 change in rank since the previous iteration,
+# and the TOP_K + 1 highest current ranks and TOP_K highest previous
+# ranks.
 #
-# This program simply represents the identity function.
+# The hot nodes and the partial sums of their salted keys (see
+# pagerank_codec.py) are sent to process_reduce.py under HOT_KEY + node
+# instead, and left out of the summary until they have been added up.
 #
 
-stoppingCriterion = False
+topK = int(os.environ.get('TOP_K', '20'))
+
+hot = hotKeys()
+keys = reducerKeys(numReducers(), STATS_KEY)
+
+out = Writer()
+
+def writeStats(value):
+    for key in keys:
+        out.write(key + '\t' + value + '\n')
 
-def stringToList(node_str):
-    return re.split("\s|\n|'['|']'", node_str)
+count = 0
+residual = 0.0
+currTop = []    # min-heaps of (rank, node)
+prevTop = []
 
-rank_dict = {}      
 for line in sys.stdin:
-    sys.stdout.write(line)
-    
+    if hot:
+        head, value = line.split('\t', 1)
+        node = head[len(NODE_ID):]
+        if isSalted(node):
+            writeStats(formatHot(unsalt(node),
+                                 PARTIAL + value.rstrip('\n')))
+            continue
+        if node in hot:
+            count += 1
+            value = value.rstrip('\n')
+            currRank, prevRank, neighbours = parseValue(value)
+            ranks = currRank + ',' + prevRank
+            out.write(keys[0] + '\t' + formatHot(node, value) + '\n')
+            for key in keys[1:]:
+                out.write(key + '\t' + formatHot(node, ranks) + '\n')
+            continue
+
+    node, currRank, prevRank, neighbours = parseNode(line)
+    out.write(line)
+
+    currRank = float(currRank)
+    prevRank = float(prevRank)
+    count += 1
+    residual += abs(currRank - prevRank)
+
+    if len(currTop) <= topK:
+        heapq.heappush(currTop, (currRank, node))
+    elif currRank > currTop[0][0]:
+        heapq.heapreplace(currTop, (currRank, node))
+
+    if len(prevTop) < topK:
+        heapq.heappush(prevTop, (prevRank, node))
+    elif prevRank > prevTop[0][0]:
+        heapq.heapreplace(prevTop, (prevRank, node))
 
+writeStats('N' + str(count))
+writeStats('R' + repr(residual))
+for rank, node in currTop:
+    writeStats('C' + repr(rank) + ',' + node)
+for rank, node in prevTop:
+    writeStats('P' + repr(rank) + ',' + node)
 
-    
+out.flush()
@@ -1,11 +1,199 @@
 #!/usr/bin/env python
 
-import sys
-
+import sys, os
+import heapq
+from pagerank_codec import ALPHA, STATS_KEY, HOT, PARTIAL, parseRecord, \
+                           parseHot, parseValue, formatNode, formatFinalRank, \
+                           taskPartition, extrapolating, Writer
+#
+# This program decides whether pagerank has converged, using the
+# summaries from process_map.py (which arrive before any node). If it
+# has, the TOP_K nodes are written out as 'FinalRank' lines; otherwise
+# every node is passed through to the next iteration.
+#
+# The process step may have several reducers. Each of them receives
+# every summary and merges them into bounded heaps of the top ranks, so
+# they all reach the same decision; the residuals are added up in sorted
+# order so that the order in which the summaries arrive does not matter.
+# Only the first reducer writes the 'FinalRank' lines (the job checks
+# the first part of the output), and the others write nothing once
+# pagerank has converged.
+#
+# The stopping rule is chosen with STOP_RULE:
+#
+#   certificate     (default) The rank of every node is within
+#                   B = ALPHA / (1 - ALPHA) * residual of its limit,
+#                   where the residual is the L1 change since the
+#                   previous iteration. Stop once every gap between
+#                   consecutive ranks among the top TOP_K + 1 exceeds
+#                   2 * STOP_SLACK * B, so neither the top TOP_K nor
+#                   their order can still change. A STOP_SLACK below 1
+#                   trades certainty for fewer iterations.
+#
+#   stable          Stop once the top TOP_K (in order) is the same for
+#                   the current and previous ranks, and the residual per
+#                   node is below STOP_TOLERANCE.
+#
+# The certificate holds only if each step is one power iteration over
+# the whole graph, so the stable rule is used instead in delta mode
+# (DELTA_EPSILON, see pagerank_map.py), where the changes held back keep
+# the residual from reaching zero, and for the block scripts when they
+# run several iterations (ITERS_PER_STEP) or a Gauss-Seidel SWEEP in a
+# step (see pagerank_block_reduce.py).
 #
-# This program simply represents the identity function.
+# Neither rule stops on an iteration that was extrapolated (EXTRAPOLATE,
+# see pagerank_codec.py).
 #
+# The drivers export the number of steps of the job as MAX_ITER (and
+# the number of the current one as ITERATION). The last step always
+# writes the 'FinalRank' lines, whatever the stopping rule says, so a
+# job that runs out of steps still reports its best ranking.
+#
+# If the graph was renumbered (see reorder_graph.py and
+# preprocess_graph.py), NODE_MAP names the mapping file, and the
+# 'FinalRank' lines use the original identifiers.
+#
+# The hot nodes (see pagerank_codec.py) arrive with the summaries along
+# with the partial sums of their salted keys. Their ranks are completed
+# and added to the summary before the decision, and since there are only
+# a few of them they are held back until then (by the first reducer).
+#
+
+topK = int(os.environ.get('TOP_K', '20'))
+stopRule = os.environ.get('STOP_RULE', 'certificate')
+stopSlack = float(os.environ.get('STOP_SLACK', '1.0'))
+stopTolerance = float(os.environ.get('STOP_TOLERANCE', '1e-4'))
+maxIter = os.environ.get('MAX_ITER')
+lastIter = maxIter is not None and \
+           int(os.environ.get('ITERATION', '0')) >= int(maxIter) - 1
+certifiable = int(os.environ.get('ITERS_PER_STEP', '1')) == 1 and \
+              os.environ.get('SWEEP', 'jacobi') == 'jacobi' and \
+              'DELTA_EPSILON' not in os.environ
+
+def pushTop(heap, k, rank, node):
+    # Keep the k highest (rank, node) pairs in a min-heap
+    if len(heap) < k:
+        heapq.heappush(heap, (rank, node))
+    elif (rank, node) > heap[0]:
+        heapq.heapreplace(heap, (rank, node))
+
+def topNodes(heap):
+    # Returns the pairs of a heap, highest first
+    return sorted(heap, reverse=True)
+
+def originalNodes(nodes):
+    # Returns the original identifiers of the nodes from NODE_MAP
+    filename = os.environ.get('NODE_MAP')
+    if not filename:
+        return dict([(node, node) for node in nodes])
+    wanted = set(nodes)
+    original = {}
+    for line in open(filename):
+        node, orig = line.rstrip('\n').split('\t', 1)
+        if node in wanted:
+            original[node] = orig
+    return original
+
+def isConverged(count, residual, currTop, prevTop):
+    if count == 0:
+        return False
+    if lastIter:
+        return True
+    if extrapolating():
+        return False
+
+    if stopRule == 'stable' or not certifiable:
+        currNodes = [node for rank, node in currTop[:topK]]
+        prevNodes = [node for rank, node in prevTop[:topK]]
+        return currNodes == prevNodes and residual / count < stopTolerance
+
+    if stopRule != 'certificate':
+        raise ValueError('unknown STOP_RULE %r' % (stopRule))
+
+    bound = ALPHA / (1 - ALPHA) * residual
+    for i in range(len(currTop) - 1):
+        if currTop[i][0] - currTop[i + 1][0] <= 2 * stopSlack * bound:
+            return False
+    return True
+
+first = taskPartition() == 0
+
+out = Writer()
+
+count = 0
+residuals = []
+currTop = []    # min-heaps of (rank, node)
+prevTop = []
+converged = None
+
+hot = {}        # node: [value, partial sums]
+hotLines = []
+
+def addHot(node, value, partials):
+    # Complete the rank of a hot node and add it to the summary
+    if value is None:
+        # the node only appears as a neighbour
+        fields = [repr(1 - ALPHA), '1.0', '']
+    else:
+        fields = parseValue(value)
+    partials.sort()
+    currRank = float(fields[0]) + sum(partials)
+    prevRank = float(fields[1])
+    residuals.append(abs(currRank - prevRank))
+    pushTop(currTop, topK + 1, currRank, node)
+    pushTop(prevTop, topK, prevRank, node)
+    hotLines.append(formatNode(node, repr(currRank), fields[1], fields[2]))
+
+def decide():
+    # Every summary has been read, so decide once
+    global currTop, prevTop, converged
+    for node in sorted(hot):
+        addHot(node, hot[node][0], hot[node][1])
+    residuals.sort()
+    residual = sum(residuals)
+    currTop = topNodes(currTop)
+    prevTop = topNodes(prevTop)
+    converged = isConverged(count, residual, currTop, prevTop)
+    if not first:
+        return
+    if converged:
+        original = originalNodes([node for rank, node in currTop])
+        for rank, node in currTop[:topK]:
+            out.write(formatFinalRank(rank, original[node]))
+    else:
+        out.extend(hotLines)
 
 for line in sys.stdin:
-    sys.stdout.write(line)
+    key, value = parseRecord(line)
+
+    if key[:1] == STATS_KEY:
+        kind = value[0]
+        if kind == HOT:
+            node, value = parseHot(value)
+            record = hot.setdefault(node, [None, []])
+            if value[:1] == PARTIAL:
+                record[1].append(float(value[1:]))
+            else:
+                record[0] = value
+        elif kind == 'N':
+            count += int(value[1:])
+        elif kind == 'R':
+            residuals.append(float(value[1:]))
+        else:
+            rank, node = value[1:].split(',', 1)
+            if kind == 'C':
+                pushTop(currTop, topK + 1, float(rank), node)
+            else:
+                pushTop(prevTop, topK, float(rank), node)
+        continue
+
+    if converged is None:
+        decide()
+
+    if not converged:
+        out.write(line)
+
+if converged is None:
+    decide()
 
+out.flush()
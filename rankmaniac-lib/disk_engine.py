@@ -0,0 +1,281 @@
+"""
+Out-of-core reference pagerank engine for graphs larger than RAM.
+
+Like local_engine.py, but only the per-node arrays (ranks, out-degrees
+and the sums of every iteration) are held in memory. The edges are
+read from a binary CSR graph (see binary_graph.py), which is
+memory-mapped and streamed in blocks of a fixed number of edges; text
+inputs in the Rankmaniac format
+
+    NodeId:<id>\t<current rank>,<previous rank>,<neighbor>,...
+
+are first converted to a temporary binary graph, which also takes only
+O(n) memory. The blocks are processed by a pool of worker processes,
+which each map the graph and the rank shares of the current iteration
+and return the sums of their block for the nodes it links to. The
+engine reports the throughput in edges per second for every block size
+it is run with.
+
+Special notes:
+    Requires NumPy and Python >= 2.6.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+from time import time
+
+import numpy as np
+
+import binary_graph
+from local_engine import CSRGraph, DefaultAlpha, DefaultDangling, top_k, \
+                         read_solution
+
+DefaultBlockSizes = '65536,262144,1048576'
+
+# The arrays of the worker processes, set by _init_worker()
+_worker = {}
+
+def _init_worker(graph_file, share_file, num_nodes):
+    """
+    Maps the graph and the rank shares in a worker process.
+    """
+
+    arrays = binary_graph.load(graph_file)
+    _worker['indptr'] = arrays['indptr']
+    _worker['indices'] = arrays['indices']
+    _worker['share'] = np.memmap(share_file, dtype='<f8', mode='r',
+                                 shape=(num_nodes,))
+
+def _block_sums(block):
+    """
+    Returns the nodes linked to by the edges start ... stop - 1 and the
+    sum of the rank shares sent to each of them. Blocks with at least as
+    many edges as there are nodes return the sums of all nodes instead
+    (and None for the nodes), which saves sorting the targets.
+    """
+
+    start, stop = block
+    indptr = _worker['indptr']
+
+    # The rows holding the block, and how many of its edges each holds
+    first = int(np.searchsorted(indptr, start, side='right')) - 1
+    last = int(np.searchsorted(indptr, stop - 1, side='right')) - 1
+    offsets = np.clip(np.asarray(indptr[first:last + 2]), start, stop)
+    sources = np.repeat(np.arange(first, last + 1), np.diff(offsets))
+
+    share = _worker['share']
+    targets = np.asarray(_worker['indices'][start:stop])
+    if stop - start >= len(share):
+        return None, np.bincount(targets, weights=share[sources],
+                                 minlength=len(share))
+    nodes, inverse = np.unique(targets, return_inverse=True)
+    return nodes, np.bincount(inverse, weights=share[sources])
+
+class DiskEngine:
+    """
+    (engine class)
+
+    Runs pagerank over a graph on disk, streaming its edges in blocks
+    to a pool of worker processes. A text graph is converted to the
+    binary format once, and `block_size` can be changed between runs.
+    Call close() when done to stop the workers and remove the temporary
+    files.
+    """
+
+    def __init__(self, filename, block_size=1 << 20, workers=None):
+        """
+        (constructor)
+
+        Arguments:
+            filename      <str>     a graph in the binary CSR or the
+                                    text input format.
+
+        Keyword arguments:
+            block_size    <int>     the number of edges per block.
+
+            workers       <int>     the number of worker processes;
+                                    defaults to the number of CPUs, and
+                                    0 processes the blocks in this
+                                    process.
+        """
+
+        self._tmpdir = tempfile.mkdtemp(prefix='rankmaniac-disk-')
+        self._pool = None
+
+        if binary_graph.is_binary(filename):
+            self.filename = filename
+        else:
+            self.filename = os.path.join(self._tmpdir, 'graph.bin')
+            binary_graph.convert(filename, self.filename)
+
+        self.graph = CSRGraph.from_binary(self.filename)
+        self.degrees = np.asarray(self.graph.out_degrees())
+        self.block_size = block_size
+
+        n = self.graph.num_nodes
+        share_file = os.path.join(self._tmpdir, 'share')
+        self._share = np.memmap(share_file, dtype='<f8', mode='w+',
+                                shape=(max(n, 1),))
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers > 0:
+            self._pool = multiprocessing.Pool(workers, _init_worker,
+                                              (self.filename, share_file,
+                                               max(n, 1)))
+        else:
+            _init_worker(self.filename, share_file, max(n, 1))
+
+    def close(self):
+        """
+        Stops the workers and removes the temporary files.
+        """
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        self._share = None
+        self.graph = None
+        _worker.clear()
+        shutil.rmtree(self._tmpdir, True)
+
+    def blocks(self):
+        """
+        Returns the (start, stop) edge offsets of every block.
+        """
+
+        m = self.graph.num_edges
+        return [(start, min(start + self.block_size, m))
+                for start in range(0, m, self.block_size)]
+
+    def step(self, ranks, alpha=DefaultAlpha, dangling=DefaultDangling):
+        """
+        Performs a single damped power iteration and returns the new
+        ranks, with the same conventions as local_engine.step().
+        """
+
+        n = self.graph.num_nodes
+        linked = self.degrees > 0
+
+        share = np.zeros(n)
+        share[linked] = ranks[linked] / self.degrees[linked]
+        self._share[:n] = share
+        self._share.flush()
+
+        if self._pool is not None:
+            results = self._pool.imap_unordered(_block_sums, self.blocks())
+        else:
+            results = map(_block_sums, self.blocks())
+
+        sums = np.zeros(n)
+        for nodes, block_sums in results:
+            if nodes is None:
+                sums += block_sums[:n]
+            else:
+                sums[nodes] += block_sums
+
+        if dangling == 'self':
+            sums[~linked] += ranks[~linked]
+        elif dangling == 'uniform':
+            sums += ranks[~linked].sum() / n
+        elif dangling != 'drop':
+            raise ValueError('unknown dangling mode %r' % (dangling))
+
+        return (1 - alpha) + alpha * sums
+
+    def pagerank(self, alpha=DefaultAlpha, tol=1e-10, max_iter=1000,
+                 dangling=DefaultDangling, callback=None):
+        """
+        Runs power iteration like local_engine.pagerank(), and returns
+        the ranks and the number of iterations performed.
+        """
+
+        ranks = np.array(self.graph.ranks)
+        n = self.graph.num_nodes
+
+        for i in range(1, max_iter + 1):
+            new_ranks = self.step(ranks, alpha, dangling)
+            residual = np.abs(new_ranks - ranks).sum() / n
+            ranks = new_ranks
+
+            if callback is not None:
+                callback(i, ranks)
+            if residual < tol:
+                break
+
+        return ranks, i
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile',
+                          description='The input is either a text or a '
+                                      'binary CSR graph.')
+    parser.add_option('-k', type='int', default=20,
+                      help='number of top nodes to report [%default]')
+    parser.add_option('-a', '--alpha', type='float', default=DefaultAlpha,
+                      help='damping factor [%default]')
+    parser.add_option('-t', '--tol', type='float', default=1e-10,
+                      help='L1 convergence tolerance [%default]')
+    parser.add_option('-i', '--max-iter', type='int', default=1000,
+                      help='maximum number of iterations [%default]')
+    parser.add_option('-d', '--dangling', default=DefaultDangling,
+                      choices=('self', 'uniform', 'drop'),
+                      help='dangling node handling: self, uniform or '
+                           'drop [%default]')
+    parser.add_option('-b', '--block-sizes', default=DefaultBlockSizes,
+                      help='comma-separated numbers of edges per block, '
+                           'each run in turn [%default]')
+    parser.add_option('-w', '--workers', type='int',
+                      help='number of worker processes, or 0 for none '
+                           '[number of CPUs]')
+    parser.add_option('-c', '--check', metavar='SOLUTION',
+                      help='compare the top-k against a solution file')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected exactly one input file')
+
+    block_sizes = [int(x) for x in options.block_sizes.split(',')]
+
+    sys.stderr.write('%12s %8s %6s %10s %14s\n'
+                     % ('block size', 'blocks', 'iters', 'time',
+                        'edges/sec'))
+    # One engine for every block size, so the input is converted once
+    engine = DiskEngine(args[0], block_sizes[0], options.workers)
+    try:
+        for block_size in block_sizes:
+            engine.block_size = block_size
+            start = time()
+            ranks, num_iter = engine.pagerank(options.alpha, options.tol,
+                                              options.max_iter,
+                                              options.dangling)
+            elapsed = time() - start
+            nodes = top_k(engine.graph, ranks, options.k)
+            num_blocks = len(engine.blocks())
+            edges = engine.graph.num_edges * num_iter
+
+            sys.stderr.write('%12d %8d %6d %9.3fs %14.0f\n'
+                             % (block_size, num_blocks, num_iter, elapsed,
+                                edges / max(elapsed, 1e-9)))
+    finally:
+        engine.close()
+
+    for node in nodes:
+        sys.stdout.write('%d\n' % (node))
+
+    if options.check:
+        expected = read_solution(options.check)
+        if nodes == expected[:options.k]:
+            sys.stderr.write('matches %s\n' % (options.check))
+        else:
+            sys.stderr.write('DIFFERS from %s\n' % (options.check))
+            sys.exit(1)
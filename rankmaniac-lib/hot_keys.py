@@ -0,0 +1,127 @@
+"""
+Detects the hot keys of a Rankmaniac input graph for salting.
+
+Every rank share sent to a node is a record for the reducer that owns
+the node, so on graphs with a power-law degree distribution the
+reducer that owns the hubs receives far more records than the others
+and holds up every iteration. This tool computes the in-degree
+histogram of the graph and picks the nodes whose in-degree is more
+than `factor` times the average (and at least `min_degree`). Their
+rank shares are then spread over several salted keys by the pagerank
+scripts (see data/pagerank_codec.py), one salt for every `factor`
+times the average in-degree, up to `max_salts`.
+
+The hot keys are written as '<node>\t<salts>' lines to a file in
+data/, which is passed to the tasks as a cache file named by HOT_KEYS.
+
+Special notes:
+    WARNING! Requires Python >= 2.5
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+from __future__ import with_statement # for Python 2.5
+
+from optparse import OptionParser
+
+DefaultFactor = 20.0
+DefaultMinDegree = 100
+DefaultMaxSalts = 16
+
+def in_degrees(infile):
+    """
+    Returns the in-degree of every node with at least one in-link, and
+    the number of nodes in the input file.
+    """
+
+    degrees = {}
+    num_nodes = 0
+    with open(infile) as f:
+        for line in f:
+            num_nodes += 1
+            fields = line.rstrip('\n').split('\t', 1)[1].split(',', 2)
+            if len(fields) > 2 and fields[2]:
+                for node in fields[2].split(','):
+                    degrees[node] = degrees.get(node, 0) + 1
+    return degrees, num_nodes
+
+def histogram(degrees):
+    """
+    Returns the number of nodes with an in-degree in each power-of-two
+    bucket [2^i, 2^(i+1)), as a list of (2^i, count) pairs.
+    """
+
+    counts = {}
+    for degree in degrees.values():
+        bucket = 1
+        while bucket * 2 <= degree:
+            bucket *= 2
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return sorted(counts.items())
+
+def find_hot_keys(degrees, num_nodes, factor=DefaultFactor,
+                  min_degree=DefaultMinDegree, max_salts=DefaultMaxSalts):
+    """
+    Returns the hot keys as a dictionary of node to number of salts.
+    """
+
+    if not num_nodes:
+        return {}
+
+    average = float(sum(degrees.values())) / num_nodes
+    threshold = max(factor * average, min_degree)
+
+    hot = {}
+    for node, degree in degrees.items():
+        if degree >= threshold:
+            hot[node] = min(max_salts, int(degree // threshold) + 1)
+    return hot
+
+def write_hot_keys(filename, hot):
+    """
+    Writes the hot keys, hottest first.
+    """
+
+    with open(filename, 'w') as f:
+        for node, salts in sorted(hot.items(),
+                                  key=lambda item: (-item[1], item[0])):
+            f.write('%s\t%d\n' % (node, salts))
+
+def detect_hot_keys(infile, outfile, factor=DefaultFactor,
+                    min_degree=DefaultMinDegree, max_salts=DefaultMaxSalts):
+    """
+    Finds the hot keys of a graph and writes them to `outfile`. Returns
+    the hot keys as a dictionary of node to number of salts.
+    """
+
+    degrees, num_nodes = in_degrees(infile)
+    hot = find_hot_keys(degrees, num_nodes, factor, min_degree, max_salts)
+    write_hot_keys(outfile, hot)
+    return hot
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile outfile')
+    parser.add_option('-f', '--factor', type='float', default=DefaultFactor,
+                      help='hot if the in-degree is this many times the '
+                           'average [%default]')
+    parser.add_option('--min-degree', type='int', default=DefaultMinDegree,
+                      help='minimum in-degree of a hot key [%default]')
+    parser.add_option('--max-salts', type='int', default=DefaultMaxSalts,
+                      help='maximum number of salts per key [%default]')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error('expected an input and an output file')
+
+    degrees, num_nodes = in_degrees(args[0])
+    print('%10s %10s' % ('in-degree', 'nodes'))
+    for bucket, count in histogram(degrees):
+        print('%10d %10d' % (bucket, count))
+
+    hot = find_hot_keys(degrees, num_nodes, options.factor,
+                        options.min_degree, options.max_salts)
+    write_hot_keys(args[1], hot)
+    print('Wrote %d hot keys' % (len(hot)))
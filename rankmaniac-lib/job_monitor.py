@@ -0,0 +1,381 @@
+"""
+Shared, rate-limited monitor for many concurrent map-reduce jobs.
+
+Every Rankmaniac job used to poll describe_jobflow on its own, so
+running many teams or configurations at once trips the request limits
+of Amazon EMR. A JobMonitor watches any number of jobs from a single
+thread instead: every `interval` seconds it describes all of them with
+batched describe_jobflows calls (up to MaxJobsPerCall jobs each), and
+hands the descriptions to the waiting jobs. Every call first takes a
+token from the bucket of its AWS account, which is shared by all the
+monitors of that account, so the request rate stays below `rate`
+however many jobs are watched.
+
+Errors are written to stderr and the polling goes on. If no description
+arrives in time, or the thread has died, describe() asks Amazon EMR
+directly.
+
+Each watched job gets a JobWatch, which holds the latest description,
+calls the callbacks of the job when its state changes, and can be
+waited on until the job has finished.
+
+Special notes:
+    WARNING! Requires Python >= 2.5
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import sys
+import threading
+import traceback
+from time import sleep, time
+
+from boto.exception import EmrResponseError
+
+DefaultRate = 0.5       # requests per second
+DefaultBurst = 2        # requests
+DefaultInterval = 20.0  # seconds between polls
+ThrottleBackoff = 60.0  # seconds to wait after being throttled
+MaxJobsPerCall = 512    # job flows returned by describe_jobflows
+DescribeTimeout = 60.0  # seconds to wait for the monitor in describe()
+
+FinalStates = ('COMPLETED', 'FAILED', 'TERMINATED')
+
+class TokenBucket:
+    """
+    (limiter class)
+
+    Allows `rate` requests per second on average, and up to `burst`
+    requests at once.
+    """
+
+    def __init__(self, rate=DefaultRate, burst=DefaultBurst):
+        """
+        (constructor)
+
+        Keyword arguments:
+            rate          <float>   the number of tokens added per
+                                    second.
+
+            burst         <int>     the most tokens the bucket holds.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is available.
+        """
+
+        while True:
+            self._lock.acquire()
+            try:
+                now = time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            finally:
+                self._lock.release()
+            sleep(wait)
+
+    def penalize(self, seconds):
+        """
+        Empties the bucket and holds back new tokens for `seconds`, so
+        that no request is made while the account is being throttled.
+        """
+
+        self._lock.acquire()
+        try:
+            self._tokens = 0.0
+            self._last = max(self._last, time()) + seconds
+        finally:
+            self._lock.release()
+
+# One token bucket per AWS account (access key)
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def account_bucket(access_key, rate=DefaultRate, burst=DefaultBurst):
+    """
+    Returns the token bucket shared by every monitor of an account,
+    creating it with the given rate and burst on first use.
+    """
+
+    _buckets_lock.acquire()
+    try:
+        if access_key not in _buckets:
+            _buckets[access_key] = TokenBucket(rate, burst)
+        return _buckets[access_key]
+    finally:
+        _buckets_lock.release()
+
+class JobWatch:
+    """
+    (future class)
+
+    The state of a watched job, as last described by the monitor.
+    """
+
+    def __init__(self, job_id):
+        """
+        (constructor)
+
+        Arguments:
+            job_id        <str>     the job flow identifier.
+        """
+
+        self.job_id = job_id
+        self.jobflow = None
+        self._callbacks = []
+        self._described = threading.Event()
+        self._finished = threading.Event()
+
+    def add_callback(self, callback):
+        """
+        Calls `callback(jobflow)` from the monitor thread every time
+        the state of the job changes (and with the latest description
+        right away, if there is one).
+        """
+
+        self._callbacks.append(callback)
+        if self.jobflow is not None:
+            callback(self.jobflow)
+
+    def describe(self, timeout=None):
+        """
+        Returns the latest description of the job (a
+        boto.emr.emrobject.JobFlow object), waiting for the first one.
+        Returns None if there is none after `timeout` seconds.
+        """
+
+        self._described.wait(timeout)
+        return self.jobflow
+
+    def done(self):
+        """
+        Returns `True` if the job has completed, failed or been
+        terminated, and `False` otherwise.
+        """
+
+        return self._finished.isSet()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the job has finished and returns its final
+        description, or None if it has not after `timeout` seconds.
+        """
+
+        self._finished.wait(timeout)
+        if self.done():
+            return self.jobflow
+        return None
+
+    def _update(self, jobflow):
+        """
+        Stores a new description and calls the callbacks if the state
+        has changed.
+        """
+
+        changed = self.jobflow is None or self.jobflow.state != jobflow.state
+        self.jobflow = jobflow
+        self._described.set()
+        try:
+            if changed:
+                for callback in self._callbacks:
+                    callback(jobflow)
+        finally:
+            if jobflow.state in FinalStates:
+                self._finished.set()
+
+class JobMonitor:
+    """
+    (monitor class)
+
+    Polls the state of all the watched jobs of an account from a single
+    background thread. Call stop() when done.
+    """
+
+    def __init__(self, emr_conn, interval=DefaultInterval,
+                 rate=DefaultRate, burst=DefaultBurst):
+        """
+        (constructor)
+
+        Arguments:
+            emr_conn      <EmrConnection>   the connection to Amazon
+                                            EMR; the monitor is the only
+                                            one to use it, and only from
+                                            one thread at a time.
+
+        Keyword arguments:
+            interval      <float>   the number of seconds between polls.
+
+            rate          <float>   the average number of requests per
+                                    second allowed for the account.
+
+            burst         <int>     the number of requests allowed at
+                                    once for the account.
+        """
+
+        self._emr_conn = emr_conn
+        self.interval = interval
+        self.limiter = account_bucket(emr_conn.aws_access_key_id,
+                                      rate, burst)
+
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._conn_lock = threading.Lock() # boto connections are not
+                                           # thread-safe
+        self._stopped = threading.Event()
+        self._thread = None
+        self.error = None # the last error, as a formatted traceback
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        return False # do not swallow any exceptions
+
+    def watch(self, job_id, callback=None):
+        """
+        Starts watching a job, and returns its JobWatch. Watching a job
+        twice returns the same JobWatch.
+        """
+
+        self._lock.acquire()
+        try:
+            watch = self._watches.get(job_id)
+            if watch is None:
+                watch = self._watches[job_id] = JobWatch(job_id)
+            if self._thread is None or not self._thread.isAlive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+        if callback is not None:
+            watch.add_callback(callback)
+        return watch
+
+    def unwatch(self, job_id):
+        """
+        Stops watching a job.
+        """
+
+        self._lock.acquire()
+        try:
+            self._watches.pop(job_id, None)
+        finally:
+            self._lock.release()
+
+    def describe(self, job_id, timeout=DescribeTimeout):
+        """
+        Returns the latest description of a job, like
+        Rankmaniac.describe(), but without calling Amazon EMR. If there
+        is none after `timeout` seconds, or the polling thread is no
+        longer running, the job is described directly instead.
+        """
+
+        watch = self.watch(job_id)
+        if self._thread is not None and self._thread.isAlive():
+            jobflow = watch.describe(timeout)
+            if jobflow is not None:
+                return jobflow
+
+        self.limiter.acquire()
+        self._conn_lock.acquire()
+        try:
+            jobflow = self._emr_conn.describe_jobflow(job_id)
+        finally:
+            self._conn_lock.release()
+        self._deliver(watch, jobflow)
+        return jobflow
+
+    def stop(self):
+        """
+        Stops the polling thread.
+        """
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """
+        Describes every watched job that has not finished, in batches,
+        and updates their JobWatch. Returns the number of requests made.
+        """
+
+        self._lock.acquire()
+        try:
+            job_ids = sorted([job_id for job_id, watch
+                              in self._watches.items() if not watch.done()])
+        finally:
+            self._lock.release()
+
+        num_calls = 0
+        for i in range(0, len(job_ids), MaxJobsPerCall):
+            self.limiter.acquire()
+            num_calls += 1
+            self._conn_lock.acquire()
+            try:
+                jobflows = self._emr_conn.describe_jobflows(
+                    jobflow_ids=job_ids[i:i + MaxJobsPerCall])
+            except EmrResponseError:
+                self._log_error()
+                self.limiter.penalize(ThrottleBackoff)
+                continue
+            except Exception:
+                self._log_error()
+                continue
+            finally:
+                self._conn_lock.release()
+
+            for jobflow in jobflows:
+                watch = self._watches.get(jobflow.jobflowid)
+                if watch is not None:
+                    self._deliver(watch, jobflow)
+
+        return num_calls
+
+    def _deliver(self, watch, jobflow):
+        """
+        Updates a JobWatch, logging any error raised by its callbacks.
+        """
+
+        try:
+            watch._update(jobflow)
+        except Exception:
+            self._log_error()
+
+    def _log_error(self):
+        """
+        Keeps the error being handled and writes it to stderr.
+        """
+
+        self.error = traceback.format_exc()
+        sys.stderr.write('job_monitor: %s' % (self.error))
+
+    def _run(self):
+        """
+        Polls the watched jobs every `interval` seconds until stopped.
+        """
+
+        while not self._stopped.isSet():
+            try:
+                self.poll()
+            except Exception:
+                self._log_error()
+            self._stopped.wait(self.interval)
@@ -0,0 +1,505 @@
+"""
+Reference pagerank engine for checking submissions locally.
+
+Parses an input file in the Rankmaniac format
+
+    NodeId:<id>\t<current rank>,<previous rank>,<neighbor>,...
+
+into a sparse matrix in compressed sparse row (CSR) form and runs
+damped power iteration on it using vectorized sparse matrix-vector
+products. The resulting top-k nodes are reported in the same shape as
+the solutions in sols/, one node identifier per line.
+
+Special notes:
+    Requires NumPy.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import sys
+from optparse import OptionParser
+from time import time
+
+import numpy as np
+
+import binary_graph
+
+DefaultAlpha = 0.85
+DefaultDangling = 'self'
+DefaultExtrapolateEvery = 10
+DefaultBlocks = 64
+
+Methods = ('jacobi', 'gauss-seidel')
+
+# The number of iterates each extrapolation needs
+Extrapolations = {
+    None: 1,
+    'aitken': 3,
+    'quadratic': 4,
+}
+
+class CSRGraph:
+    """
+    (graph class)
+
+    A directed graph stored as a CSR adjacency matrix. Row i holds the
+    out-links of node i, using dense node indices 0 ... n - 1. The
+    original node identifiers are kept in `node_ids`.
+    """
+
+    def __init__(self, node_ids, indptr, indices, ranks=None):
+        """
+        (constructor)
+
+        Arguments:
+            node_ids      <array>   the original identifier of each
+                                    dense node index.
+
+            indptr        <array>   the offsets of each row in
+                                    `indices` (length n + 1).
+
+            indices       <array>   the dense index of the destination
+                                    of every edge.
+
+        Keyword arguments:
+            ranks         <array>   the initial rank of each node;
+                                    defaults to 1.0 for every node.
+        """
+
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+
+        if ranks is None:
+            ranks = np.ones(len(node_ids))
+        self.ranks = ranks
+
+        self._sources = None
+        self._in_links = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def out_degrees(self):
+        """
+        Returns the number of out-links of every node.
+        """
+
+        return np.diff(self.indptr)
+
+    def sources(self):
+        """
+        Returns the dense index of the source of every edge, which is
+        the row index expanded from `indptr`.
+        """
+
+        if self._sources is None:
+            self._sources = np.repeat(np.arange(self.num_nodes),
+                                      self.out_degrees())
+        return self._sources
+
+    def in_links(self):
+        """
+        Returns the (indptr, indices) of the graph stored by in-links:
+        row i lists the dense indices of the nodes linking to node i.
+        """
+
+        if self._in_links is None:
+            order = np.argsort(self.indices, kind='mergesort')
+            indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.num_nodes),
+                      out=indptr[1:])
+            self._in_links = (indptr, self.sources()[order])
+        return self._in_links
+
+    @classmethod
+    def from_text(cls, filename):
+        """
+        Parses a file in the Rankmaniac input format. Nodes that only
+        appear as neighbors are added as dangling nodes.
+        """
+
+        ids = []
+        ranks = []
+        degrees = []
+        chunks = []
+
+        f = open(filename)
+        try:
+            for line in f:
+                head, rest = line.split('\t', 1)
+                fields = rest.rstrip().split(',', 2)
+                ids.append(head[len('NodeId:'):])
+                ranks.append(fields[0])
+                if len(fields) > 2 and fields[2]:
+                    degrees.append(fields[2].count(',') + 1)
+                    chunks.append(fields[2])
+                else:
+                    degrees.append(0)
+        finally:
+            f.close()
+
+        ids = np.array(ids, dtype=np.int64)
+        ranks = np.array(ranks, dtype=np.float64)
+        degrees = np.array(degrees, dtype=np.int64)
+        if chunks:
+            targets = np.fromstring(','.join(chunks), dtype=np.int64,
+                                    sep=',')
+        else:
+            targets = np.zeros(0, dtype=np.int64)
+
+        return cls.from_edges(ids, np.repeat(ids, degrees), targets, ranks)
+
+    @classmethod
+    def from_binary(cls, filename):
+        """
+        Memory-maps a graph in the binary CSR format (see binary_graph)
+        without copying its arrays.
+        """
+
+        arrays = binary_graph.load(filename)
+        return cls(arrays['node_ids'], arrays['indptr'], arrays['indices'],
+                   arrays['ranks'])
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reads a graph in either the binary CSR or the text input format.
+        """
+
+        if binary_graph.is_binary(filename):
+            return cls.from_binary(filename)
+        return cls.from_text(filename)
+
+    @classmethod
+    def from_edges(cls, ids, sources, targets, ranks=None):
+        """
+        Builds a graph from parallel arrays of source and target node
+        identifiers. `ids` lists the identifiers of nodes that should
+        be present even without any edges, with their initial `ranks`.
+        """
+
+        node_ids = np.union1d(ids, targets)
+        n = len(node_ids)
+
+        src = np.searchsorted(node_ids, sources)
+        dst = np.searchsorted(node_ids, targets)
+
+        order = np.argsort(src, kind='mergesort')
+        indices = dst[order].astype(np.int32)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+
+        initial = np.ones(n)
+        if ranks is not None:
+            initial[np.searchsorted(node_ids, ids)] = ranks
+
+        return cls(node_ids, indptr, indices, initial)
+
+def step(graph, ranks, alpha=DefaultAlpha, dangling=DefaultDangling):
+    """
+    Performs a single damped power iteration and returns the new ranks.
+
+    Ranks follow the Rankmaniac convention of summing to the number of
+    nodes, so every node receives (1 - alpha) from teleportation. The
+    rank held by nodes without out-links is handled according to
+    `dangling`, which is one of
+
+        'self'      the node links to itself (as in sols/).
+        'uniform'   the rank is spread uniformly over all nodes.
+        'drop'      the rank is lost.
+    """
+
+    n = graph.num_nodes
+    degrees = graph.out_degrees()
+
+    share = np.zeros(n)
+    linked = degrees > 0
+    share[linked] = ranks[linked] / degrees[linked]
+
+    sums = np.bincount(graph.indices, weights=share[graph.sources()],
+                       minlength=n)
+
+    if dangling == 'self':
+        sums[~linked] += ranks[~linked]
+    elif dangling == 'uniform':
+        sums += ranks[~linked].sum() / n
+    elif dangling != 'drop':
+        raise ValueError('unknown dangling mode %r' % (dangling))
+
+    return (1 - alpha) + alpha * sums
+
+def gauss_seidel_step(graph, ranks, alpha=DefaultAlpha,
+                      dangling=DefaultDangling, blocks=DefaultBlocks):
+    """
+    Performs a single block Gauss-Seidel sweep and returns the new
+    ranks. The nodes are cut into `blocks` contiguous blocks, which are
+    updated in turn, so every block already uses the new ranks of the
+    blocks before it (as the streaming scripts do within a partition,
+    see pagerank_block_reduce.py). The rank held by dangling nodes is
+    handled as in step().
+    """
+
+    n = graph.num_nodes
+    in_indptr, in_sources = graph.in_links()
+    degrees = graph.out_degrees()
+    linked = degrees > 0
+
+    ranks = np.array(ranks, dtype=np.float64)
+    share = np.zeros(n)
+    share[linked] = ranks[linked] / degrees[linked]
+    uniform = ranks[~linked].sum() / n
+
+    bounds = np.linspace(0, n, min(blocks, n) + 1).astype(np.int64)
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        start, stop = in_indptr[lo], in_indptr[hi]
+        rows = np.repeat(np.arange(hi - lo), np.diff(in_indptr[lo:hi + 1]))
+        sums = np.bincount(rows, weights=share[in_sources[start:stop]],
+                           minlength=hi - lo).astype(np.float64)
+
+        if dangling == 'self':
+            unlinked = ~linked[lo:hi]
+            sums[unlinked] += ranks[lo:hi][unlinked]
+        elif dangling == 'uniform':
+            sums += uniform
+        elif dangling != 'drop':
+            raise ValueError('unknown dangling mode %r' % (dangling))
+
+        ranks[lo:hi] = (1 - alpha) + alpha * sums
+        block_linked = linked[lo:hi]
+        share[lo:hi][block_linked] = ranks[lo:hi][block_linked] / \
+                                     degrees[lo:hi][block_linked]
+
+    return ranks
+
+def aitken(x0, x1, x2):
+    """
+    Returns the componentwise Aitken extrapolation of three successive
+    iterates. Components that do not converge geometrically (the ratio
+    of their successive changes is not between 0 and 1) keep their
+    value from `x2`.
+    """
+
+    d1 = x1 - x0
+    d2 = x2 - x1
+    ratio = np.zeros(len(x2))
+    nonzero = d1 != 0
+    ratio[nonzero] = d2[nonzero] / d1[nonzero]
+    usable = (ratio > 0) & (ratio < 1)
+
+    x = np.array(x2)
+    x[usable] += d2[usable] * ratio[usable] / (1 - ratio[usable])
+    return x
+
+def quadratic(x0, x1, x2, x3):
+    """
+    Returns the quadratic extrapolation (Kamvar et al., 2003) of four
+    successive iterates, which removes the components along the second
+    and third eigenvectors. The result is scaled to the total rank of
+    `x3`, and `x3` itself is returned if the extrapolation fails.
+    """
+
+    y = np.column_stack([x1 - x0, x2 - x0])
+    gamma = np.linalg.lstsq(y, -(x3 - x0), rcond=-1)[0]
+    beta0 = gamma[0] + gamma[1] + 1
+    beta1 = gamma[1] + 1
+
+    x = beta0 * x1 + beta1 * x2 + x3
+    total = x.sum()
+    if not np.isfinite(total) or total <= 0 or (x < 0).any():
+        return x3
+    return x * (x3.sum() / total)
+
+def pagerank(graph, alpha=DefaultAlpha, tol=1e-10, max_iter=1000,
+             dangling=DefaultDangling, ranks=None, callback=None,
+             method='jacobi', extrapolate=None,
+             every=DefaultExtrapolateEvery, blocks=DefaultBlocks):
+    """
+    Runs power iteration until the L1 change in the normalized ranks
+    drops below `tol`, and returns the ranks and the number of
+    iterations performed.
+
+    If `callback` is specified, it is called with the iteration number
+    and the ranks after every iteration.
+
+    Keyword arguments:
+        method      <str>       'jacobi' (see step()) or 'gauss-seidel'
+                                (see gauss_seidel_step()).
+
+        extrapolate <str>       None, 'aitken' or 'quadratic'; the
+                                ranks are extrapolated from the last
+                                iterates every `every` iterations.
+
+        blocks      <int>       the number of blocks of a Gauss-Seidel
+                                sweep.
+    """
+
+    if method not in Methods:
+        raise ValueError('unknown method %r' % (method))
+    if extrapolate not in Extrapolations:
+        raise ValueError('unknown extrapolation %r' % (extrapolate))
+
+    if ranks is None:
+        ranks = graph.ranks
+    n = graph.num_nodes
+    history = [ranks]
+    needed = Extrapolations[extrapolate]
+
+    for i in range(1, max_iter + 1):
+        if method == 'jacobi':
+            new_ranks = step(graph, ranks, alpha, dangling)
+        else:
+            new_ranks = gauss_seidel_step(graph, ranks, alpha, dangling,
+                                          blocks)
+        residual = np.abs(new_ranks - ranks).sum() / n
+
+        # Extrapolate from plain iterates only, and never stop on an
+        # extrapolated iteration
+        history = (history + [new_ranks])[-needed:]
+        if extrapolate and i % every == 0 and len(history) == needed:
+            if extrapolate == 'aitken':
+                new_ranks = aitken(*history)
+            else:
+                new_ranks = quadratic(*history)
+            history = [new_ranks]
+            residual = None
+        ranks = new_ranks
+
+        if callback is not None:
+            callback(i, ranks)
+        if residual is not None and residual < tol:
+            break
+
+    return ranks, i
+
+def top_k(graph, ranks, k=20):
+    """
+    Returns the identifiers of the `k` highest-ranked nodes in
+    decreasing order of rank (ties broken by identifier).
+    """
+
+    candidates = np.arange(graph.num_nodes)
+    if k < graph.num_nodes:
+        # Keep every node tied with the k-th rank so ties are broken
+        # the same way as in a full sort
+        kth = -np.partition(-ranks, k - 1)[k - 1]
+        candidates = np.flatnonzero(ranks >= kth)
+
+    node_ids = graph.node_ids[candidates]
+    order = np.lexsort((node_ids, -ranks[candidates]))[:k]
+    return [int(node) for node in node_ids[order]]
+
+def iterations_to_top_k(graph, k=20, alpha=DefaultAlpha, tol=1e-10,
+                        max_iter=1000, dangling=DefaultDangling,
+                        method='jacobi', extrapolate=None,
+                        every=DefaultExtrapolateEvery, blocks=DefaultBlocks):
+    """
+    Returns the number of iterations after which the top-k list (in
+    order) no longer changes, which is the number of iterations a
+    streaming submission really needs, along with the converged ranks
+    and the total number of iterations performed. The remaining
+    arguments select the iteration scheme, as in pagerank().
+    """
+
+    history = []
+    def record(i, ranks):
+        history.append(top_k(graph, ranks, k))
+
+    ranks, num_iter = pagerank(graph, alpha, tol, max_iter, dangling,
+                               callback=record, method=method,
+                               extrapolate=extrapolate, every=every,
+                               blocks=blocks)
+
+    final = history[-1]
+    i = len(history)
+    while i > 0 and history[i - 1] == final:
+        i -= 1
+    return i + 1, ranks, num_iter
+
+def read_solution(filename):
+    """
+    Reads a solution file from sols/, which lists one node identifier
+    per line.
+    """
+
+    f = open(filename)
+    try:
+        return [int(line) for line in f if line.strip()]
+    finally:
+        f.close()
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile',
+                          description='The input is either a text or a '
+                                      'binary CSR graph.')
+    parser.add_option('-k', type='int', default=20,
+                      help='number of top nodes to report [%default]')
+    parser.add_option('-a', '--alpha', type='float', default=DefaultAlpha,
+                      help='damping factor [%default]')
+    parser.add_option('-t', '--tol', type='float', default=1e-10,
+                      help='L1 convergence tolerance [%default]')
+    parser.add_option('-i', '--max-iter', type='int', default=1000,
+                      help='maximum number of iterations [%default]')
+    parser.add_option('-d', '--dangling', default=DefaultDangling,
+                      choices=('self', 'uniform', 'drop'),
+                      help='dangling node handling: self, uniform or '
+                           'drop [%default]')
+    parser.add_option('-m', '--method', default='jacobi', choices=Methods,
+                      help='iteration: %s [%%default]'
+                           % (' or '.join(Methods)))
+    parser.add_option('-x', '--extrapolate',
+                      choices=[x for x in Extrapolations if x],
+                      help='extrapolation: aitken or quadratic [none]')
+    parser.add_option('--every', type='int',
+                      default=DefaultExtrapolateEvery,
+                      help='iterations between extrapolations [%default]')
+    parser.add_option('--blocks', type='int', default=DefaultBlocks,
+                      help='blocks of a Gauss-Seidel sweep [%default]')
+    parser.add_option('-c', '--check', metavar='SOLUTION',
+                      help='compare the top-k against a solution file')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected exactly one input file')
+
+    start = time()
+    graph = CSRGraph.load(args[0])
+    load_time = time() - start
+
+    start = time()
+    stable, ranks, num_iter = iterations_to_top_k(graph, options.k,
+                                                  options.alpha, options.tol,
+                                                  options.max_iter,
+                                                  options.dangling,
+                                                  options.method,
+                                                  options.extrapolate,
+                                                  options.every,
+                                                  options.blocks)
+    run_time = time() - start
+
+    nodes = top_k(graph, ranks, options.k)
+    for node in nodes:
+        sys.stdout.write('%d\n' % (node))
+
+    sys.stderr.write('%d nodes, %d edges: loaded in %.3fs, '
+                     'converged in %d iterations (%.3fs)\n'
+                     % (graph.num_nodes, graph.num_edges, load_time,
+                        num_iter, run_time))
+    sys.stderr.write('top-%d stable after %d iterations\n'
+                     % (options.k, stable))
+
+    if options.check:
+        expected = read_solution(options.check)
+        if nodes == expected[:options.k]:
+            sys.stderr.write('matches %s\n' % (options.check))
+        else:
+            sys.stderr.write('DIFFERS from %s\n' % (options.check))
+            sys.exit(1)
@@ -0,0 +1,777 @@
+"""
+Local emulator for running the Rankmaniac pipeline without Amazon EMR.
+
+The pagerank and process scripts are executed as real subprocesses
+that read from stdin and write to stdout, exactly as Hadoop streaming
+runs them. The input of each step is split across the mappers, the
+map output is hash-partitioned on its key and sort-shuffled, and each
+partition is fed to its own reducer process. Like Hadoop streaming,
+lines of the form 'reporter:counter:<group>,<counter>,<amount>' that
+the scripts write to stderr increment the counters of the step.
+
+Special notes:
+    WARNING! Requires Python >= 2.6
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+from __future__ import with_statement # for Python 2.5
+
+import sys, os
+import bisect
+import shutil
+import subprocess
+import tempfile
+import ConfigParser
+from optparse import OptionParser
+from time import time
+
+from rankmaniac import RankmaniacError
+from hot_keys import detect_hot_keys
+from partitioner import partition
+from preprocess_graph import preprocess_graph
+
+try:
+    import binary_graph
+except ImportError: # NumPy is not installed
+    binary_graph = None
+
+def get_key(line):
+    """
+    Returns the key of a streaming record, which is everything up to
+    the first tab character (or the whole line if there is no tab).
+    """
+
+    i = line.find('\t')
+    if i < 0:
+        return line.rstrip('\n')
+    return line[:i]
+
+def skew(records):
+    """
+    Returns the largest number of records received by one reducer over
+    the average number (1.0 when the records are spread evenly).
+    """
+
+    if not records or not sum(records):
+        return 1.0
+    return max(records) * len(records) / float(sum(records))
+
+def parse_counter(line):
+    """
+    Returns the (group, counter, amount) of a streaming counter update,
+    or `None` if the stderr line is not one.
+    """
+
+    prefix = 'reporter:counter:'
+    if not line.startswith(prefix):
+        return None
+
+    fields = line[len(prefix):].rstrip('\n').split(',')
+    if len(fields) != 3:
+        return None
+    try:
+        return fields[0], fields[1], int(fields[2])
+    except ValueError:
+        return None
+
+def _iter_file(filename):
+    """
+    Yields the lines of a text file, closing it once they are all read.
+    """
+
+    with open(filename) as f:
+        for line in f:
+            yield line
+
+class LocalRankmaniac:
+    """
+    (emulator class)
+
+    This class mirrors the job-building interface of the Rankmaniac
+    class, but runs each step on the local machine instead of on
+    Amazon EMR. This way a submission can be checked for correctness
+    (and convergence) in seconds without paying for a cluster.
+    """
+
+    def __init__(self, indir='data', outdir='local_results'):
+        """
+        (constructor)
+
+        Creates a new local job that reads the scripts from `indir` and
+        writes the output of every step under `outdir`.
+
+        Keyword arguments:
+            indir         <str>     the directory containing the
+                                    map-reduce scripts (and, by default,
+                                    the input file).
+
+            outdir        <str>     the base directory to which the
+                                    output of each step is written.
+        """
+
+        self._indir = indir
+        self._outdir = outdir
+
+        self._reset()
+
+    def _reset(self):
+        """
+        Resets the internal state of the job.
+        """
+
+        self._iter_no = 0
+        self._infile = None
+        self._last_outdir = None
+
+        self._steps = []
+        self._is_done = False
+
+        self.timings = []
+
+    def set_infile(self, filename):
+        """
+        Sets the data file to use for the first iteration of the
+        pagerank step. Relative paths are resolved against the input
+        directory. The file is either in the text input format or in
+        the binary CSR format (see binary_graph).
+        """
+
+        self._infile = os.path.join(self._indir, filename)
+
+    def do_iter(self, pagerank_mapper, pagerank_reducer,
+                process_mapper, process_reducer,
+                pagerank_output=None, process_output=None,
+                num_pagerank_mappers=1, num_pagerank_reducers=1,
+                cache_files=None, pagerank_combiner=None,
+                process_combiner=None, iters_per_step=1, cmdenv=None,
+                pagerank_partitioner=None, num_process_mappers=1,
+                num_process_reducers=1, submit=True):
+        """
+        Adds a pagerank step and a process step to the current job.
+
+        The arguments are the same as those of Rankmaniac.do_iter(). The
+        steps are only queued (whatever `submit` is); call run() to
+        execute them.
+        """
+
+        if self._iter_no == 0:
+            pagerank_input = self._infile
+        elif self._iter_no > 0:
+            pagerank_input = self._last_outdir
+
+        if pagerank_output is None:
+            pagerank_output = self._get_default_outdir('pagerank')
+        pagerank_output = os.path.join(self._outdir, pagerank_output)
+
+        # Output from the pagerank step becomes input to process step
+        process_input = pagerank_output
+
+        if process_output is None:
+            process_output = self._get_default_outdir('process')
+        process_output = os.path.join(self._outdir, process_output)
+
+        # The steps know their number, for EXTRAPOLATE (see
+        # pagerank_codec.py), and how many iterations each one runs,
+        # for the stopping rule (see process_reduce.py)
+        process_cmdenv = dict(cmdenv or {})
+        process_cmdenv['ITERATION'] = self._iter_no
+        process_cmdenv['ITERS_PER_STEP'] = iters_per_step
+        pagerank_cmdenv = dict(process_cmdenv)
+
+        # The text split points stand in for the SequenceFile that
+        # Hadoop's TotalOrderPartitioner reads
+        pagerank_cache_files = cache_files
+        partition_file = None
+        if pagerank_partitioner is not None:
+            partition_file = pagerank_partitioner + '.txt'
+            pagerank_cache_files = list(cache_files or []) + [partition_file]
+            pagerank_cmdenv['RANGE_PARTITIONS'] = \
+                os.path.basename(partition_file)
+
+        self._steps.append({'step': 'pagerank', 'iter_no': self._iter_no,
+                            'mapper': pagerank_mapper,
+                            'reducer': pagerank_reducer,
+                            'combiner': pagerank_combiner,
+                            'input': pagerank_input,
+                            'output': pagerank_output,
+                            'num_mappers': num_pagerank_mappers,
+                            'num_reducers': num_pagerank_reducers,
+                            'cache_files': pagerank_cache_files,
+                            'cmdenv': pagerank_cmdenv,
+                            'partition_file': partition_file})
+
+        self._steps.append({'step': 'process', 'iter_no': self._iter_no,
+                            'mapper': process_mapper,
+                            'reducer': process_reducer,
+                            'combiner': process_combiner,
+                            'input': process_input,
+                            'output': process_output,
+                            'num_mappers': num_process_mappers,
+                            'num_reducers': num_process_reducers,
+                            'cache_files': cache_files,
+                            'cmdenv': process_cmdenv,
+                            'partition_file': None})
+
+        self._last_outdir = process_output
+        self._iter_no += 1
+
+    def submit(self):
+        """
+        Does nothing, as the steps are already queued; for compatibility
+        with Rankmaniac.submit().
+        """
+
+        pass
+
+    def run(self):
+        """
+        Executes the queued steps in order, stopping after the first
+        process step whose output begins with the string 'FinalRank'.
+
+        Returns `True` if 'FinalRank' was outputted, and `False`
+        otherwise.
+        """
+
+        while self._steps and not self._is_done:
+            step = self._steps.pop(0)
+
+            timing = self._run_step(step['mapper'], step['reducer'],
+                                    step['input'], step['output'],
+                                    step['num_mappers'],
+                                    step['num_reducers'],
+                                    step['combiner'],
+                                    step['cache_files'],
+                                    step['cmdenv'],
+                                    step['partition_file'])
+            timing['step'] = step['step']
+            timing['iter_no'] = step['iter_no']
+            self.timings.append(timing)
+
+            if step['step'] == 'process' and self._is_final(step['output']):
+                self._is_done = True
+
+        return self._is_done
+
+    def is_done(self):
+        """
+        Returns `True` if some process step has outputted 'FinalRank',
+        and `False` otherwise.
+        """
+
+        return self._is_done
+
+    def report(self, out=sys.stdout):
+        """
+        Writes the wall-time spent in each phase of every executed step,
+        along with the number of records and bytes it shuffled, the skew
+        of the records over its reducers (the largest number received by
+        one reducer over the average), and the counters reported by its
+        tasks. The number of records received by each reducer follows
+        for the steps with several reducers.
+        """
+
+        header = '%-5s %-9s %8s %8s %8s %8s %10s %12s %6s\n'
+        row = '%-5s %-9s %8.3f %8.3f %8.3f %8.3f %10d %12d %6s\n'
+        fields = ('map', 'shuffle', 'reduce', 'shuffle_records',
+                  'shuffle_bytes')
+
+        out.write(header % ('iter', 'step', 'map', 'shuffle', 'reduce',
+                            'total', 'records', 'bytes', 'skew'))
+        totals = dict([(field, 0) for field in fields])
+        for t in self.timings:
+            total = t['map'] + t['shuffle'] + t['reduce']
+            out.write(row % (t['iter_no'], t['step'], t['map'],
+                             t['shuffle'], t['reduce'], total,
+                             t['shuffle_records'], t['shuffle_bytes'],
+                             '%.2f' % (skew(t['reducer_records']))))
+            for field in fields:
+                totals[field] += t[field]
+
+        total = totals['map'] + totals['shuffle'] + totals['reduce']
+        out.write(row % ('all', '', totals['map'], totals['shuffle'],
+                         totals['reduce'], total,
+                         totals['shuffle_records'],
+                         totals['shuffle_bytes'], ''))
+
+        names = []
+        for t in self.timings:
+            for name in t['counters']:
+                if name not in names:
+                    names.append(name)
+
+        if names:
+            # One column per counter, for the steps that report any
+            names.sort()
+            out.write('\n%-5s %-9s' % ('iter', 'step'))
+            for group, name in names:
+                out.write(' %14s' % (name))
+            out.write('\n')
+            for t in self.timings:
+                if not t['counters']:
+                    continue
+                out.write('%-5s %-9s' % (t['iter_no'], t['step']))
+                for name in names:
+                    out.write(' %14d' % (t['counters'].get(name, 0)))
+                out.write('\n')
+
+        timings = [t for t in self.timings if len(t['reducer_records']) > 1]
+        if timings:
+            out.write('\n%-5s %-9s %s\n'
+                      % ('iter', 'step', 'records per reducer'))
+            for t in timings:
+                out.write('%-5s %-9s %s\n'
+                          % (t['iter_no'], t['step'],
+                             ' '.join(['%8d' % (records)
+                                       for records in t['reducer_records']])))
+
+    def _run_step(self, mapper, reducer, input, output,
+                  num_mappers=1, num_reducers=1, combiner=None,
+                  cache_files=None, cmdenv=None, partition_file=None):
+        """
+        Runs a single streaming step and returns the wall-time (in
+        seconds) spent in its map, shuffle and reduce phases, and the
+        number of records and bytes that were shuffled. The map output
+        is hash-partitioned, or range-partitioned on the split points
+        in the `partition_file`.
+        """
+
+        if os.path.exists(output):
+            shutil.rmtree(output)
+        tmpdir = os.path.join(output, '_temporary')
+        workdir = os.path.join(tmpdir, 'work')
+        os.makedirs(workdir)
+
+        # Like the distributed cache, link the cache files into the
+        # working directory of the tasks
+        for filename in cache_files or []:
+            if not os.path.exists(os.path.join(self._indir, filename)):
+                raise RankmaniacError('cache file %s not found'
+                                      % (filename))
+            os.symlink(os.path.abspath(os.path.join(self._indir, filename)),
+                       os.path.join(workdir, os.path.basename(filename)))
+
+        # Like Hadoop streaming, export the job configuration and the
+        # -cmdenv variables to the tasks
+        env = os.environ.copy()
+        env['mapred_map_tasks'] = str(num_mappers)
+        env['mapred_reduce_tasks'] = str(num_reducers)
+        for name, value in (cmdenv or {}).items():
+            env[name] = str(value)
+
+        # Like the TotalOrderPartitioner, expect a split point between
+        # every two reducers
+        split_points = None
+        if partition_file is not None:
+            with open(os.path.join(self._indir, partition_file)) as f:
+                split_points = [line.rstrip('\n') for line in f]
+            if len(split_points) != num_reducers - 1:
+                raise RankmaniacError('%s has %d split points, but %d '
+                                      'reducers need %d'
+                                      % (partition_file, len(split_points),
+                                         num_reducers, num_reducers - 1))
+
+        start = time()
+        splits = self._split_input(input, num_mappers, tmpdir)
+        map_outputs = []
+        for i, split in enumerate(splits):
+            map_outputs.append(os.path.join(tmpdir, 'map-%05d' % (i)))
+        counters = {}
+        self._run_tasks(mapper, splits, map_outputs, workdir, env, counters)
+
+        if combiner is not None:
+            # The combiner runs within each map task on its sorted output
+            sorted_outputs = []
+            combined_outputs = []
+            for i, filename in enumerate(map_outputs):
+                sorted_output = os.path.join(tmpdir, 'sort-%05d' % (i))
+                self._sort_file(filename, sorted_output)
+                sorted_outputs.append(sorted_output)
+                combined_outputs.append(os.path.join(tmpdir,
+                                                     'combine-%05d' % (i)))
+            self._run_tasks(combiner, sorted_outputs, combined_outputs,
+                            workdir, env, counters)
+            map_outputs = combined_outputs
+        map_time = time() - start
+
+        start = time()
+        partitions, counts, size = self._shuffle(map_outputs, num_reducers,
+                                                 tmpdir, split_points)
+        shuffle_time = time() - start
+
+        start = time()
+        part_files = []
+        for i in range(num_reducers):
+            part_files.append(os.path.join(output, 'part-%05d' % (i)))
+        self._run_tasks(reducer, partitions, part_files, workdir, env,
+                        counters)
+        reduce_time = time() - start
+
+        shutil.rmtree(tmpdir)
+
+        return {'map': map_time, 'shuffle': shuffle_time,
+                'reduce': reduce_time, 'shuffle_records': sum(counts),
+                'shuffle_bytes': size, 'reducer_records': counts,
+                'counters': counters}
+
+    def _split_input(self, input, num_mappers, tmpdir):
+        """
+        Splits the input (a file, or a directory of part files) into at
+        most `num_mappers` contiguous chunks of roughly equal size. The
+        lines are counted first and then streamed to the chunks, so the
+        input is never held in memory.
+        """
+
+        filenames = self._list_input(input)
+        num_lines = sum([self._count_lines(filename)
+                         for filename in filenames])
+
+        num_mappers = max(1, min(num_mappers, num_lines))
+        size = (num_lines + num_mappers - 1) // num_mappers
+
+        splits = [os.path.join(tmpdir, 'split-%05d' % (i))
+                  for i in range(num_mappers)]
+        i = 0
+        count = 0
+        f = open(splits[0], 'w')
+        try:
+            for filename in filenames:
+                for line in self._read_lines(filename):
+                    if count == size:
+                        f.close()
+                        i += 1
+                        count = 0
+                        f = open(splits[i], 'w')
+                    f.write(line)
+                    count += 1
+        finally:
+            f.close()
+
+        # Short inputs leave the last chunks empty
+        for filename in splits[i + 1:]:
+            open(filename, 'w').close()
+
+        return splits
+
+    def _shuffle(self, map_outputs, num_reducers, tmpdir,
+                 split_points=None):
+        """
+        Hash-partitions the map output on its key and sorts each
+        partition by key, as the Hadoop shuffle does. Returns the
+        partition files, the number of records shuffled to each reducer
+        and the number of bytes shuffled.
+
+        Given `split_points`, the keys are range-partitioned instead,
+        like Hadoop's TotalOrderPartitioner does.
+        """
+
+        buckets = [[] for i in range(num_reducers)]
+        cache = {}
+        size = 0
+        for filename in map_outputs:
+            with open(filename) as f:
+                for line in f:
+                    size += len(line)
+                    key = get_key(line)
+                    i = cache.get(key)
+                    if i is None and split_points is not None:
+                        i = cache[key] = bisect.bisect_right(split_points,
+                                                             key)
+                    elif i is None:
+                        i = cache[key] = partition(key, num_reducers)
+                    buckets[i].append((key, line))
+
+        partitions = []
+        for i, bucket in enumerate(buckets):
+            bucket.sort(key=lambda record: record[0])
+            filename = os.path.join(tmpdir, 'reduce-%05d' % (i))
+            with open(filename, 'w') as f:
+                f.writelines([line for (key, line) in bucket])
+            partitions.append(filename)
+
+        return partitions, [len(bucket) for bucket in buckets], size
+
+    def _sort_file(self, infile, outfile):
+        """
+        Sorts the records of a file by key.
+        """
+
+        with open(infile) as f:
+            lines = f.readlines()
+        lines.sort(key=get_key)
+        with open(outfile, 'w') as f:
+            f.writelines(lines)
+
+    def _run_tasks(self, script, infiles, outfiles, workdir, env,
+                   counters=None):
+        """
+        Runs one subprocess of `script` per input file concurrently in
+        the working directory and environment, connecting its stdin and
+        stdout to the input and output files.
+
+        The counter updates the tasks write to stderr are added to the
+        `counters` dictionary, keyed on (group, counter); the rest of
+        their stderr is passed through.
+        """
+
+        command = [sys.executable,
+                   os.path.abspath(os.path.join(self._indir, script))]
+
+        tasks = []
+        for i, (infile, outfile) in enumerate(zip(infiles, outfiles)):
+            # Like Hadoop, tell each task its partition number
+            task_env = env.copy()
+            task_env['mapred_task_partition'] = str(i)
+
+            stdin = open(infile)
+            stdout = open(outfile, 'w')
+            stderr = tempfile.TemporaryFile()
+            proc = subprocess.Popen(command, stdin=stdin, stdout=stdout,
+                                    stderr=stderr, cwd=workdir,
+                                    env=task_env)
+            tasks.append((proc, stdin, stdout, stderr))
+
+        failed = []
+        for proc, stdin, stdout, stderr in tasks:
+            if proc.wait() != 0:
+                failed.append(proc.returncode)
+            stdin.close()
+            stdout.close()
+
+            stderr.seek(0)
+            for line in stderr:
+                counter = parse_counter(line)
+                if counter is None:
+                    if not line.startswith('reporter:status:'):
+                        sys.stderr.write(line)
+                elif counters is not None:
+                    group, name, amount = counter
+                    counters[(group, name)] = \
+                        counters.get((group, name), 0) + amount
+            stderr.close()
+
+        if failed:
+            raise RankmaniacError('%s exited with status %d'
+                                  % (script, failed[0]))
+
+    def _list_input(self, input):
+        """
+        Returns the files making up a step input, which is either a
+        single file or a directory of part files.
+        """
+
+        if not os.path.isdir(input):
+            return [input]
+
+        filenames = []
+        for filename in sorted(os.listdir(input)):
+            if not filename.startswith(('_', '.')):
+                filenames.append(os.path.join(input, filename))
+        return filenames
+
+    def _is_binary(self, filename):
+        """
+        Returns `True` if the input file is a graph in the binary CSR
+        format, which needs NumPy to be read, and `False` otherwise.
+        """
+
+        with open(filename, 'rb') as f:
+            magic = f.read(8)
+
+        if not magic.startswith('RMCSR'):
+            return False
+        if binary_graph is None:
+            raise RankmaniacError('NumPy is required to read %s'
+                                  % (filename))
+        return True
+
+    def _read_lines(self, filename):
+        """
+        Returns an iterator over the lines of an input file. Graphs in
+        the binary CSR format are decoded to the text input format as
+        they are read.
+        """
+
+        if self._is_binary(filename):
+            return binary_graph.iter_lines(filename)
+        return _iter_file(filename)
+
+    def _count_lines(self, filename):
+        """
+        Returns the number of lines of an input file, which for a binary
+        graph is its number of nodes.
+        """
+
+        if self._is_binary(filename):
+            return len(binary_graph.load(filename)['node_ids'])
+
+        count = 0
+        for line in _iter_file(filename):
+            count += 1
+        return count
+
+    def _is_final(self, output):
+        """
+        Returns `True` if the first part of the output begins with the
+        string 'FinalRank', and `False` otherwise.
+        """
+
+        with open(os.path.join(output, 'part-00000')) as f:
+            return f.read(len('FinalRank')) == 'FinalRank'
+
+    def _get_default_outdir(self, name, iter_no=None):
+        """
+        Returns the default output directory, which is 'iter_no/name/'.
+        """
+
+        if iter_no is None:
+            iter_no = self._iter_no
+
+        return '%s/%s/' % (iter_no, name)
+
+def do_main(infile='input.txt', max_iter=100,
+            num_mappers=1, num_reducers=1, outdir='local_results'):
+    """
+    Runs the configured scripts locally until they output 'FinalRank'
+    (or `max_iter` iterations have completed) and reports the time
+    spent in each phase.
+    """
+
+    # Default modules for where to expect the pagerank step
+    # and process step code
+    pagerank_map = 'pagerank_map.py'
+    pagerank_reduce = 'pagerank_reduce.py'
+    process_map = 'process_map.py'
+    process_reduce = 'process_reduce.py'
+    pagerank_combine = None
+    cache_files = None
+    iters_per_step = 1
+    pagerank_partitioner = None
+    hot_keys = None
+    preprocess = None
+    num_process_mappers = 1
+    num_process_reducers = 1
+    cmdenv = {}
+
+    # Read the configuration and override defaults
+    config = ConfigParser.SafeConfigParser()
+    config.read('data/rankmaniac.cfg')
+
+    section = 'Rankmaniac'
+    if config.has_section(section):
+        pagerank_map = config.get(section, 'pagerank_map')
+        pagerank_reduce = config.get(section, 'pagerank_reduce')
+        process_map = config.get(section, 'process_map')
+        process_reduce = config.get(section, 'process_reduce')
+        if config.has_option(section, 'pagerank_combine'):
+            pagerank_combine = config.get(section, 'pagerank_combine')
+        if config.has_option(section, 'cache_files'):
+            cache_files = config.get(section, 'cache_files').split()
+        if config.has_option(section, 'iters_per_step'):
+            iters_per_step = config.getint(section, 'iters_per_step')
+        if config.has_option(section, 'pagerank_partitioner'):
+            pagerank_partitioner = config.get(section,
+                                              'pagerank_partitioner')
+        if config.has_option(section, 'hot_keys'):
+            hot_keys = config.get(section, 'hot_keys')
+        if config.has_option(section, 'preprocess'):
+            preprocess = config.get(section, 'preprocess')
+        if config.has_option(section, 'num_process_mappers'):
+            num_process_mappers = config.getint(section,
+                                                'num_process_mappers')
+        if config.has_option(section, 'num_process_reducers'):
+            num_process_reducers = config.getint(section,
+                                                 'num_process_reducers')
+
+    # Only the block scripts run several iterations in one step; the
+    # others would silently run fewer iterations than asked for
+    if iters_per_step > 1 and pagerank_reduce != 'pagerank_block_reduce.py':
+        raise RankmaniacError('iters_per_step = %d needs '
+                              'pagerank_block_reduce.py' % (iters_per_step))
+
+    # Every option in the environment section is exported to the tasks
+    section = 'Environment'
+    if config.has_section(section):
+        for name in config.options(section):
+            cmdenv[name.upper()] = config.get(section, name)
+
+    # In schimmy mode each reducer reads its partition of the static
+    # graph, written by partition_graph.py
+    prefix = cmdenv.get('SCHIMMY_GRAPH')
+    if prefix:
+        cache_files = list(cache_files or [])
+        for i in range(num_reducers):
+            cache_files.append('%s-%05d' % (prefix, i))
+
+    # Clean and renumber the input once, before anything else reads it;
+    # the 'FinalRank' lines are mapped back to the original identifiers
+    if preprocess is not None:
+        preprocess_graph(os.path.join('data', infile),
+                         os.path.join('data', preprocess))
+        infile = preprocess
+        cache_files = list(cache_files or []) + [preprocess + '.map']
+        cmdenv['NODE_MAP'] = preprocess + '.map'
+
+    # A graph renumbered by reorder_graph.py comes with its node map,
+    # which the process step needs for the 'FinalRank' lines
+    node_map = infile + '.map'
+    if 'NODE_MAP' not in cmdenv and \
+           os.path.isfile(os.path.join('data', node_map)):
+        cache_files = list(cache_files or []) + [node_map]
+        cmdenv['NODE_MAP'] = os.path.basename(node_map)
+
+    # Like the uploader, detect the hot keys to salt from the input
+    if hot_keys is not None:
+        detect_hot_keys(os.path.join('data', infile),
+                        os.path.join('data', hot_keys))
+        cache_files = list(cache_files or []) + [hot_keys]
+        cmdenv['HOT_KEYS'] = hot_keys
+
+    # The last step writes 'FinalRank' even if it has not converged
+    cmdenv['MAX_ITER'] = (max_iter + iters_per_step - 1) // iters_per_step
+
+    r = LocalRankmaniac(outdir=outdir)
+    r.set_infile(infile)
+    for i in range(0, max_iter, iters_per_step):
+        r.do_iter(pagerank_map, pagerank_reduce,
+                  process_map, process_reduce,
+                  num_pagerank_mappers=num_mappers,
+                  num_pagerank_reducers=num_reducers,
+                  cache_files=cache_files,
+                  pagerank_combiner=pagerank_combine,
+                  iters_per_step=iters_per_step,
+                  cmdenv=cmdenv,
+                  pagerank_partitioner=pagerank_partitioner,
+                  num_process_mappers=num_process_mappers,
+                  num_process_reducers=num_process_reducers)
+
+    start = time()
+    if r.run():
+        print("Outputted 'FinalRank'")
+    else:
+        print("Failed to output 'FinalRank'!")
+    print('Finished in %.3f seconds' % (time() - start))
+    print('')
+    r.report()
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] [infile]')
+    parser.add_option('-i', '--max-iter', type='int', default=100,
+                      help='maximum number of iterations [%default]')
+    parser.add_option('-m', '--mappers', type='int', default=1,
+                      help='number of pagerank mappers [%default]')
+    parser.add_option('-r', '--reducers', type='int', default=1,
+                      help='number of pagerank reducers [%default]')
+    parser.add_option('-o', '--outdir', default='local_results',
+                      help='directory for step outputs [%default]')
+    (options, args) = parser.parse_args()
+
+    infile = 'input.txt'
+    if args:
+        infile = args[0]
+
+    do_main(infile, options.max_iter, options.mappers, options.reducers,
+            options.outdir)
@@ -0,0 +1,381 @@
+"""
+Monte Carlo approximation of pagerank for a fast top-k.
+
+Instead of iterating over every edge until the ranks converge, this
+tool starts `walks` random walks at every node. At every step a walk
+follows a random out-link with probability alpha and stops otherwise,
+and the visits to every node are counted (the complete-path estimator
+of Avrachenkov et al.). Scaled by (1 - alpha) / walks, the visits
+estimate the ranks in the Rankmaniac convention, where they sum to the
+number of nodes. Walks at a dangling node follow the same rule as the
+reference engine: stay ('self'), jump to a random node ('uniform') or
+stop ('drop').
+
+The start nodes are split into chunks that are walked by a pool of
+worker processes, like mappers. The walks are split into independent
+batches too, so the spread of the batch estimates gives a confidence
+interval for every rank. A prefix of the top-k is certain when the
+intervals of its nodes do not overlap, and the nodes whose interval
+reaches the k-th rank are the candidates for the top-k. The candidates
+can be refined with local power iterations: only the candidates and
+the nodes within `hops` in-links of them are updated, from the in-links
+of each, while every other node keeps its estimate. At most `budget`
+nodes are updated, so the refinement stays local however well the
+candidates are linked: past the budget, only the nodes that send the
+largest shares of rank are added. The iterations stop as soon as the
+certificate of process_reduce.py holds for the candidates in that local
+system, so the result is as good as the frozen estimates around it;
+more hops and a larger budget freeze them further away.
+
+Special notes:
+    Requires NumPy and Python >= 2.6 on a Unix system.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import sys
+import multiprocessing
+from optparse import OptionParser
+from time import time
+
+import numpy as np
+
+from local_engine import CSRGraph, DefaultAlpha, DefaultDangling, \
+                         read_solution
+
+DefaultWalks = 16
+DefaultBatches = 8
+DefaultConfidence = 2.576 # z-score of a two-sided 99% interval
+DefaultHops = 1
+DefaultBudget = 300 # most nodes updated by refine()
+ChunkSize = 1 << 16 # start nodes per task
+
+# The graph, as seen by the worker processes
+_walker = {}
+
+def _init_worker(graph, alpha, dangling, walks, batches):
+    """
+    Keeps the graph and the parameters of the walks in a worker.
+    """
+
+    _walker['graph'] = graph
+    _walker['params'] = (alpha, dangling, walks, batches)
+
+def _walk_chunk(args):
+    """
+    Walks `walks` random walks from each of the nodes lo ... hi - 1 and
+    returns the visits to every node in every batch, and the number of
+    steps taken.
+    """
+
+    lo, hi, seed = args
+    graph = _walker['graph']
+    alpha, dangling, walks, batches = _walker['params']
+    n = graph.num_nodes
+    indptr = graph.indptr
+    indices = graph.indices
+    degrees = graph.out_degrees()
+    rng = np.random.RandomState(seed)
+
+    # Walk r of every start node belongs to batch r % batches
+    pos = np.repeat(np.arange(lo, hi), walks)
+    batch = np.tile(np.arange(walks) % batches, hi - lo)
+    visits = np.bincount(batch * n + pos, minlength=batches * n)
+    num_steps = 0
+
+    while len(pos):
+        going = rng.random_sample(len(pos)) < alpha
+        pos = pos[going]
+        batch = batch[going]
+
+        degree = degrees[pos]
+        linked = degree > 0
+        offsets = indptr[pos[linked]] + \
+                  (rng.random_sample(linked.sum()) * degree[linked]).astype(
+                      np.int64)
+        pos[linked] = indices[offsets]
+
+        if dangling == 'uniform':
+            pos[~linked] = rng.randint(0, n, (~linked).sum())
+        elif dangling == 'drop':
+            pos = pos[linked]
+            batch = batch[linked]
+
+        num_steps += len(pos)
+        visits += np.bincount(batch * n + pos, minlength=batches * n)
+
+    return visits, num_steps
+
+def random_walks(graph, walks=DefaultWalks, alpha=DefaultAlpha,
+                 dangling=DefaultDangling, batches=DefaultBatches,
+                 workers=None, seed=0):
+    """
+    Runs the random walks and returns the estimated ranks of every
+    batch (as a batches x n array) and the total number of steps.
+
+    Keyword arguments:
+        walks       <int>       the number of walks started at every
+                                node.
+
+        batches     <int>       the number of batches the walks are
+                                split into (at most `walks`).
+
+        workers     <int>       the number of worker processes;
+                                defaults to the number of CPUs, and 0
+                                walks in this process.
+    """
+
+    if dangling not in ('self', 'uniform', 'drop'):
+        raise ValueError('unknown dangling mode %r' % (dangling))
+
+    n = graph.num_nodes
+    batches = max(1, min(batches, walks))
+    params = (graph, alpha, dangling, walks, batches)
+    tasks = [(lo, min(lo + ChunkSize, n), seed + i)
+             for i, lo in enumerate(range(0, n, ChunkSize))]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers > 0:
+        pool = multiprocessing.Pool(workers, _init_worker, params)
+        try:
+            results = pool.map(_walk_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(*params)
+        results = map(_walk_chunk, tasks)
+
+    visits = np.zeros(batches * n)
+    num_steps = 0
+    for chunk_visits, chunk_steps in results:
+        visits += chunk_visits
+        num_steps += chunk_steps
+
+    # Every batch holds the same number of walks per node, up to one
+    per_batch = np.bincount(np.arange(walks) % batches, minlength=batches)
+    scale = (1 - alpha) / per_batch.astype(np.float64)
+    return visits.reshape(batches, n) * scale[:, np.newaxis], num_steps
+
+def confidence(estimates, z=DefaultConfidence):
+    """
+    Returns the mean of the batch estimates of every rank and the
+    half-width of its confidence interval (infinite with one batch).
+    """
+
+    mean = estimates.mean(axis=0)
+    batches = estimates.shape[0]
+    if batches < 2:
+        return mean, np.inf * np.ones(len(mean))
+    error = estimates.std(axis=0, ddof=1) / np.sqrt(batches)
+    return mean, z * error
+
+def top_k_bounds(mean, halfwidth, k=20):
+    """
+    Returns the dense indices of the top-k by estimated rank, the
+    length of the prefix of the top-k that is certain (its intervals
+    do not overlap each other or the rest), and the candidates: every
+    node whose interval reaches the interval of the k-th node.
+    """
+
+    order = np.lexsort((np.arange(len(mean)), -mean))
+    top = order[:k]
+    lower = mean - halfwidth
+    upper = mean + halfwidth
+
+    certain = 0
+    for i in range(len(top)):
+        rest = order[i + 1:]
+        if len(rest) and lower[top[i]] <= upper[rest].max():
+            break
+        certain += 1
+
+    if len(top):
+        candidates = np.flatnonzero(upper >= lower[top[-1]])
+    else:
+        candidates = top
+    return top, certain, candidates
+
+def neighborhood(graph, nodes, hops=DefaultHops, budget=None,
+                 weights=None):
+    """
+    Returns the sorted dense indices of the nodes and of every node
+    within `hops` in-links of them. If that is more than `budget` nodes,
+    the hop that crosses the budget only adds the nodes with the largest
+    `weights` that fit, and no further hops are made.
+    """
+
+    in_indptr, in_sources = graph.in_links()
+    active = np.unique(nodes)
+    frontier = active
+    for i in range(hops):
+        sources = in_sources[_in_edges(in_indptr, frontier)]
+        frontier = np.setdiff1d(np.unique(sources), active)
+        if budget is not None and len(active) + len(frontier) > budget:
+            room = max(budget - len(active), 0)
+            order = np.argsort(-weights[frontier], kind='mergesort')
+            active = np.union1d(active, frontier[order[:room]])
+            break
+        if not len(frontier):
+            break
+        active = np.union1d(active, frontier)
+    return active
+
+def _in_edges(in_indptr, nodes):
+    """
+    Returns the positions of the in-links of the nodes in the in-link
+    arrays, in order.
+    """
+
+    starts = in_indptr[nodes]
+    counts = in_indptr[nodes + 1] - starts
+    firsts = np.cumsum(counts) - counts
+    return np.repeat(starts - firsts, counts) + np.arange(counts.sum())
+
+def refine(graph, ranks, candidates, k=20, alpha=DefaultAlpha,
+           dangling=DefaultDangling, max_iter=1000, stop_slack=1.0,
+           hops=DefaultHops, budget=DefaultBudget):
+    """
+    Runs power iterations from the estimated ranks on the candidates
+    and the nodes within `hops` in-links of them only, at most `budget`
+    nodes in all (see neighborhood()), where the nodes that send the
+    largest shares of rank come first; the ranks of the other nodes
+    stay frozen at their estimates. The iterations stop
+    when the candidates are separated: every gap between consecutive
+    ranks among the top k + 1 candidates exceeds 2 * stop_slack * B,
+    where B = alpha / (1 - alpha) * residual bounds the distance of
+    every updated rank to the limit of the local system (see
+    process_reduce.py). Returns the ranks, the number of iterations
+    and the number of updated nodes.
+    """
+
+    if dangling not in ('self', 'uniform', 'drop'):
+        raise ValueError('unknown dangling mode %r' % (dangling))
+
+    n = graph.num_nodes
+    in_indptr, in_sources = graph.in_links()
+    degrees = graph.out_degrees()
+
+    shares = ranks / np.maximum(degrees, 1)
+    active = neighborhood(graph, candidates, hops, budget, shares)
+    sources = in_sources[_in_edges(in_indptr, active)]
+    rows = np.repeat(np.arange(len(active)),
+                     in_indptr[active + 1] - in_indptr[active])
+    unlinked = degrees[active] == 0
+
+    # The frozen part of the rank held by dangling nodes
+    frozen_dangling = ranks[degrees == 0].sum() - ranks[active][unlinked].sum()
+
+    ranks = np.array(ranks, dtype=np.float64)
+    position = np.searchsorted(active, candidates)
+    for i in range(1, max_iter + 1):
+        sums = np.bincount(rows, weights=ranks[sources] / degrees[sources],
+                           minlength=len(active))
+        if dangling == 'self':
+            sums[unlinked] += ranks[active][unlinked]
+        elif dangling == 'uniform':
+            sums += (frozen_dangling + ranks[active][unlinked].sum()) / n
+
+        new_ranks = (1 - alpha) + alpha * sums
+        bound = alpha / (1 - alpha) * np.abs(new_ranks - ranks[active]).sum()
+        ranks[active] = new_ranks
+
+        top = np.sort(new_ranks[position])[::-1][:k + 1]
+        if (np.diff(top) < -2 * stop_slack * bound).all():
+            break
+
+    return ranks, i, len(active)
+
+def node_ids(graph, nodes):
+    """
+    Returns the identifiers of dense node indices.
+    """
+
+    return [int(node) for node in graph.node_ids[nodes]]
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile',
+                          description='The input is either a text or a '
+                                      'binary CSR graph.')
+    parser.add_option('-k', type='int', default=20,
+                      help='number of top nodes to report [%default]')
+    parser.add_option('-a', '--alpha', type='float', default=DefaultAlpha,
+                      help='damping factor [%default]')
+    parser.add_option('-d', '--dangling', default=DefaultDangling,
+                      choices=('self', 'uniform', 'drop'),
+                      help='dangling node handling: self, uniform or '
+                           'drop [%default]')
+    parser.add_option('-R', '--walks', type='int', default=DefaultWalks,
+                      help='random walks per node [%default]')
+    parser.add_option('-b', '--batches', type='int', default=DefaultBatches,
+                      help='batches for the confidence intervals '
+                           '[%default]')
+    parser.add_option('-z', type='float', default=DefaultConfidence,
+                      help='z-score of the confidence intervals '
+                           '[%default]')
+    parser.add_option('-w', '--workers', type='int',
+                      help='number of worker processes, or 0 for none '
+                           '[number of CPUs]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='random seed [%default]')
+    parser.add_option('-r', '--refine', action='store_true', default=False,
+                      help='refine the candidates with power iterations')
+    parser.add_option('-H', '--hops', type='int', default=DefaultHops,
+                      help='in-link hops around the candidates updated by '
+                           '--refine [%default]')
+    parser.add_option('-B', '--budget', type='int', default=DefaultBudget,
+                      help='most nodes updated by --refine [%default]')
+    parser.add_option('-c', '--check', metavar='SOLUTION',
+                      help='compare the top-k against a solution file')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected exactly one input file')
+
+    graph = CSRGraph.load(args[0])
+
+    start = time()
+    estimates, num_steps = random_walks(graph, options.walks, options.alpha,
+                                        options.dangling, options.batches,
+                                        options.workers, options.seed)
+    mean, halfwidth = confidence(estimates, options.z)
+    top, certain, candidates = top_k_bounds(mean, halfwidth, options.k)
+    walk_time = time() - start
+
+    sys.stderr.write('%d nodes, %d edges: %d walks per node, %d steps in '
+                     '%.3fs; top %d of %d certain, %d candidates\n'
+                     % (graph.num_nodes, graph.num_edges, options.walks,
+                        num_steps, walk_time, certain, len(top),
+                        len(candidates)))
+
+    ranks = mean
+    if options.refine:
+        start = time()
+        ranks, num_iter, num_active = refine(graph, mean, candidates,
+                                             options.k, options.alpha,
+                                             options.dangling,
+                                             hops=options.hops,
+                                             budget=options.budget)
+        sys.stderr.write('refined %d nodes in %d iterations (%.3fs)\n'
+                         % (num_active, num_iter, time() - start))
+        order = candidates[np.lexsort((candidates, -ranks[candidates]))]
+        nodes = node_ids(graph, order[:options.k])
+        for node in nodes:
+            sys.stdout.write('%d\n' % (node))
+    else:
+        nodes = node_ids(graph, top)
+        for i, node in zip(top, nodes):
+            sys.stdout.write('%d\t%.6f\t%.6f\n'
+                             % (node, mean[i], halfwidth[i]))
+
+    if options.check:
+        expected = read_solution(options.check)
+        if nodes == expected[:options.k]:
+            sys.stderr.write('matches %s\n' % (options.check))
+        else:
+            sys.stderr.write('DIFFERS from %s\n' % (options.check))
+            sys.exit(1)
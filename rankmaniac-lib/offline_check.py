@@ -0,0 +1,657 @@
+"""
+Offline checks of the Amazon S3 and EMR logic of rankmaniac.py.
+
+The Rankmaniac class only talks to Amazon through boto's S3Connection,
+EmrConnection and MultiPartUpload, so this tool swaps them for small
+in-memory fakes that record every request, and runs the parts of the
+class (and of the job monitor) that are easy to get wrong without an
+AWS account:
+
+    listing     is_done() finds the outputs in one listing, past keys
+                that sort before the iteration numbers (such as
+                '.DS_Store' or '-graph'), and only probes new outputs.
+
+    submit      submit() sends the steps queued by do_iter() in batches
+                of MaxStepsPerCall, clears the outputs in one pass, and
+                resumes after a throttled call.
+
+    upload      upload() skips the files whose MD5 matches the ETag of
+                their key (multipart ones included), sends the others
+                in parallel and removes the stale keys.
+
+    download    download() skips the complete files, resumes a partial
+                file only for the same ETag, starts over when the whole
+                key comes back instead of the rest of it, and rejects a
+                file that does not match its ETag.
+
+    monitor     A JobMonitor (see job_monitor.py) keeps to the rate of
+                its token bucket, reports every change of state, keeps
+                polling after a throttled call, never uses its
+                connection from two threads at once, and describes jobs
+                directly once stopped.
+
+Every check prints 'ok' or what went wrong, and the exit status is the
+number of failed checks.
+
+Special notes:
+    WARNING! Requires Python >= 2.6 and boto (which is never used to
+    make a request).
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import sys, os
+import shutil
+import tempfile
+import threading
+import traceback
+from optparse import OptionParser
+from StringIO import StringIO
+from time import sleep, time
+
+from hashlib import md5
+
+from boto.exception import EmrResponseError
+
+import rankmaniac
+import job_monitor
+from rankmaniac import Rankmaniac
+from job_monitor import JobMonitor, TokenBucket
+
+class FakeAWS:
+    """
+    (fake class)
+
+    The contents of the fake S3 bucket and the requests made to the
+    fakes, shared by all the fake connections.
+    """
+
+    def __init__(self):
+        self.store = {}     # keyname: contents
+        self.etags = {}     # keyname: ETag of multipart uploads
+        self.calls = []
+        self.parts = {}     # upload id: {part number: contents}
+        self.throttled = () # the EMR calls to throttle (from 1)
+        self.emr_calls = 0
+        self.corrupt = False
+        self.ranges = True  # whether GET requests honour 'Range'
+        self.states = {}    # job flow id: state
+        self.emr_lock = threading.Lock() # held by the EMR call under way
+        self._lock = threading.Lock()
+
+    def log(self, *call):
+        self._lock.acquire()
+        try:
+            self.calls.append(call)
+        finally:
+            self._lock.release()
+
+    def take_calls(self, kind=None):
+        """
+        Returns the requests made so far (of one kind only if `kind` is
+        set), and forgets them all.
+        """
+
+        calls = self.calls
+        self.calls = []
+        if kind is not None:
+            calls = [call for call in calls if call[0] == kind]
+        return calls
+
+    def etag(self, keyname):
+        if keyname in self.etags:
+            return self.etags[keyname]
+        return '"%s"' % (md5(self.store[keyname]).hexdigest())
+
+# The fakes in use
+_aws = FakeAWS()
+
+def _byte_range(headers, size):
+    """
+    Returns the offsets of the 'Range' header of a request.
+    """
+
+    if not headers or 'Range' not in headers:
+        return 0, size
+    first, last = headers['Range'][len('bytes='):].split('-')
+    if not last:
+        return int(first), size
+    return int(first), int(last) + 1
+
+class FakeKey:
+    """
+    (fake class)
+
+    A key of the fake bucket.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        if name in _aws.store:
+            self.etag = _aws.etag(name)
+            self.size = len(_aws.store[name])
+
+    def get_contents_as_string(self, headers=None):
+        contents = _aws.store[self.name]
+        first, last = _byte_range(headers, len(contents))
+        _aws.log('get', self.name, first)
+        return contents[first:last]
+
+    def open_read(self, headers=None):
+        contents = _aws.store[self.name]
+        first, last = _byte_range(headers, len(contents))
+        self.resp = FakeResponse(200)
+        if headers and 'Range' in headers:
+            if _aws.ranges and \
+               headers.get('If-Range') == _aws.etag(self.name):
+                self.resp = FakeResponse(206)
+            else:
+                first, last = 0, len(contents) # the whole key
+        _aws.log('get', self.name, first)
+        if _aws.corrupt:
+            contents = 'x' * len(contents)
+        self._data = contents[first:last]
+
+    def read(self, size=0):
+        data = self._data[:size]
+        self._data = self._data[size:]
+        return data
+
+    def close(self):
+        self.resp = None
+
+    def set_contents_from_filename(self, filename):
+        _aws.log('put', self.name)
+        _aws.store[self.name] = open(filename, 'rb').read()
+        _aws.etags.pop(self.name, None)
+
+class FakeResponse:
+    """
+    (fake class)
+
+    The response to a GET request.
+    """
+
+    def __init__(self, status):
+        self.status = status
+
+class FakeBucket:
+    """
+    (fake class)
+
+    The bucket of the submissions.
+    """
+
+    def list(self, prefix='', marker=''):
+        _aws.log('list', prefix)
+        return [FakeKey(name) for name in sorted(_aws.store)
+                if name.startswith(prefix) and name > marker]
+
+    def new_key(self, name):
+        return FakeKey(name)
+
+    def delete_keys(self, keys):
+        names = sorted([key.name for key in keys])
+        _aws.log('delete', names)
+        for name in names:
+            del _aws.store[name]
+            _aws.etags.pop(name, None)
+
+    def initiate_multipart_upload(self, name):
+        upload = FakeMultiPartUpload(self)
+        upload.key_name = name
+        upload.id = 'upload-' + name
+        _aws.parts[upload.id] = {}
+        return upload
+
+class FakeMultiPartUpload:
+    """
+    (fake class)
+
+    A multipart upload, which may be resumed from any thread.
+    """
+
+    def __init__(self, bucket=None):
+        self.key_name = None
+        self.id = None
+
+    def upload_part_from_file(self, f, part_num, size=None):
+        _aws.log('part', self.key_name, part_num)
+        _aws.parts[self.id][part_num] = f.read(size)
+
+    def complete_upload(self):
+        parts = _aws.parts.pop(self.id)
+        numbers = sorted(parts)
+        _aws.log('complete', self.key_name, len(numbers))
+        _aws.store[self.key_name] = ''.join([parts[i] for i in numbers])
+        digests = ''.join([md5(parts[i]).digest() for i in numbers])
+        _aws.etags[self.key_name] = '"%s-%d"' % (md5(digests).hexdigest(),
+                                                 len(numbers))
+
+    def cancel_upload(self):
+        _aws.log('cancel', self.key_name)
+        _aws.parts.pop(self.id, None)
+
+class FakeConnection:
+    """
+    (fake class)
+
+    A connection to Amazon S3 or EMR.
+    """
+
+    def __init__(self, access_key=None, secret_key=None, region=None):
+        self.aws_access_key_id = access_key
+
+    def get_bucket(self, name, validate=True):
+        return FakeBucket()
+
+    def run_jobflow(self, name=None, steps=None, **kwargs):
+        self._throttle()
+        _aws.log('run', len(steps))
+        return 'j-FAKE'
+
+    def add_jobflow_steps(self, job_id, steps):
+        self._throttle()
+        _aws.log('add', len(steps))
+
+    def terminate_jobflow(self, job_id):
+        _aws.log('terminate', job_id)
+
+    def describe_jobflows(self, jobflow_ids=None):
+        self._enter('describe', len(jobflow_ids))
+        try:
+            return [FakeJobFlow(job_id) for job_id in jobflow_ids]
+        finally:
+            _aws.emr_lock.release()
+
+    def describe_jobflow(self, job_id):
+        self._enter('describe', 1)
+        try:
+            return FakeJobFlow(job_id)
+        finally:
+            _aws.emr_lock.release()
+
+    def close(self):
+        pass
+
+    def _throttle(self):
+        _aws.emr_calls += 1
+        if _aws.emr_calls in _aws.throttled:
+            _aws.log('throttled')
+            raise EmrResponseError(400, 'Throttling')
+
+    def _enter(self, *call):
+        # Takes the EMR lock for a call, noting any call still under way
+        if not _aws.emr_lock.acquire(False):
+            _aws.log('overlap')
+            _aws.emr_lock.acquire()
+        try:
+            _aws.log(*call)
+            self._throttle()
+            sleep(0.001) # long enough for another thread to overlap
+        except:
+            _aws.emr_lock.release()
+            raise
+
+class FakeJobFlow:
+    """
+    (fake class)
+
+    The description of a job flow.
+    """
+
+    def __init__(self, job_id):
+        self.jobflowid = job_id
+        self.state = _aws.states.get(job_id, 'STARTING')
+
+def install():
+    """
+    Replaces the boto classes used by rankmaniac.py with the fakes,
+    which start out empty.
+    """
+
+    global _aws
+    _aws = FakeAWS()
+    rankmaniac.S3Connection = FakeConnection
+    rankmaniac.EmrConnection = FakeConnection
+    rankmaniac.MultiPartUpload = FakeMultiPartUpload
+
+def expect(actual, expected, what):
+    """
+    Raises an AssertionError if `actual` is not `expected`.
+    """
+
+    if actual != expected:
+        raise AssertionError('%s: expected %r, got %r'
+                             % (what, expected, actual))
+
+def check_listing(workdir):
+    """
+    Checks that is_done() lists the outputs once per call and only
+    probes the first part of the new process-step outputs.
+    """
+
+    store = _aws.store
+    for name in ('input.txt', 'job_logs/j-FAKE/steps/1/stderr', '.DS_Store',
+                 '-graph', '+x'):
+        store['team/' + name] = 'x'
+
+    r = Rankmaniac('team', 'access', 'secret')
+    expect(r.is_done(), False, 'is_done() without outputs')
+    expect(len(_aws.take_calls('list')), 1, 'listings')
+
+    for i in range(12):
+        store['team/%d/pagerank/part-00000' % (i)] = 'NodeId:1\t1.0,1.0\n'
+        store['team/%d/process/part-00000' % (i)] = 'NodeId:1\t1.0,1.0\n'
+        store['team/%d/process/part-00001' % (i)] = ''
+        store['team/%d/process_$folder$' % (i)] = ''
+    expect(r.is_done(), False, 'is_done() before FinalRank')
+    calls = _aws.take_calls()
+    expect(len([c for c in calls if c[0] == 'list']), 1, 'listings')
+    expect(len([c for c in calls if c[0] == 'get']), 12, 'probes')
+
+    expect(r.is_done(), False, 'is_done() with nothing new')
+    expect(_aws.take_calls('get'), [], 'probes of old outputs')
+
+    store['team/12/process/part-00000'] = 'FinalRank:1.0\t1\n'
+    store['team/12/process/part-00001'] = ''
+    expect(r.is_done(), True, 'is_done() after FinalRank')
+    expect(_aws.take_calls('get'),
+           [('get', 'team/12/process/part-00000', 0)], 'probes')
+
+    expect(r.is_done(), True, 'cached is_done()')
+    expect(_aws.take_calls(), [], 'requests of a cached is_done()')
+
+def check_submit(workdir):
+    """
+    Checks that submit() sends the queued steps in batches, clears the
+    outputs of every step in one listing, and resumes after a failed
+    call.
+    """
+
+    store = _aws.store
+    for name in ('0/pagerank/part-00000', '0/pagerank/_logs/history',
+                 '3/process/part-00000', '77/process/part-00000',
+                 'input.txt', 'custom/part-00000'):
+        store['team/' + name] = 'x'
+
+    r = Rankmaniac('team', 'access', 'secret')
+    r.MaxStepsPerCall = 30
+    r.set_infile('input.txt')
+    for i in range(50):
+        r.do_iter('pagerank_map.py', 'pagerank_reduce.py',
+                  'process_map.py', 'process_reduce.py', submit=False)
+    r.do_iter('pagerank_map.py', 'pagerank_reduce.py',
+              'process_map.py', 'process_reduce.py',
+              pagerank_output='custom/', process_output='custom2/',
+              submit=False)
+    expect(_aws.take_calls(), [], 'requests before submit()')
+
+    _aws.throttled = (2,)
+    try:
+        r.submit()
+    except EmrResponseError:
+        pass
+    else:
+        raise AssertionError('submit() was not throttled')
+    calls = _aws.take_calls()
+    expect(len([c for c in calls if c[0] == 'list']), 3, 'listings')
+    expect([c for c in calls if c[0] == 'delete'],
+           [('delete', ['team/0/pagerank/_logs/history',
+                        'team/0/pagerank/part-00000',
+                        'team/3/process/part-00000',
+                        'team/custom/part-00000'])], 'deleted outputs')
+    expect([c for c in calls if c[0] in ('run', 'add')], [('run', 30)],
+           'submitted steps')
+    expect(len(r._pending_steps), 72, 'steps left queued')
+
+    r.submit()
+    expect([c for c in _aws.take_calls() if c[0] != 'throttled'],
+           [('add', 30), ('add', 30), ('add', 12)], 'resumed steps')
+
+    r.do_iter('pagerank_map.py', 'pagerank_reduce.py',
+              'process_map.py', 'process_reduce.py')
+    expect([c for c in _aws.take_calls() if c[0] == 'add'], [('add', 2)],
+           'steps of do_iter()')
+    r.terminate()
+
+def check_upload(workdir):
+    """
+    Checks that upload() skips the unchanged files, sends large files
+    in parts and removes the stale keys.
+    """
+
+    indir = os.path.join(workdir, 'data')
+    os.mkdir(indir)
+    for name, contents in (('a.py', 'a\n'), ('b.py', 'b\n'),
+                           ('big.txt', 'x' * 2500)):
+        f = open(os.path.join(indir, name), 'w')
+        try:
+            f.write(contents)
+        finally:
+            f.close()
+    for name in ('old.py', '3/process/part-00000', 'job_logs/x'):
+        _aws.store['team/' + name] = 'x'
+
+    r = Rankmaniac('team', 'access', 'secret')
+    r.MultipartThreshold = 1000
+    r.MultipartPartSize = 1000
+    expect(r.upload(indir, workers=4), (['a.py', 'b.py', 'big.txt'], []),
+           'first upload')
+    calls = _aws.take_calls()
+    expect(sorted([c for c in calls if c[0] != 'list']),
+           [('complete', 'team/big.txt', 3),
+            ('delete', ['team/3/process/part-00000', 'team/job_logs/x',
+                        'team/old.py']),
+            ('part', 'team/big.txt', 1), ('part', 'team/big.txt', 2),
+            ('part', 'team/big.txt', 3),
+            ('put', 'team/a.py'), ('put', 'team/b.py')], 'first upload')
+    expect(_aws.store['team/big.txt'], 'x' * 2500, 'multipart contents')
+
+    expect(r.upload(indir), ([], ['a.py', 'b.py', 'big.txt']),
+           'upload of unchanged files')
+    expect([c for c in _aws.take_calls() if c[0] != 'list'], [],
+           'upload of unchanged files')
+
+    f = open(os.path.join(indir, 'b.py'), 'w')
+    try:
+        f.write('bb\n')
+    finally:
+        f.close()
+    expect(r.upload(indir), (['b.py'], ['a.py', 'big.txt']),
+           'upload of a changed file')
+    expect([c for c in _aws.take_calls() if c[0] != 'list'],
+           [('put', 'team/b.py')], 'upload of a changed file')
+
+def check_download(workdir):
+    """
+    Checks that download() skips the complete files, resumes partial
+    files with the same ETag, restarts the others, and rejects a file
+    that does not match its ETag.
+    """
+
+    store = _aws.store
+    for i in range(3):
+        for step in ('pagerank', 'process'):
+            store['team/%d/%s/part-00000' % (i, step)] = \
+                '%d%s' % (i, step) * 100
+            store['team/%d/%s_$folder$' % (i, step)] = ''
+    store['team/input.txt'] = 'x'
+
+    outdir = os.path.join(workdir, 'results')
+    r = Rankmaniac('team', 'access', 'secret')
+    downloaded, complete = r.download(outdir, filters=['process'])
+    expect((len(downloaded), complete), (3, []), 'first download')
+    _aws.take_calls()
+
+    # A partial file with the same ETag is resumed
+    resumed = os.path.join(outdir, '1', 'process', 'part-00000')
+    keyname = 'team/1/process/part-00000'
+    os.rename(resumed, resumed + '.part')
+    f = open(resumed + '.part', 'r+')
+    try:
+        f.truncate(250)
+    finally:
+        f.close()
+    rankmaniac._write_file(resumed + '.part.etag',
+                           _aws.etag(keyname).strip('"'))
+
+    # and a partial file of an older version is restarted
+    restarted = os.path.join(outdir, '2', 'process', 'part-00000')
+    os.rename(restarted, restarted + '.part')
+    rankmaniac._write_file(restarted + '.part.etag', 'older')
+
+    downloaded, complete = r.download(outdir, filters=['process'])
+    expect((len(downloaded), len(complete)), (2, 1), 'second download')
+    expect(sorted(_aws.take_calls('get')),
+           [('get', keyname, 250),
+            ('get', 'team/2/process/part-00000', 0)], 'resumed downloads')
+    for filename, keyname in ((resumed, keyname),
+                              (restarted, 'team/2/process/part-00000')):
+        expect(rankmaniac._read_file(filename), store[keyname],
+               'contents of ' + keyname)
+        expect(os.path.exists(filename + '.part'), False,
+               'partial file of ' + keyname)
+
+    # A partial file is started over if the whole key comes back
+    os.rename(resumed, resumed + '.part')
+    f = open(resumed + '.part', 'r+')
+    try:
+        f.truncate(250)
+    finally:
+        f.close()
+    keyname = 'team/1/process/part-00000'
+    rankmaniac._write_file(resumed + '.part.etag',
+                           _aws.etag(keyname).strip('"'))
+    _aws.ranges = False
+    downloaded, complete = r.download(outdir, filters=['process'])
+    _aws.ranges = True
+    expect(len(downloaded), 1, 'download of the whole key')
+    expect(rankmaniac._read_file(resumed), store[keyname],
+           'contents after the whole key')
+
+    # A download that does not match its ETag is not kept
+    corrupt = os.path.join(outdir, '0', 'process', 'part-00000')
+    os.remove(corrupt)
+    _aws.corrupt = True
+    try:
+        r.download(outdir, filters=['process'])
+    except rankmaniac.RankmaniacError:
+        pass
+    else:
+        raise AssertionError('a corrupt download was accepted')
+    expect(os.path.exists(corrupt) or os.path.exists(corrupt + '.part'),
+           False, 'corrupt download')
+
+def check_monitor(workdir):
+    """
+    Checks that a JobMonitor keeps to its rate, reports the states of
+    the jobs, keeps polling after being throttled, serializes its
+    requests, and describes the jobs itself once stopped.
+    """
+
+    bucket = TokenBucket(rate=20, burst=2)
+    start = time()
+    for i in range(4):
+        bucket.acquire()
+    expect(time() - start >= 0.09, True, 'wait for the tokens past burst')
+    bucket.penalize(0.2)
+    start = time()
+    bucket.acquire()
+    expect(time() - start >= 0.2, True, 'wait after a penalty')
+
+    # The errors of the monitor go to stderr
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    backoff = job_monitor.ThrottleBackoff
+    job_monitor.ThrottleBackoff = 0.1
+    monitor = JobMonitor(FakeConnection('check-monitor'), interval=0.01,
+                         rate=1000, burst=10)
+    try:
+        _aws.states['j-1'] = 'RUNNING'
+        states = []
+        watch = monitor.watch('j-1', lambda jobflow: states.append(
+                                  jobflow.state))
+        expect(monitor.describe('j-1', timeout=5).state, 'RUNNING',
+               'described state')
+        _aws.states['j-1'] = 'COMPLETED'
+        expect(watch.wait(5) is not None, True, 'finished job')
+        expect(states, ['RUNNING', 'COMPLETED'], 'states reported')
+
+        # A throttled poll is logged, and the polling goes on
+        _aws.throttled = set(range(_aws.emr_calls + 1,
+                                   _aws.emr_calls + 3))
+        _aws.states['j-2'] = 'RUNNING'
+        watch = monitor.watch('j-2')
+        _aws.take_calls()
+        expect(watch.describe(5) is not None, True, 'described after throttle')
+        expect('Throttling' in (monitor.error or ''), True, 'logged error')
+        expect(len(_aws.take_calls('throttled')) > 0, True, 'throttled polls')
+
+        # Callers that describe jobs directly wait for the poll in flight
+        threads = [threading.Thread(target=monitor.describe,
+                                    args=('j-%d' % (i), 0))
+                   for i in range(3, 23)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expect(_aws.take_calls('overlap'), [], 'concurrent requests')
+
+        # Once stopped, the monitor describes the jobs itself
+        monitor.stop()
+        _aws.states['j-99'] = 'FAILED'
+        expect(monitor.describe('j-99', timeout=0.1).state, 'FAILED',
+               'direct description')
+    finally:
+        monitor.stop()
+        job_monitor.ThrottleBackoff = backoff
+        sys.stderr = stderr
+
+Checks = (
+    ('listing', check_listing),
+    ('submit', check_submit),
+    ('upload', check_upload),
+    ('download', check_download),
+    ('monitor', check_monitor),
+)
+
+def run_checks(names=None, verbose=False):
+    """
+    Runs the checks (all of them by default) with fresh fakes and
+    returns the number of failures.
+    """
+
+    failures = 0
+    for name, check in Checks:
+        if names and name not in names:
+            continue
+        install()
+        workdir = tempfile.mkdtemp(prefix='rankmaniac-check-')
+        try:
+            check(workdir)
+            print('%-10s ok' % (name))
+        except Exception, e:
+            failures += 1
+            print('%-10s FAILED: %s' % (name, e))
+            if verbose:
+                traceback.print_exc()
+        shutil.rmtree(workdir, True)
+    return failures
+
+if __name__ == '__main__':
+
+    names = [name for name, check in Checks]
+    parser = OptionParser(usage='%%prog [options] [%s ...]'
+                                % ('|'.join(names)))
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help='print the traceback of every failure')
+    (options, args) = parser.parse_args()
+
+    for arg in args:
+        if arg not in names:
+            parser.error('unknown check %r' % (arg))
+
+    sys.exit(run_checks(args, options.verbose))
@@ -0,0 +1,258 @@
+"""
+Multi-core reference pagerank engine.
+
+Like local_engine.py, but every iteration is split over a pool of
+worker processes. The graph is stored by in-links (each row lists the
+nodes linking to it) and cut into row blocks of roughly equal work,
+so each worker computes the new ranks of its own blocks and writes
+them straight into the result; no sums have to be merged. The graph,
+the rank shares and both rank vectors live in shared memory, created
+before the workers are started, so an iteration only sends the bounds
+of each block to the workers and receives a partial sum back.
+
+Special notes:
+    Requires NumPy and Python >= 2.6 on a Unix system.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+import sys
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from optparse import OptionParser
+from time import time
+
+import numpy as np
+
+from local_engine import CSRGraph, DefaultAlpha, DefaultDangling, top_k, \
+                         read_solution
+
+DefaultBlocksPerWorker = 4
+
+# The shared arrays, as seen by the worker processes
+_shared = {}
+
+def _share_array(array, ctype, dtype):
+    """
+    Returns a copy of an array in shared memory, as the raw shared
+    array and a NumPy view of it.
+    """
+
+    raw = RawArray(ctype, max(len(array), 1))
+    view = np.frombuffer(raw, dtype=dtype)[:len(array)]
+    view[:] = array
+    return raw, view
+
+def _init_worker(arrays):
+    """
+    Maps the shared arrays in a worker process.
+    """
+
+    for name, (raw, dtype, length) in arrays.items():
+        _shared[name] = np.frombuffer(raw, dtype=dtype)[:length]
+
+def _block_shares(args):
+    """
+    Computes the rank shares of the nodes lo ... hi - 1 from the rank
+    vector `src`, and returns the rank held by the dangling ones.
+    """
+
+    lo, hi, src = args
+    ranks = _shared['ranks%d' % (src)][lo:hi]
+    degrees = _shared['degrees'][lo:hi]
+    linked = degrees > 0
+
+    share = _shared['share'][lo:hi]
+    share[:] = 0.0
+    share[linked] = ranks[linked] / degrees[linked]
+    return float(ranks[~linked].sum())
+
+def _block_ranks(args):
+    """
+    Computes the new ranks of the nodes lo ... hi - 1 into the rank
+    vector `dst`, and returns their L1 change.
+    """
+
+    lo, hi, src, dst, alpha, dangling, uniform = args
+    indptr = _shared['indptr']
+    start, stop = int(indptr[lo]), int(indptr[hi])
+
+    rows = np.repeat(np.arange(hi - lo), np.diff(indptr[lo:hi + 1]))
+    weights = _shared['share'][_shared['indices'][start:stop]]
+    sums = np.bincount(rows, weights=weights,
+                       minlength=hi - lo).astype(np.float64)
+
+    ranks = _shared['ranks%d' % (src)][lo:hi]
+    if dangling == 'self':
+        unlinked = _shared['degrees'][lo:hi] == 0
+        sums[unlinked] += ranks[unlinked]
+    elif dangling == 'uniform':
+        sums += uniform
+
+    new_ranks = _shared['ranks%d' % (dst)][lo:hi]
+    new_ranks[:] = (1 - alpha) + alpha * sums
+    return float(np.abs(new_ranks - ranks).sum())
+
+class ParallelEngine:
+    """
+    (engine class)
+
+    Runs pagerank on a graph in shared memory with a pool of worker
+    processes. Call close() when done to stop the workers.
+    """
+
+    def __init__(self, graph, workers=None,
+                 blocks_per_worker=DefaultBlocksPerWorker):
+        """
+        (constructor)
+
+        Arguments:
+            graph         <CSRGraph>    the graph (see local_engine).
+
+        Keyword arguments:
+            workers       <int>         the number of worker processes;
+                                        defaults to the number of CPUs.
+
+            blocks_per_worker <int>     the number of row blocks per
+                                        worker, which evens out the
+                                        work when some blocks are
+                                        slower than others.
+        """
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        self.graph = graph
+        n = graph.num_nodes
+
+        # Store the graph by in-links
+        indptr, indices = graph.in_links()
+
+        arrays = {}
+        self._views = {}
+        for name, array, ctype, dtype in (
+                ('indptr', indptr, ctypes.c_int64, np.int64),
+                ('indices', indices, ctypes.c_int64, np.int64),
+                ('degrees', graph.out_degrees(), ctypes.c_int64, np.int64),
+                ('share', np.zeros(n), ctypes.c_double, np.float64),
+                ('ranks0', np.zeros(n), ctypes.c_double, np.float64),
+                ('ranks1', np.zeros(n), ctypes.c_double, np.float64)):
+            raw, view = _share_array(array, ctype, dtype)
+            arrays[name] = (raw, dtype, len(array))
+            self._views[name] = view
+
+        # Cut the rows into blocks with about the same number of
+        # in-links (counting one for every node)
+        num_blocks = max(1, min(n, workers * blocks_per_worker))
+        cost = indptr + np.arange(n + 1)
+        bounds = np.searchsorted(cost, np.linspace(0, cost[-1],
+                                                   num_blocks + 1))
+        bounds[0], bounds[-1] = 0, n
+        self.blocks = [(int(lo), int(hi))
+                       for lo, hi in zip(bounds[:-1], bounds[1:]) if lo < hi]
+
+        self.workers = workers
+        self._pool = multiprocessing.Pool(workers, _init_worker, (arrays,))
+
+    def close(self):
+        """
+        Stops the workers.
+        """
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def pagerank(self, alpha=DefaultAlpha, tol=1e-10, max_iter=1000,
+                 dangling=DefaultDangling, ranks=None, callback=None):
+        """
+        Runs power iteration like local_engine.pagerank(), and returns
+        the ranks and the number of iterations performed.
+        """
+
+        if dangling not in ('self', 'uniform', 'drop'):
+            raise ValueError('unknown dangling mode %r' % (dangling))
+        if ranks is None:
+            ranks = self.graph.ranks
+        n = self.graph.num_nodes
+
+        src, dst = 0, 1
+        self._views['ranks0'][:] = ranks
+        for i in range(1, max_iter + 1):
+            held = self._pool.map(_block_shares, [(lo, hi, src)
+                                                  for lo, hi in self.blocks])
+            uniform = sum(held) / n
+            changes = self._pool.map(_block_ranks,
+                                     [(lo, hi, src, dst, alpha, dangling,
+                                       uniform)
+                                      for lo, hi in self.blocks])
+            residual = sum(changes) / n
+            src, dst = dst, src
+
+            if callback is not None:
+                callback(i, self._views['ranks%d' % (src)])
+            if residual < tol:
+                break
+
+        return np.array(self._views['ranks%d' % (src)]), i
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile',
+                          description='The input is either a text or a '
+                                      'binary CSR graph.')
+    parser.add_option('-k', type='int', default=20,
+                      help='number of top nodes to report [%default]')
+    parser.add_option('-a', '--alpha', type='float', default=DefaultAlpha,
+                      help='damping factor [%default]')
+    parser.add_option('-t', '--tol', type='float', default=1e-10,
+                      help='L1 convergence tolerance [%default]')
+    parser.add_option('-i', '--max-iter', type='int', default=1000,
+                      help='maximum number of iterations [%default]')
+    parser.add_option('-d', '--dangling', default=DefaultDangling,
+                      choices=('self', 'uniform', 'drop'),
+                      help='dangling node handling: self, uniform or '
+                           'drop [%default]')
+    parser.add_option('-w', '--workers', type='int',
+                      help='number of worker processes [number of CPUs]')
+    parser.add_option('-c', '--check', metavar='SOLUTION',
+                      help='compare the top-k against a solution file')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected exactly one input file')
+
+    start = time()
+    graph = CSRGraph.load(args[0])
+    engine = ParallelEngine(graph, options.workers)
+    load_time = time() - start
+
+    try:
+        start = time()
+        ranks, num_iter = engine.pagerank(options.alpha, options.tol,
+                                          options.max_iter,
+                                          options.dangling)
+        run_time = time() - start
+    finally:
+        engine.close()
+
+    nodes = top_k(graph, ranks, options.k)
+    for node in nodes:
+        sys.stdout.write('%d\n' % (node))
+
+    sys.stderr.write('%d nodes, %d edges: loaded in %.3fs, '
+                     'converged in %d iterations (%.3fs) with %d workers\n'
+                     % (graph.num_nodes, graph.num_edges, load_time,
+                        num_iter, run_time, engine.workers))
+
+    if options.check:
+        expected = read_solution(options.check)
+        if nodes == expected[:options.k]:
+            sys.stderr.write('matches %s\n' % (options.check))
+        else:
+            sys.stderr.write('DIFFERS from %s\n' % (options.check))
+            sys.exit(1)
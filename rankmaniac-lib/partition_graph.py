@@ -0,0 +1,162 @@
+"""
+Splits the static structure of a Rankmaniac input graph into one
+partition per pagerank reducer, for the schimmy mode of the pagerank
+scripts (see data/pagerank_reduce.py).
+
+Each partition holds the nodes that the partitioner of the step (by
+default Hadoop's hash partitioner) sends to that reducer, sorted by
+key like the reducer's input, as lines
+
+    <node>\t<neighbor>,<neighbor>,...
+
+Nodes that only appear as neighbors are included without neighbors.
+The partitions are written to data/ (so that they are uploaded along
+with the scripts) and shipped to the reducers as cache files, which
+means the neighbor lists no longer have to be shuffled every
+iteration.
+
+Special notes:
+    WARNING! Requires Python >= 2.5
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+from __future__ import with_statement # for Python 2.5
+
+import os
+import re
+import bisect
+import tempfile
+from optparse import OptionParser
+
+from partitioner import partition
+
+try:
+    import binary_graph
+except ImportError: # NumPy is not installed
+    binary_graph = None
+
+DefaultPrefix = 'graph'
+
+def part_name(prefix, part):
+    """
+    Returns the filename of a partition.
+    """
+
+    return '%s-%05d' % (prefix, part)
+
+def list_parts(indir, prefix):
+    """
+    Returns the filenames (without the directory) of the partitions
+    with the specified prefix in `indir`, in order.
+    """
+
+    pattern = re.compile(r'^%s-\d{5}$' % (re.escape(prefix)))
+    return sorted([filename for filename in os.listdir(indir)
+                   if pattern.match(filename)])
+
+def _iter_lines(infile):
+    """
+    Yields the lines of a graph in the text input format, decoding a
+    binary CSR graph if necessary.
+    """
+
+    if binary_graph is not None and binary_graph.is_binary(infile):
+        for line in binary_graph.iter_lines(infile):
+            yield line
+    else:
+        with open(infile) as f:
+            for line in f:
+                yield line
+
+def partition_graph(infile, num_parts, outdir='data',
+                    prefix=DefaultPrefix, splits=None):
+    """
+    Writes the partitions of a graph to `outdir` and returns their
+    filenames. Any partitions left over from an earlier run with more
+    reducers are removed.
+
+    The lines are first distributed to unsorted temporary files, so
+    that only one partition is held in memory at a time while it is
+    sorted.
+
+    Keyword arguments:
+        num_parts   <int>       the number of pagerank reducers.
+
+        prefix      <str>       the prefix of the partition filenames,
+                                which is also the value of SCHIMMY_GRAPH.
+
+        splits      <str>       the text split points of a range
+                                partitioner (see reorder_graph.py).
+    """
+
+    split_points = None
+    if splits is not None:
+        with open(splits) as f:
+            split_points = [line.rstrip('\n') for line in f]
+
+    def get_part(node):
+        if split_points is not None:
+            return bisect.bisect_right(split_points, node)
+        return partition(node, num_parts)
+
+    buckets = [tempfile.TemporaryFile() for i in range(num_parts)]
+    try:
+        nodes = set()
+        neighbors = set()
+        for line in _iter_lines(infile):
+            head, rest = line.rstrip('\n').split('\t', 1)
+            node = head[len('NodeId:'):]
+            fields = rest.split(',', 2)
+            links = ''
+            if len(fields) > 2:
+                links = fields[2]
+                neighbors.update(links.split(','))
+            nodes.add(node)
+            buckets[get_part(node)].write(node + '\t' + links + '\n')
+
+        # Nodes that only appear as neighbors have no links
+        for node in neighbors - nodes:
+            buckets[get_part(node)].write(node + '\t\n')
+
+        for filename in list_parts(outdir, prefix):
+            os.remove(os.path.join(outdir, filename))
+
+        filenames = []
+        for part, bucket in enumerate(buckets):
+            bucket.seek(0)
+            lines = bucket.readlines()
+            lines.sort(key=lambda line: line[:line.index('\t')])
+
+            filename = part_name(prefix, part)
+            with open(os.path.join(outdir, filename), 'w') as f:
+                f.writelines(lines)
+            filenames.append(filename)
+    finally:
+        for bucket in buckets:
+            bucket.close()
+
+    return filenames
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile')
+    parser.add_option('-r', '--reducers', type='int', default=1,
+                      help='number of pagerank reducers [%default]')
+    parser.add_option('-o', '--outdir', default='data',
+                      help='directory for the partitions [%default]')
+    parser.add_option('-p', '--prefix', default=DefaultPrefix,
+                      help='prefix of the partition filenames [%default]')
+    parser.add_option('-s', '--splits',
+                      help='split points of a range partitioner, as '
+                           'written by reorder_graph.py')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('expected an input file')
+
+    filenames = partition_graph(args[0], options.reducers, options.outdir,
+                                options.prefix, options.splits)
+    print('Wrote %s' % (', '.join(filenames)))
@@ -0,0 +1,33 @@
+"""
+Hadoop's default partitioning of streaming records, shared by the
+local emulator and the tools that lay out the graph for the reducers.
+
+A streaming key is a Text, which the HashPartitioner sends to reducer
+(hashCode & Integer.MAX_VALUE) % numReduceTasks, where the hash code is
+that of WritableComparator.hashBytes() over the bytes of the key.
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+def hash_key(key):
+    """
+    Returns the hash code Hadoop computes for a Text key, i.e.
+    WritableComparator.hashBytes() as a signed 32-bit integer.
+    """
+
+    h = 1
+    for c in key:
+        h = (31 * h + ord(c)) & 0xFFFFFFFF
+    if h & 0x80000000:
+        h -= 0x100000000
+    return h
+
+def partition(key, num_reducers):
+    """
+    Returns the reducer that receives the specified key under Hadoop's
+    default HashPartitioner.
+    """
+
+    return (hash_key(key) & 0x7FFFFFFF) % num_reducers
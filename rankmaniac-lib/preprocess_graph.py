@@ -0,0 +1,226 @@
+"""
+One-time cleanup and dense renumbering of a Rankmaniac input graph.
+
+Raw inputs may list an edge more than once, link nodes to themselves
+and use sparse identifiers, all of which cost work in every iteration.
+This tool streams the input through an external sort: the records are
+cut into runs of `run_size` lines, each run is sorted in memory and
+written to a temporary file, and the runs are merged. In the merged
+order the records of every node are adjacent, so duplicate edges are
+dropped by comparing each record with the previous one, and self-loops
+on the way. Only the in-degree of every node is held in memory.
+
+The nodes are then renumbered 0 ... n - 1 by decreasing in-degree (ties
+in the order of the original identifiers), so the hubs get the lowest
+identifiers, and the renumbered lines are sorted again so that the
+output lists the nodes in that order, with their neighbors in
+increasing order too. Like reorder_graph.py, the new identifiers are
+zero-padded to the same width, and the tool writes
+
+    <outfile>           the cleaned graph in the text input format
+    <outfile>.map       one '<new id>\t<original id>' line per node
+
+The mapping file is passed to the tasks as a cache file named by
+NODE_MAP, so that the 'FinalRank' lines report the original identifiers
+(see data/process_reduce.py).
+
+Special notes:
+    WARNING! Requires Python >= 2.6
+
+Written for the Rankmaniac competition (2014)
+in CS/EE 144: Ideas behind our Networked World
+at the California Institute of Technology.
+"""
+
+from __future__ import with_statement # for Python 2.5
+
+import os
+import heapq
+import shutil
+import tempfile
+from optparse import OptionParser
+
+DefaultRunSize = 1 << 20 # lines sorted in memory at once
+
+def _write_run(lines, tmpdir):
+    """
+    Sorts a run of lines and writes it to a temporary file, returning
+    its name.
+    """
+
+    lines.sort()
+    fd, filename = tempfile.mkstemp(prefix='run-', dir=tmpdir)
+    with os.fdopen(fd, 'w') as f:
+        f.writelines(lines)
+    return filename
+
+def _merge_runs(filenames):
+    """
+    Yields the lines of sorted files in sorted order.
+    """
+
+    files = [open(filename) for filename in filenames]
+    try:
+        for line in heapq.merge(*files):
+            yield line
+    finally:
+        for f in files:
+            f.close()
+
+def external_sort(lines, tmpdir, run_size=DefaultRunSize):
+    """
+    Returns an iterator over the lines in sorted order, holding at most
+    `run_size` of them in memory. Lines that do not fit in one run are
+    spilled to sorted runs in `tmpdir`.
+    """
+
+    runs = []
+    run = []
+    for line in lines:
+        run.append(line)
+        if len(run) >= run_size:
+            runs.append(_write_run(run, tmpdir))
+            run = []
+
+    if not runs:
+        run.sort()
+        return iter(run)
+    if run:
+        runs.append(_write_run(run, tmpdir))
+    return _merge_runs(runs)
+
+def _records(infile):
+    """
+    Yields a '<node>\t\t<current rank>,<previous rank>' record for every
+    line of the input and a '<node>\t<neighbor>' record for every edge.
+    The empty field sorts the rank of a node before its edges.
+    """
+
+    with open(infile) as f:
+        for line in f:
+            head, rest = line.rstrip('\n').split('\t', 1)
+            node = head[len('NodeId:'):]
+            fields = rest.split(',')
+            yield '%s\t\t%s,%s\n' % (node, fields[0], fields[1])
+            for neighbor in fields[2:]:
+                if neighbor:
+                    yield '%s\t%s\n' % (node, neighbor)
+
+def _groups(filename):
+    """
+    Yields the node, the ranks and the neighbors of every node in a file
+    of sorted, cleaned records.
+    """
+
+    node = None
+    with open(filename) as f:
+        for line in f:
+            src, dst, ranks = (line.rstrip('\n') + '\t').split('\t')[:3]
+            if not dst:
+                if node is not None:
+                    yield node, rank, neighbors
+                node, rank, neighbors = src, ranks, []
+            else:
+                neighbors.append(dst)
+    if node is not None:
+        yield node, rank, neighbors
+
+def preprocess_graph(infile, outfile, mapfile=None, run_size=DefaultRunSize,
+                     tmpdir=None):
+    """
+    Cleans and renumbers a graph, and writes the cleaned graph and the
+    mapping to the original identifiers. Returns the number of nodes,
+    the number of edges kept, and the number of duplicate edges and
+    self-loops that were dropped.
+
+    Keyword arguments:
+        mapfile     <str>       the mapping file; defaults to
+                                `outfile`.map.
+
+        run_size    <int>       the number of lines sorted in memory
+                                at once.
+
+        tmpdir      <str>       the directory for the sorted runs;
+                                defaults to the system's.
+    """
+
+    if mapfile is None:
+        mapfile = outfile + '.map'
+
+    workdir = tempfile.mkdtemp(prefix='rankmaniac-pre-', dir=tmpdir)
+    try:
+        # Sort the records, dropping duplicates and self-loops, and
+        # count the in-degree of every node
+        cleaned = os.path.join(workdir, 'cleaned')
+        degrees = {}
+        num_edges = duplicates = self_loops = 0
+        with open(cleaned, 'w') as out:
+            prev = None
+            ranked = None
+            for record in external_sort(_records(infile), workdir,
+                                        run_size):
+                src, dst = record.split('\t', 2)[:2]
+                if not dst:
+                    # a node listed twice keeps its first ranks
+                    if src != ranked:
+                        ranked = src
+                        degrees.setdefault(src, 0)
+                        out.write(record)
+                elif record == prev:
+                    duplicates += 1
+                elif src == dst.rstrip('\n'):
+                    self_loops += 1
+                else:
+                    dst = dst.rstrip('\n')
+                    degrees[dst] = degrees.get(dst, 0) + 1
+                    num_edges += 1
+                    out.write(record)
+                prev = record
+
+        # Hubs first; identifiers of equal length sort numerically
+        order = [node for node, degree in
+                 sorted(degrees.items(),
+                        key=lambda item: (-item[1], len(item[0]), item[0]))]
+        width = len(str(max(len(order) - 1, 0)))
+        new_ids = dict([(node, '%0*d' % (width, i))
+                        for i, node in enumerate(order)])
+        del degrees
+
+        with open(mapfile, 'w') as f:
+            for node in order:
+                f.write('%s\t%s\n' % (new_ids[node], node))
+        del order
+
+        def renumbered():
+            for node, rank, neighbors in _groups(cleaned):
+                neighbors = sorted([new_ids[x] for x in neighbors])
+                yield 'NodeId:%s\t%s%s\n' % (new_ids[node], rank,
+                                             ''.join([',' + x
+                                                      for x in neighbors]))
+
+        with open(outfile, 'w') as f:
+            f.writelines(external_sort(renumbered(), workdir, run_size))
+    finally:
+        shutil.rmtree(workdir, True)
+
+    return len(new_ids), num_edges, duplicates, self_loops
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage='%prog [options] infile outfile')
+    parser.add_option('--map',
+                      help='mapping to the original identifiers '
+                           '[<outfile>.map]')
+    parser.add_option('-s', '--run-size', type='int', default=DefaultRunSize,
+                      help='lines sorted in memory at once [%default]')
+    parser.add_option('-t', '--tmpdir',
+                      help='directory for the sorted runs [system default]')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error('expected an input and an output file')
+
+    num_nodes, num_edges, duplicates, self_loops = preprocess_graph(
+        args[0], args[1], options.map, options.run_size, options.tmpdir)
+    print('%d nodes, %d edges; dropped %d duplicate edges and %d '
+          'self-loops' % (num_nodes, num_edges, duplicates, self_loops))
@@ -1,6 +1,9 @@
 """
 Simple wrapper for boto library to connect with AWS.
 
+Special notes:
+    WARNING! Requires Python >= 2.6
+
 Written for the Rankmaniac competition (2013-2014)
 in CS/EE 144: Ideas behind our Networked World
 at the California Institute of Technology.
@@ -10,8 +13,15 @@ Edited by: Max Hirschhorn (maxh@caltech.edu)
 """
 
 import os
+import threading
+from multiprocessing.pool import ThreadPool
 from time import localtime, strftime
 
+try:
+    from hashlib import md5
+except ImportError: # Python 2.4
+    from md5 import md5
+
 # Amazon SDK for EC2
 from boto.ec2.regioninfo import RegionInfo
 
@@ -21,7 +31,61 @@ from boto.emr.step import StreamingStep
 
 # Amazon SDK for S3
 from boto.s3.connection import S3Connection
-from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
+
+DefaultWorkers = 8
+
+def _local_etag(filename, multipart=None, part_size=None):
+    """
+    Returns the ETag that Amazon S3 gives a file once uploaded: the MD5
+    of its contents or, if it is sent in parts of `part_size` bytes
+    (see Rankmaniac.upload()), the MD5 of the MD5s of the parts followed
+    by the number of parts. By default, the file is sent in parts if it
+    is larger than MultipartThreshold.
+    """
+
+    if part_size is None:
+        part_size = Rankmaniac.MultipartPartSize
+    size = os.path.getsize(filename)
+    if multipart is None:
+        multipart = size > Rankmaniac.MultipartThreshold
+
+    whole = md5()
+    digests = []
+    f = open(filename, 'rb')
+    try:
+        for offset in range(0, size, part_size):
+            data = f.read(part_size)
+            whole.update(data)
+            digests.append(md5(data).digest())
+    finally:
+        f.close()
+
+    if not multipart:
+        return whole.hexdigest()
+    return '%s-%d' % (md5(''.join(digests)).hexdigest(), len(digests))
+
+def _read_file(filename):
+    """
+    Returns the contents of a small file.
+    """
+
+    f = open(filename)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _write_file(filename, contents):
+    """
+    Writes a small file.
+    """
+
+    f = open(filename, 'w')
+    try:
+        f.write(contents)
+    finally:
+        f.close()
 
 class RankmaniacError(Exception):
     """General (catch-all) class for exceptions in this module."""
@@ -41,8 +105,24 @@ class Rankmaniac:
     DefaultRegionName = 'us-west-2'
     DefaultRegionEndpoint = 'elasticmapreduce.us-west-2.amazonaws.com'
 
+    # The most steps that RunJobFlow or AddJobFlowSteps accept at once
+    MaxStepsPerCall = 256
+
+    # The most steps that a job flow can hold in all
+    MaxStepsPerJob = 256
+
+    # Files above this size are uploaded in parts of this size
+    MultipartThreshold = 64 * 1024 * 1024
+    MultipartPartSize = 16 * 1024 * 1024
+
+    # The filters of download()
+    DownloadFilters = ('outputs', 'process', 'final', 'failed-logs')
+
+    # Keys are downloaded in reads of this size
+    DownloadChunkSize = 1024 * 1024
+
     def __init__(self, team_id, access_key, secret_key,
-                 bucket='cs144students'):
+                 bucket='cs144students', monitor=None):
         """
         (constructor)
 
@@ -59,6 +139,11 @@ class Rankmaniac:
 
         Keyword arguments:
             bucket        <str>     the S3 bucket name.
+
+            monitor       <JobMonitor>  a monitor shared with the
+                                        other jobs of the account (see
+                                        job_monitor.py), which then
+                                        describes the job instead.
         """
 
         region = RegionInfo(None, self.DefaultRegionName,
@@ -66,10 +151,16 @@ class Rankmaniac:
 
         self._s3_bucket = bucket
         self._s3_conn = S3Connection(access_key, secret_key)
+        self._s3_credentials = (access_key, secret_key)
+        self._local = threading.local() # S3 connections of the threads
+        self._thread_conns = []
+        self._thread_conns_lock = threading.Lock()
         self._emr_conn = EmrConnection(access_key, secret_key, region=region)
 
         self.team_id = team_id
         self.job_id = None
+        self._bucket = None
+        self._monitor = monitor
 
         self._reset()
         self._num_instances = 1
@@ -83,7 +174,10 @@ class Rankmaniac:
         self._infile = None
         self._last_outdir = None
 
-        self._last_process_step_iter_no = -1
+        self._pending_steps = [] # queued by do_iter() for submit()
+        self._pending_outputs = []
+
+        self._probed = {} # keyname: (ETag, size) of the checked outputs
         self._is_done = False
 
     def __del__(self):
@@ -116,40 +210,125 @@ class Rankmaniac:
         self.__del__()
         return False # do not swallow any exceptions
 
-    def upload(self, indir='data'):
+    def upload(self, indir='data', workers=DefaultWorkers):
         """
         Uploads the local data to Amazon S3 under the configured bucket
         and key prefix (the team identifier). This way the code can be
         accessed by Amazon EMR to compute pagerank.
 
+        Files whose MD5 matches the ETag of their key are left alone,
+        so only new and changed files are sent, by a pool of threads.
+        Files larger than MultipartThreshold are sent in parts of
+        MultipartPartSize bytes, which are uploaded concurrently too.
+
+        Returns the names of the files that were uploaded and of those
+        that were unchanged.
+
         Keyword arguments:
             indir       <str>       the base directory from which to
                                     upload contents.
 
+            workers     <int>       the number of upload threads.
+
         Special notes:
             This method only uploads **files** in the specified
             directory. It does not scan through subdirectories.
 
             WARNING! This method removes all previous (or ongoing)
-            submission results, so it is unsafe to call while a job is
+            submission results, along with the uploaded files that no
+            longer exist locally, so it is unsafe to call while a job is
             already running (and possibly started elsewhere).
         """
 
         if self.job_id is not None:
             raise RankmaniacError('A job is already running.')
 
-        bucket = self._s3_conn.get_bucket(self._s3_bucket)
-
-        # Clear out current bucket contents for team
-        keys = bucket.list(prefix=self._get_keyname())
-        bucket.delete_keys(keys)
+        bucket = self._get_bucket()
 
+        local = {}
         for filename in os.listdir(indir):
             relpath = os.path.join(indir, filename)
             if os.path.isfile(relpath):
-                keyname = self._get_keyname(filename)
-                key = bucket.new_key(keyname)
-                key.set_contents_from_filename(relpath)
+                local[self._get_keyname(filename)] = relpath
+
+        # Previous results and removed files are stale, and so are the
+        # keys of files that changed; the unchanged ones are kept
+        stale = []
+        unchanged = set()
+        for key in bucket.list(prefix=self._get_keyname()):
+            relpath = local.get(key.name)
+            if relpath is not None and \
+               key.etag.strip('"') == self._upload_etag(relpath):
+                unchanged.add(key.name)
+            elif key.name not in local:
+                stale.append(key)
+        if stale:
+            bucket.delete_keys(stale)
+
+        tasks = []
+        uploads = []
+        try:
+            for keyname in sorted(local):
+                if keyname in unchanged:
+                    continue
+                relpath = local[keyname]
+                size = os.path.getsize(relpath)
+                if size <= self.MultipartThreshold:
+                    tasks.append((keyname, relpath, None, 0, 0, size))
+                    continue
+
+                upload = bucket.initiate_multipart_upload(keyname)
+                uploads.append(upload)
+                part_size = self.MultipartPartSize
+                for i, offset in enumerate(range(0, size, part_size)):
+                    tasks.append((keyname, relpath, upload.id, i + 1,
+                                  offset, min(part_size, size - offset)))
+
+            self._run_parallel(self._upload_part, tasks, workers)
+            for upload in uploads:
+                upload.complete_upload()
+        except:
+            for upload in uploads:
+                upload.cancel_upload()
+            raise
+
+        uploaded = [os.path.basename(local[keyname])
+                    for keyname in sorted(local) if keyname not in unchanged]
+        unchanged = [os.path.basename(local[keyname])
+                     for keyname in sorted(unchanged)]
+        return uploaded, unchanged
+
+    def _upload_etag(self, relpath):
+        """
+        Returns the ETag of a file once uploaded by upload(), which
+        sends it in parts if it is larger than MultipartThreshold.
+        """
+
+        multipart = os.path.getsize(relpath) > self.MultipartThreshold
+        return _local_etag(relpath, multipart, self.MultipartPartSize)
+
+    def _upload_part(self, task):
+        """
+        Uploads a whole file, or a part of a multipart upload, from a
+        worker thread.
+        """
+
+        keyname, relpath, upload_id, part_num, offset, size = task
+        bucket = self._get_thread_bucket()
+
+        if upload_id is None:
+            bucket.new_key(keyname).set_contents_from_filename(relpath)
+            return
+
+        upload = MultiPartUpload(bucket)
+        upload.key_name = keyname
+        upload.id = upload_id
+        f = open(relpath, 'rb')
+        try:
+            f.seek(offset)
+            upload.upload_part_from_file(f, part_num, size=size)
+        finally:
+            f.close()
 
     def set_infile(self, filename):
         """
@@ -165,13 +344,67 @@ class Rankmaniac:
     def do_iter(self, pagerank_mapper, pagerank_reducer,
                 process_mapper, process_reducer,
                 pagerank_output=None, process_output=None,
-                num_pagerank_mappers=1, num_pagerank_reducers=1):
+                num_pagerank_mappers=1, num_pagerank_reducers=1,
+                cache_files=None, pagerank_combiner=None,
+                process_combiner=None, iters_per_step=1, cmdenv=None,
+                pagerank_partitioner=None, num_process_mappers=1,
+                num_process_reducers=1, submit=True):
         """
         Adds a pagerank step and a process step to the current job.
-        """
 
-        num_process_mappers = 1
-        num_process_reducers = 1
+        Each call to Amazon EMR can add a limited number of steps, and
+        is limited in frequency, so when adding many iterations it is
+        much faster to queue them with `submit` set to False and then
+        submit them all at once with submit().
+
+        Keyword arguments:
+            pagerank_combiner   <str>       the combiner of the pagerank
+                                            step, which runs on the
+                                            output of each mapper.
+
+            process_combiner    <str>       the combiner of the process
+                                            step.
+
+            cache_files         <list(str)> uploaded files (such as
+                                            modules shared by the
+                                            scripts) to place in the
+                                            working directory of every
+                                            map and reduce task.
+
+            iters_per_step      <int>       the number of pagerank
+                                            iterations to run within
+                                            the pagerank step, exported
+                                            to the tasks as the
+                                            ITERS_PER_STEP environment
+                                            variable (see
+                                            pagerank_block_reduce.py).
+
+            cmdenv              <dict>      environment variables to
+                                            set for the tasks of both
+                                            steps, such as the stopping
+                                            rule of the process step.
+
+            pagerank_partitioner <str>      the split points (without
+                                            their extension) written by
+                                            reorder_graph.py; the
+                                            pagerank step then sends
+                                            contiguous ranges of nodes
+                                            to each reducer.
+
+            num_process_mappers <int>       the number of mappers of the
+                                            process step.
+
+            num_process_reducers <int>      the number of reducers of
+                                            the process step, which all
+                                            receive the convergence
+                                            summaries (see
+                                            process_reduce.py).
+
+            submit              <bool>      whether to submit the steps
+                                            right away (after any that
+                                            were queued), or only queue
+                                            them for submit().
+        """
 
         if self._iter_no == 0:
             pagerank_input = self._infile
@@ -187,35 +420,91 @@ class Rankmaniac:
         if process_output is None:
             process_output = self._get_default_outdir('process')
 
+        # The steps know their number, for EXTRAPOLATE (see
+        # pagerank_codec.py), and how many iterations each one runs,
+        # for the stopping rule (see process_reduce.py)
+        process_cmdenv = dict(cmdenv or {})
+        process_cmdenv['ITERATION'] = self._iter_no
+        process_cmdenv['ITERS_PER_STEP'] = iters_per_step
+        pagerank_cmdenv = dict(process_cmdenv)
+
+        # The scripts read the split points as text, and Hadoop's
+        # TotalOrderPartitioner reads them as a SequenceFile
+        pagerank_cache_files = cache_files
+        partition_file = None
+        if pagerank_partitioner is not None:
+            splits = pagerank_partitioner + '.txt'
+            pagerank_cache_files = list(cache_files or []) + [splits]
+            pagerank_cmdenv['RANGE_PARTITIONS'] = os.path.basename(splits)
+            partition_file = pagerank_partitioner + '.seq'
+
         pagerank_step = self._make_step(pagerank_mapper, pagerank_reducer,
                                         pagerank_input, pagerank_output,
                                         num_pagerank_mappers,
-                                        num_pagerank_reducers)
+                                        num_pagerank_reducers,
+                                        combiner=pagerank_combiner,
+                                        cache_files=pagerank_cache_files,
+                                        cmdenv=pagerank_cmdenv,
+                                        partition_file=partition_file)
 
         process_step = self._make_step(process_mapper, process_reducer,
                                        process_input, process_output,
                                        num_process_mappers,
-                                       num_process_reducers)
+                                       num_process_reducers,
+                                       combiner=process_combiner,
+                                       cache_files=cache_files,
+                                       cmdenv=process_cmdenv)
 
         steps = [pagerank_step, process_step]
-        if self.job_id is None:
-            self._submit_new_job(steps)
+        outputs = [pagerank_output, process_output]
+        if submit:
+            self.submit()
+            self._clear_outputs(outputs)
+            self._submit_steps(steps)
         else:
-            self._emr_conn.add_jobflow_steps(self.job_id, steps)
+            self._pending_steps.extend(steps)
+            self._pending_outputs.extend(outputs)
 
         # Store `process_output` directory so it can be used in
         # subsequent iteration
         self._last_outdir = process_output
         self._iter_no += 1
 
+    def submit(self):
+        """
+        Submits the steps queued by do_iter(), in as few calls to Amazon
+        EMR as possible: the job is started with the first
+        MaxStepsPerCall steps, and the rest are added MaxStepsPerCall at
+        a time. The outputs of all the queued steps are cleared first,
+        in a single pass.
+
+        Special notes:
+            If a call fails (e.g. with an EmrResponseError when Amazon
+            throttles the requests), the steps that were not submitted
+            stay queued, so calling this method again resumes.
+        """
+
+        if self._pending_outputs:
+            self._clear_outputs(self._pending_outputs)
+            self._pending_outputs = []
+
+        while self._pending_steps:
+            steps = self._pending_steps[:self.MaxStepsPerCall]
+            self._submit_steps(steps)
+            del self._pending_steps[:len(steps)]
+
     def is_done(self):
         """
         Returns `True` if the map-reduce job is done, and `False`
         otherwise.
 
-        For all process-step output files that have not been fetched,
-        gets the first part of the output file, and checks whether its
-        contents begins with the string 'FinalRank'.
+        Lists the outputs of the team once, and for every first part of
+        a process-step output that is new (or whose ETag or size has
+        changed) since the last call, gets its first few bytes and
+        checks whether they begin with the string 'FinalRank'. The
+        newest outputs are checked first, so a call costs one listing
+        and usually one small ranged GET, however many iterations have
+        completed.
 
         Special notes:
             WARNING! The usage of this method in your code requires that
@@ -228,20 +517,23 @@ class Rankmaniac:
         if self._is_done:
             return True
 
-        iter_no = self._get_last_process_step_iter_no()
-        if iter_no < 0:
-            return False
-
-        while self._last_process_step_iter_no < iter_no:
-            self._last_process_step_iter_no += 1
-            i = self._last_process_step_iter_no
+        outputs = []
+        for key in self._list_outputs():
+            parts = key.name.split('/')[1:]
+            if parts[1:] != ['process', 'part-00000']:
+                continue
+            i = parts[0]
 
-            outdir = self._get_default_outdir('process', iter_no=i)
-            keyname = self._get_keyname(outdir, 'part-00000')
+            # Empty outputs cannot begin with 'FinalRank'
+            version = (key.etag, key.size)
+            if key.size and self._probed.get(key.name) != version:
+                outputs.append((int(i), key, version))
 
-            bucket = self._s3_conn.get_bucket(self._s3_bucket)
-            key = Key(bucket=bucket, name=keyname)
-            contents = key.next() # get first chunk of the output file
+        outputs.sort(reverse=True)
+        headers = {'Range': 'bytes=0-%d' % (len('FinalRank') - 1)}
+        for i, key, version in outputs:
+            contents = key.get_contents_as_string(headers=headers)
+            self._probed[key.name] = version
 
             if contents.startswith('FinalRank'):
                 self._is_done = True # cache result
@@ -249,6 +541,52 @@ class Rankmaniac:
 
         return self._is_done
 
+    def _list_outputs(self):
+        """
+        Yields the keys of the step outputs ('iter_no/name/...') of the
+        team in a single listing. The keys are listed in byte order, so
+        the listing starts just before the first key that begins with a
+        digit ('/' sorts right before '0'), skips any other key before
+        the last of them, and stops at the first key after them (such
+        as an uploaded file or the logs).
+        """
+
+        prefix = self._get_keyname()
+        bucket = self._get_bucket()
+        for key in bucket.list(prefix=prefix, marker=prefix + '/'):
+            first = key.name[len(prefix):][:1]
+            if first.isdigit():
+                yield key
+            elif first > '9':
+                break
+
+    def _clear_outputs(self, outputs):
+        """
+        Deletes the current contents of the output directories. The
+        default directories ('iter_no/name/') are all found in a single
+        listing of the team's outputs, and any others are listed one by
+        one.
+        """
+
+        bucket = self._get_bucket()
+
+        defaults = set()
+        keys = []
+        for output in outputs:
+            parts = output.split('/')
+            if len(parts) == 3 and parts[0].isdigit() and not parts[2]:
+                defaults.add(self._get_keyname(output))
+            else:
+                keys.extend(bucket.list(prefix=self._get_keyname(output)))
+
+        if defaults:
+            for key in self._list_outputs():
+                if '/'.join(key.name.split('/')[:3]) + '/' in defaults:
+                    keys.append(key)
+
+        if keys:
+            bucket.delete_keys(keys)
+
     def is_alive(self):
         """
         Checks whether the jobflow has completed, failed, or been
@@ -276,38 +614,171 @@ class Rankmaniac:
             raise RankmaniacError('No job is running.')
 
         self._emr_conn.terminate_jobflow(self.job_id)
+        if self._monitor is not None:
+            self._monitor.unwatch(self.job_id)
         self.job_id = None
 
         self._reset()
 
-    def download(self, outdir='results'):
+    def download(self, outdir='results', workers=DefaultWorkers,
+                 filters=None):
         """
-        Downloads the results from Amazon S3 to the local directory.
+        Downloads the results from Amazon S3 to the local directory,
+        with a pool of threads.
+
+        Files that are already complete locally (same size and, unless
+        the key was uploaded in parts, same MD5 as its ETag) are
+        skipped, and interrupted downloads resume from where they
+        stopped: every key is first written to '<filename>.part', with
+        its ETag in '<filename>.part.etag', and renamed once complete
+        and checked against the ETag. A partial file is only resumed
+        for the same ETag, and restarted otherwise.
+
+        Returns the names of the files that were downloaded and of those
+        that were already complete.
 
         Keyword arguments:
             outdir      <str>       the base directory to which to
                                     download contents.
 
-        Special notes:
-            This method downloads all keys (files) from the configured
-            bucket for this particular team. It creates subdirectories
-            as needed.
-        """
+            workers     <int>       the number of download threads.
 
-        bucket = self._s3_conn.get_bucket(self._s3_bucket)
-        keys = bucket.list(prefix=self._get_keyname())
-        for key in keys:
-            keyname = key.name
-            # Ignore folder keys
-            if '$' not in keyname:
-                suffix = keyname.split('/')[1:] # removes team identifier
-                filename = os.path.join(outdir, *suffix)
-                dirname = os.path.dirname(filename)
+            filters     <list(str)> download only the keys that match
+                                    all of these filters, among
+                                        outputs         step outputs
+                                        process         process-step
+                                                        outputs
+                                        final           outputs of the
+                                                        final iteration
+                                        failed-logs     logs of the
+                                                        failed steps
+                                                        (of the running
+                                                        job)
 
-                if not os.path.exists(dirname):
-                    os.makedirs(dirname)
+        Special notes:
+            Without filters, this method downloads all keys (files) from
+            the configured bucket for this particular team. It creates
+            subdirectories as needed.
+        """
+
+        filters = list(filters or [])
+        for name in filters:
+            if name not in self.DownloadFilters:
+                raise RankmaniacError('Unknown download filter %r.'
+                                      % (name))
+
+        failed = []
+        if 'failed-logs' in filters:
+            steps = self.describe().steps
+            failed = ['job_logs/%s/steps/%d/' % (self.job_id, i + 1)
+                      for i, step in enumerate(steps)
+                      if step.state == 'FAILED']
+
+        prefix = self._get_keyname()
+        keys = []
+        final = None
+        for key in self._get_bucket().list(prefix=prefix):
+            # Ignore folder keys
+            if '$' in key.name:
+                continue
+            parts = key.name[len(prefix):].split('/')
+            if parts[0].isdigit() and len(parts) > 2:
+                final = max(final, int(parts[0]))
+            keys.append((parts, key))
+
+        tasks = []
+        for parts, key in keys:
+            is_output = parts[0].isdigit() and len(parts) > 2
+            if 'outputs' in filters and not is_output:
+                continue
+            if 'process' in filters and \
+               not (is_output and parts[1] == 'process'):
+                continue
+            if 'final' in filters and \
+               not (is_output and int(parts[0]) == final):
+                continue
+            if 'failed-logs' in filters and \
+               not [p for p in failed if '/'.join(parts).startswith(p)]:
+                continue
+
+            filename = os.path.join(outdir, *parts)
+            dirname = os.path.dirname(filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            tasks.append((key.name, filename, key.size, key.etag.strip('"')))
+
+        results = self._run_parallel(self._download_key, tasks, workers)
+
+        downloaded = []
+        complete = []
+        for task, fetched in zip(tasks, results):
+            if fetched:
+                downloaded.append(task[1])
+            else:
+                complete.append(task[1])
+        return downloaded, complete
+
+    def _download_key(self, task):
+        """
+        Downloads a key to a file from a worker thread, resuming from an
+        earlier partial download. Returns `False` if the file was already
+        complete, and `True` otherwise.
+        """
+
+        keyname, filename, size, etag = task
+        if os.path.exists(filename) and os.path.getsize(filename) == size \
+           and ('-' in etag or _local_etag(filename, False) == etag):
+            return False
 
-                key.get_contents_to_filename(filename)
+        # The ETag of the key being downloaded is kept next to the
+        # partial file, which is only resumed for the same ETag
+        partial = filename + '.part'
+        tag = partial + '.etag'
+        offset = 0
+        if os.path.exists(partial) and os.path.exists(tag) and \
+           _read_file(tag) == etag and os.path.getsize(partial) <= size:
+            offset = os.path.getsize(partial)
+        else:
+            _write_file(tag, etag)
+
+        if offset == 0 or offset < size:
+            key = self._get_thread_bucket().new_key(keyname)
+            headers = None
+            mode = 'wb'
+            if offset:
+                headers = {'Range': 'bytes=%d-' % (offset),
+                           'If-Range': '"%s"' % (etag)}
+                mode = 'ab'
+            f = open(partial, mode)
+            try:
+                key.open_read(headers=headers)
+                try:
+                    # The whole key comes back (200 rather than 206) if
+                    # it has changed since the partial download
+                    if offset and key.resp.status != 206:
+                        f.seek(0)
+                        f.truncate()
+                    while True:
+                        data = key.read(self.DownloadChunkSize)
+                        if not data:
+                            break
+                        f.write(data)
+                finally:
+                    key.close()
+            finally:
+                f.close()
+
+        # Check the whole file before it replaces anything
+        if os.path.getsize(partial) != size or \
+           ('-' not in etag and _local_etag(partial, False) != etag):
+            os.remove(partial)
+            os.remove(tag)
+            raise RankmaniacError('Downloaded %s does not match its ETag.'
+                                  % (keyname))
+
+        os.rename(partial, filename)
+        os.remove(tag)
+        return True
 
     def describe(self):
         """
@@ -339,31 +810,67 @@ class Rankmaniac:
 
             WARNING! Amazon has an upper-limit on the frequency with
             which you can call this method; we have had success with
-            calling it at most once every 10 seconds.
+            calling it at most once every 10 seconds. With a monitor,
+            this returns its latest description without calling Amazon
+            EMR, and can be called as often as needed; the monitor only
+            calls Amazon EMR itself when it has no description in time.
         """
 
         if not self.job_id:
             raise RankmaniacError('No job is running.')
 
+        if self._monitor is not None:
+            return self._monitor.describe(self.job_id)
         return self._emr_conn.describe_jobflow(self.job_id)
 
-    def _get_last_process_step_iter_no(self):
+    def _get_bucket(self):
         """
-        Returns the most recently process-step of the job flow that has
-        been completed.
+        Returns the S3 bucket of the submissions, which is looked up
+        only once.
         """
 
-        steps = self.describe().steps
-        i = 1
+        if self._bucket is None:
+            self._bucket = self._s3_conn.get_bucket(self._s3_bucket)
+        return self._bucket
 
-        while i < len(steps):
-            step = steps[i]
-            if step.state != 'COMPLETED':
-                break
+    def _get_thread_bucket(self):
+        """
+        Returns the S3 bucket of the submissions through a connection of
+        the calling thread, as the connections are not thread-safe.
+        """
 
-            i += 2
+        bucket = getattr(self._local, 'bucket', None)
+        if bucket is None:
+            conn = S3Connection(*self._s3_credentials)
+            self._thread_conns_lock.acquire()
+            try:
+                self._thread_conns.append(conn)
+            finally:
+                self._thread_conns_lock.release()
+            bucket = self._local.bucket = conn.get_bucket(self._s3_bucket,
+                                                          validate=False)
+        return bucket
 
-        return i / 2 - 1
+    def _run_parallel(self, func, tasks, workers):
+        """
+        Calls `func` on every task from a pool of `workers` threads, and
+        returns the results in order. Raises the first exception of any
+        call. The S3 connections opened by the threads are closed once
+        they are done.
+        """
+
+        if not tasks:
+            return []
+        pool = ThreadPool(max(1, min(workers, len(tasks))))
+        try:
+            return pool.map(func, tasks)
+        finally:
+            pool.close()
+            pool.join()
+            for conn in self._thread_conns:
+                conn.close()
+            self._thread_conns = []
+            self._local = threading.local()
 
     def _get_default_outdir(self, name, iter_no=None):
         """
@@ -376,6 +883,17 @@ class Rankmaniac:
         # Return iter_no/name/ **with** the trailing slash
         return '%s/%s/' % (iter_no, name)
 
+    def _submit_steps(self, steps):
+        """
+        Submits steps to Amazon EMR, starting the job with them if it
+        is not running yet.
+        """
+
+        if self.job_id is None:
+            self._submit_new_job(steps)
+        else:
+            self._emr_conn.add_jobflow_steps(self.job_id, steps)
+
     def _submit_new_job(self, steps):
         """
         Submits a new job to run on Amazon EMR.
@@ -391,29 +909,51 @@ class Rankmaniac:
                                                  steps=steps,
                                                  num_instances=num_instances,
                                                  log_uri=log_uri)
+        if self._monitor is not None:
+            self._monitor.watch(self.job_id)
 
     def _make_step(self, mapper, reducer, input, output,
-                   num_mappers=1, num_reducers=1):
+                   num_mappers=1, num_reducers=1, combiner=None,
+                   cache_files=None, cmdenv=None, partition_file=None):
         """
-        Returns a new step that runs the specified mapper and reducer,
-        reading from the specified input and writing to the specified
-        output.
+        Returns a new step that runs the specified mapper and reducer
+        (and combiner, if any), reading from the specified input and
+        writing to the specified output. Each of the `cache_files` is
+        symlinked under its own name in the working directory of the
+        tasks, and each entry of `cmdenv` is set in their environment.
+        If a `partition_file` of split points is given, the map output
+        is range-partitioned by Hadoop's TotalOrderPartitioner.
         """
 
-        bucket = self._s3_conn.get_bucket(self._s3_bucket)
-
-        # Clear out current bucket/output contents for team
-        keys = bucket.list(prefix=self._get_keyname(output))
-        bucket.delete_keys(keys)
-
         step_name = self._make_name()
         step_args = ['-jobconf', 'mapred.map.tasks=%d' % (num_mappers),
                      '-jobconf', 'mapred.reduce.tasks=%d' % (num_reducers)]
 
+        if cmdenv is not None:
+            for name in sorted(cmdenv):
+                step_args.extend(['-cmdenv', '%s=%s' % (name, cmdenv[name])])
+
+        if partition_file is not None:
+            step_args.extend([
+                '-partitioner',
+                'org.apache.hadoop.mapred.lib.TotalOrderPartitioner',
+                '-jobconf', 'total.order.partitioner.path=%s'
+                            % (self._get_s3_team_uri(partition_file))])
+
+        if combiner is not None:
+            combiner = self._get_s3_team_uri(combiner)
+
+        if cache_files is not None:
+            cache_files = ['%s#%s' % (self._get_s3_team_uri(filename),
+                                      os.path.basename(filename))
+                           for filename in cache_files]
+
         return StreamingStep(name=step_name,
                             step_args=step_args,
+                            cache_files=cache_files,
                             mapper=self._get_s3_team_uri(mapper),
                             reducer=self._get_s3_team_uri(reducer),
+                            combiner=combiner,
                             input=self._get_s3_team_uri(input),
                             output=self._get_s3_team_uri(output))
 
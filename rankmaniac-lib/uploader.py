@@ -2,7 +2,7 @@
 Utility to execute map-reduce jobs on Amazon EMR.
 
 Special notes:
-    WARNING! Requires Python >= 2.5
+    WARNING! Requires Python >= 2.6
 
 Written for the Rankmaniac competition (2014)
 in CS/EE 144: Ideas behind our Networked World
@@ -19,14 +19,19 @@ from time import sleep
 
 from boto.exception import EmrResponseError
 from rankmaniac import Rankmaniac
+from partition_graph import list_parts
+from hot_keys import detect_hot_keys
+from preprocess_graph import preprocess_graph
 
 unbuff_stdout = os.fdopen(sys.stdout.fileno(), 'w', 0) # unbuffered
 
 def do_main(team_id, access_key, secret_key,
-            infile='input.txt', max_iter=50):
+            infile='input.txt', max_iter=50, monitor=None):
     """
     Submits a new map-reduce job to Amazon EMR and waits for it to
-    finish executing.
+    finish executing. Jobs run at the same time (e.g. from several
+    threads) should share one `monitor` (see job_monitor.py), which
+    polls all of them together within the request limits of Amazon.
     """
 
     # Ensure that the input file exists
@@ -39,6 +44,16 @@ def do_main(team_id, access_key, secret_key,
     pagerank_reduce = 'pagerank_reduce.py'
     process_map = 'process_map.py'
     process_reduce = 'process_reduce.py'
+    pagerank_combine = None
+    cache_files = None
+    iters_per_step = 1
+    pagerank_partitioner = None
+    hot_keys = None
+    preprocess = None
+    download_filters = None
+    num_process_mappers = 1
+    num_process_reducers = 1
+    cmdenv = {}
 
     # Read the configuration and override defaults
     config = ConfigParser.SafeConfigParser()
@@ -50,24 +65,108 @@ def do_main(team_id, access_key, secret_key,
         pagerank_reduce = config.get(section, 'pagerank_reduce')
         process_map = config.get(section, 'process_map')
         process_reduce = config.get(section, 'process_reduce')
+        if config.has_option(section, 'pagerank_combine'):
+            pagerank_combine = config.get(section, 'pagerank_combine')
+        if config.has_option(section, 'cache_files'):
+            cache_files = config.get(section, 'cache_files').split()
+        if config.has_option(section, 'iters_per_step'):
+            iters_per_step = config.getint(section, 'iters_per_step')
+        if config.has_option(section, 'pagerank_partitioner'):
+            pagerank_partitioner = config.get(section,
+                                              'pagerank_partitioner')
+        if config.has_option(section, 'hot_keys'):
+            hot_keys = config.get(section, 'hot_keys')
+        if config.has_option(section, 'preprocess'):
+            preprocess = config.get(section, 'preprocess')
+        if config.has_option(section, 'download'):
+            download_filters = config.get(section, 'download').split()
+        if config.has_option(section, 'num_process_mappers'):
+            num_process_mappers = config.getint(section,
+                                                'num_process_mappers')
+        if config.has_option(section, 'num_process_reducers'):
+            num_process_reducers = config.getint(section,
+                                                 'num_process_reducers')
+
+    # Only the block scripts run several iterations in one step; the
+    # others would silently run fewer iterations than asked for
+    if iters_per_step > 1 and pagerank_reduce != 'pagerank_block_reduce.py':
+        raise Exception('iters_per_step = %d needs pagerank_block_reduce.py'
+                        % (iters_per_step))
+
+    # Every option in the environment section is exported to the tasks
+    section = 'Environment'
+    if config.has_section(section):
+        for name in config.options(section):
+            cmdenv[name.upper()] = config.get(section, name)
+
+    # In schimmy mode the reducers also need the partitions of the
+    # static graph, written by partition_graph.py
+    prefix = cmdenv.get('SCHIMMY_GRAPH')
+    if prefix:
+        cache_files = (cache_files or []) + list_parts('data', prefix)
+
+    # Clean and renumber the input once, before anything else reads it;
+    # the 'FinalRank' lines are mapped back to the original identifiers
+    if preprocess is not None:
+        preprocess_graph(os.path.join('data', infile),
+                         os.path.join('data', preprocess))
+        infile = preprocess
+        cache_files = list(cache_files or []) + [preprocess + '.map']
+        cmdenv['NODE_MAP'] = preprocess + '.map'
+
+    # A graph renumbered by reorder_graph.py comes with its node map,
+    # which the process step needs for the 'FinalRank' lines
+    node_map = infile + '.map'
+    if 'NODE_MAP' not in cmdenv and \
+           os.path.isfile(os.path.join('data', node_map)):
+        cache_files = list(cache_files or []) + [node_map]
+        cmdenv['NODE_MAP'] = os.path.basename(node_map)
+
+    # Salt the hot keys, detected from the input before it is uploaded
+    if hot_keys is not None:
+        detect_hot_keys(os.path.join('data', infile),
+                        os.path.join('data', hot_keys))
+        cache_files = (cache_files or []) + [hot_keys]
+        cmdenv['HOT_KEYS'] = hot_keys
+
+    # Each step runs `iters_per_step` iterations, and every one of them
+    # adds a pagerank step and a process step to the job flow
+    num_steps = (max_iter + iters_per_step - 1) // iters_per_step
+    if 2 * num_steps > Rankmaniac.MaxStepsPerJob:
+        raise Exception('%d iterations need %d steps, but a job flow holds '
+                        'at most %d' % (max_iter, 2 * num_steps,
+                                        Rankmaniac.MaxStepsPerJob))
+    cmdenv['MAX_ITER'] = num_steps
 
     # Terminates the job and closes connections upon leaving this block
-    with Rankmaniac(team_id, access_key, secret_key) as r:
+    with Rankmaniac(team_id, access_key, secret_key, monitor=monitor) as r:
         r.set_infile(infile)
         print('Uploading...')
-        r.upload()
-        print('Uploaded')
-
-        print('Adding %d iterations...' % (max_iter))
-        for i in range(max_iter):
-            while True:
-                try:
-                    unbuff_stdout.write('.')
-                    r.do_iter(pagerank_map, pagerank_reduce,
-                              process_map, process_reduce)
-                    break
-                except EmrResponseError:
-                    sleep(10) # call Amazon APIs infrequently
+        uploaded, unchanged = r.upload()
+        print('Uploaded %d files (%d unchanged)'
+              % (len(uploaded), len(unchanged)))
+
+        # Queue every iteration, then submit them in as few calls as
+        # possible; a failed call leaves the rest queued for the retry
+        print('Adding %d steps...' % (num_steps))
+        for i in range(num_steps):
+            r.do_iter(pagerank_map, pagerank_reduce,
+                      process_map, process_reduce,
+                      cache_files=cache_files,
+                      pagerank_combiner=pagerank_combine,
+                      iters_per_step=iters_per_step,
+                      cmdenv=cmdenv,
+                      pagerank_partitioner=pagerank_partitioner,
+                      num_process_mappers=num_process_mappers,
+                      num_process_reducers=num_process_reducers,
+                      submit=False)
+        while True:
+            try:
+                unbuff_stdout.write('.')
+                r.submit()
+                break
+            except EmrResponseError:
+                sleep(10) # call Amazon APIs infrequently
         print('')
 
         print('Waiting for map-reduce job to finish...')
@@ -91,8 +190,9 @@ def do_main(team_id, access_key, secret_key,
 
         print('Terminating...')
         print('  Downloading...')
-        r.download()
-        print('  Downloaded')
+        downloaded, complete = r.download(filters=download_filters)
+        print('  Downloaded %d files (%d already complete)'
+              % (len(downloaded), len(complete)))
 
     print('Terminated')
 